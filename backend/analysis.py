@@ -0,0 +1,291 @@
+"""
+Media analysis shared by /predict, /jobs, /predict/batch and the bulk CLI:
+picks the detector for an ingested upload, consults the result cache and
+returns the verdict.
+"""
+import datetime
+import os
+
+import numpy as np
+
+from audio_utils import (preprocess_audio, predict_audio, audio_model_version,
+                         evaluate_audio_stream, AUDIO_MAX_SEGMENTS, AUDIO_DECODE_MODE, AUDIO_ANALYSIS_MODE)
+from batching import BatcherOverloaded
+from metrics import request_trace, set_model_version, stage
+from model_workers import model_available, version_settled
+from result_cache import get_result_cache, make_cache_key
+
+
+def _audio_options(audio_mode=None, full_audio=False):
+    """Resolve the audio analysis mode; full-file analysis always streams"""
+    mode = "stream" if full_audio else (audio_mode or AUDIO_ANALYSIS_MODE).lower()
+    return mode if mode in ("batch", "stream") else "batch"
+
+
+def _model_version(upload):
+    """Version tag of the model serving an upload kind (artifact name + checksum)"""
+    if upload.kind == "audio":
+        return audio_model_version()
+    if upload.kind == "image":
+        from image_utils import image_model_version
+        return image_model_version()
+    if upload.kind == "video":
+        from video_utils import video_model_version
+        return video_model_version()
+    return None
+
+
+def _result_cache_key(upload, model_version, audio_mode="batch", full_audio=False):
+    """Cache key for an upload: content hash + model version + preprocessing params"""
+    if not version_settled(model_version):
+        # Workers still starting, or mid-reload with the verdict from either artifact
+        return None
+    if upload.kind == "audio":
+        return make_cache_key(upload.sha256, "audio", model_version,
+                              max_segments="all" if full_audio else AUDIO_MAX_SEGMENTS,
+                              decode=AUDIO_DECODE_MODE, mode=audio_mode)
+    if upload.kind == "image":
+        from image_utils import IMAGE_TARGET_SIZE
+        # The sparkle check always runs first, so the model input comes from a full-size decode
+        return make_cache_key(upload.sha256, "image", model_version, target_size=IMAGE_TARGET_SIZE[0])
+    if upload.kind == "video":
+        from video_utils import VIDEO_NUM_FRAMES
+        from frame_sampler import VIDEO_FRAME_SAMPLER
+        # "keyframe" samples different frames than seek/scan, so it can give a different verdict
+        return make_cache_key(upload.sha256, "video", model_version, num_frames=VIDEO_NUM_FRAMES,
+                              sampler=VIDEO_FRAME_SAMPLER)
+    return None
+
+
+def analyze_upload(upload, progress_callback=None, audio_mode=None, full_audio=False):
+    """
+    Run the detector matching an ingested upload.
+    Returns {"label", "confidence", "detail", "cached", "model_version"} or an {"error": ...} dict.
+    `progress_callback(done, total)` is forwarded to the video analyzer.
+    `audio_mode` ("batch" / "stream") and `full_audio` select the audio evaluator.
+    Stage timings are recorded per request (see metrics).
+    """
+    with request_trace(upload.kind) as trace:
+        result = _analyze(upload, progress_callback, audio_mode, full_audio)
+        if trace is not None:
+            trace.outcome = "error" if "error" in result else "cached" if result["cached"] else "ok"
+        return result
+
+
+def _analyze(upload, progress_callback, audio_mode, full_audio):
+    content_type = upload.content_type
+    audio_mode = _audio_options(audio_mode, full_audio)
+    label = "PROCESSING_ERROR"
+    confidence = 0.0
+    detection_detail = None
+
+    # Same bytes + same model version + same preprocessing => same verdict
+    cache = get_result_cache()
+    cache_key = None
+    cached = None
+    model_version = None
+    try:
+        model_version = _model_version(upload)
+        set_model_version(model_version)
+        cache_key = _result_cache_key(upload, model_version, audio_mode, full_audio)
+        if cache_key:
+            cached = cache.get(cache_key)
+    except Exception as e:
+        print(f"Result cache lookup failed: {e}")
+
+    try:
+        if cached is not None:
+            print(f"Result cache hit for {upload.sha256[:12]}")
+            label = cached["label"]
+            confidence = cached["confidence"]
+            detection_detail = cached.get("detail")
+        elif content_type.startswith("audio/"):
+            # Audio Prediction Logic
+            print("Processing Audio...")
+            # Preloaded by the model registry (or loaded now in lazy mode)
+            model = model_available("audio")
+            if model:
+                if audio_mode == "stream":
+                    # Score small batches and stop once the verdict is confident
+                    stream_result = evaluate_audio_stream(
+                        upload.source(), max_segments=None if full_audio else AUDIO_MAX_SEGMENTS
+                    )
+                    if stream_result is None:
+                        print("Feature extraction failed.")
+                        return {"error": "Could not extract features"}
+                    avg_probs = stream_result["probs"]
+                    detection_detail = (f"Scored {stream_result['segments']} of {stream_result['total_segments']} segments"
+                                        + (" (early exit)" if stream_result["early_exit"] else ""))
+                    print(detection_detail)
+                else:
+                    batch = preprocess_audio(upload.source()) # [N, 128, 109, 1]
+                    if batch is None or not len(batch):
+                        print("Feature extraction failed.")
+                        return {"error": "Could not extract features"}
+                    print(f"Analyzing {len(batch)} audio segments (Batch shape: {batch.shape})...")
+                    
+                    try:
+                        probs = predict_audio(batch) # [N, 2]
+                        # Average probabilities across all segments
+                        avg_probs = np.mean(probs, axis=0)
+                    except Exception as e:
+                         print(f"Model prediction error: {e}")
+                         raise e
+
+                print(f"AVERAGE PREDICTION (Probs): {avg_probs}")
+                
+                fake_prob = float(avg_probs[0])
+                real_prob = float(avg_probs[1])
+                
+                if real_prob > fake_prob:
+                    label = "REAL"
+                    confidence = real_prob
+                else:
+                    label = "FAKE"
+                    confidence = fake_prob
+
+                print(f"Result: {label} (REAL_PROB: {real_prob:.4f}, FAKE_PROB: {fake_prob:.4f})")
+            else:
+                print("Audio model refused to load.")
+                return {"error": "model_not_loaded", "detail": "Audio model could not be loaded. Check server logs and model file."}
+
+        elif content_type.startswith("image/"):
+            # Image Prediction Logic
+            print("Processing Image...")
+            from image_utils import (
+                DecodedImage, preprocess_image, check_ai_watermark, predict_image, local_image_model_version,
+                HF_IMAGE_MODEL
+            )
+
+            # Decoded once; the watermark check and the model share the pixels
+            source = upload.source()
+            try:
+                image = DecodedImage(source)
+            except Exception as e:
+                # Not decodable by PIL: the checks below report it as before
+                print(f"Image decode error: {e}")
+                image = source
+
+            try:
+                # 1. First check for AI watermarks (Gemini/Google)
+                is_ai, water_conf, reason = check_ai_watermark(image)
+                if is_ai:
+                    print(f"Watermark Detection: {reason}")
+                    label = "FAKE"
+                    confidence = water_conf
+                    detection_detail = reason
+                else:
+                    # 2. Falling back to ML model if no metadata watermark found
+                    hf_token = os.getenv("HUGGINGFACE_API_TOKEN")
+                    if hf_token:
+                        print("Hugging Face API token found. Using Hugging Face InferenceClient...")
+                        try:
+                            from huggingface_hub import InferenceClient
+                            client = InferenceClient(token=hf_token)
+                            with stage("model_forward"):
+                                result = client.image_classification(upload.read_bytes(), model=HF_IMAGE_MODEL)
+                            print(f"HF API Response: {result}")
+                            if result and len(result) > 0:
+                                top_pred = result[0]
+                                pred_label = getattr(top_pred, "label", None) or (top_pred.get("label", "") if isinstance(top_pred, dict) else "")
+                                pred_score = getattr(top_pred, "score", None) or (top_pred.get("score", 0.0) if isinstance(top_pred, dict) else 0.0)
+                                label = "REAL" if "real" in str(pred_label).lower() else "FAKE"
+                                confidence = float(pred_score)
+                            else:
+                                print(f"Unexpected HF API response format: {result}")
+                                return {"error": "hf_api_error", "detail": "Unexpected response from Hugging Face API"}
+                        except Exception as e:
+                            print(f"Error calling Hugging Face API: {e}")
+                            # Fallback to local model (result no longer matches the HF cache key)
+                            hf_token = None
+                            cache_key = None
+                            model_version = local_image_model_version()
+                            set_model_version(model_version)
+
+                    # If HF token is not present or API failed, use local model
+                    if not hf_token:
+                        model = model_available("image")
+                        if model:
+                            print("Image Model loaded. Preprocessing...")
+                            img_tensor = preprocess_image(image)
+                            if img_tensor is not None:
+                                print(f"Image processed: {img_tensor.shape}. Predicting...")
+                                pred = predict_image(img_tensor)
+                                print(f"Prediction raw: {pred}")
+
+                                # Assume binary sigmoid output [0=Fake, 1=Real] or similar
+                                score = float(pred[0][0]) if pred.shape[-1] == 1 else float(pred[0][1])
+                                confidence = score if score > 0.5 else 1 - score
+                                label = "REAL" if score > 0.5 else "FAKE"
+                                print(f"Result: {label} ({confidence})")
+                            else:
+                                return {"error": "Could not process image"}
+                        else:
+                            return {"error": "model_load_failed", "detail": "Image detection model failed to load. Check trained/ folder."}
+            finally:
+                # Release the PIL handle, the decoded pixels and the in-memory buffer
+                if isinstance(image, DecodedImage):
+                    image.close()
+                if hasattr(source, "close"):
+                    source.close()
+
+        elif content_type.startswith("video/"):
+            # Video Prediction - Hybrid Detection (Xception + Heuristics)
+            print("Processing Video (Hybrid Neural + Heuristic)...")
+            from video_utils import predict_video
+            video_result = predict_video(upload.path, progress_callback=progress_callback)
+
+            if "error" in video_result:
+                label = "ERROR"
+                confidence = 0.0
+                print(f"Video Error: {video_result['error']}")
+            else:
+                label = video_result['result']
+                confidence = float(video_result['confidence'])
+                print(f"Video Result: {label} ({confidence}) Raw: {video_result.get('raw')}")
+        else:
+            return {"error": "Unsupported media type"}
+
+    except BatcherOverloaded as e:
+        print(f"Prediction rejected: {e}")
+        return {"error": "server_busy", "detail": str(e)}
+    except Exception as e:
+        print(f"Prediction Error: {e}")
+        return {"error": "prediction_failed", "detail": str(e)}
+
+    if cached is None and cache_key and label not in ("ERROR", "PROCESSING_ERROR"):
+        if _model_version(upload) == model_version:
+            cache.put(cache_key, {"label": label, "confidence": confidence, "detail": detection_detail})
+        else:
+            # Reloaded mid-request: don't file this verdict under either version
+            print(f"Model reloaded during analysis of {upload.sha256[:12]}; not caching")
+
+    return {
+        "label": label,
+        "confidence": confidence,
+        "detail": detection_detail,
+        "cached": cached is not None,
+        "model_version": model_version,
+    }
+
+
+def result_record(upload, analysis):
+    """The record returned by /predict and stored in history"""
+    return {
+        "filename": upload.filename,
+        "label": analysis["label"],
+        "confidence": analysis["confidence"],
+        "content_type": upload.content_type,
+        "detail": analysis["detail"],
+        "cached": analysis["cached"],
+        "model_version": analysis.get("model_version"),
+        "timestamp": datetime.datetime.utcnow().isoformat()
+    }
+
+
+def analyze_and_close(upload, **kwargs):
+    try:
+        return analyze_upload(upload, **kwargs)
+    finally:
+        # Always drop the buffer / spool file, including on error returns
+        upload.close()
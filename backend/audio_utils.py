@@ -1,99 +1,399 @@
-import tensorflow as tf
 import librosa
+import soundfile as sf
 import numpy as np
 import os
-import threading
+import functools
+import math
+from batching import get_batcher
+from model_workers import batch_buffer, run_model, worker_model_version
+from model_registry import get_registry
+from lite_models import AUDIO_BACKEND, load_lite
+from metrics import timed_stage
 
-_audio_model = None
-_model_lock = threading.Lock()
+AUDIO_MAX_SEGMENTS = int(os.getenv("AUDIO_MAX_SEGMENTS", "10"))
 
-# Use the verified working model
-MODEL_PATH = r"v:\Road2Tech\Project_3\Image and Audio Real or Fake Detection System\trained\audio_classifier.h5"
-ALT_MODEL_PATH = os.path.join(os.path.dirname(__file__), "..", "trained", "audio_classifier.h5")
+# "partial" decodes only the sampled windows, "full" decodes up to AUDIO_MAX_SECONDS first
+AUDIO_DECODE_MODE = os.getenv("AUDIO_DECODE_MODE", "partial").lower()
+AUDIO_MAX_SECONDS = 300.0
+PARTIAL_MARGIN_SECONDS = 0.05
 
-def load_audio_model(model_path=MODEL_PATH):
-    global _audio_model
-    with _model_lock:
-        if _audio_model is None:
+# "batch" scores all sampled segments at once, "stream" scores in small batches with early exit
+AUDIO_ANALYSIS_MODE = os.getenv("AUDIO_ANALYSIS_MODE", "batch").lower()
+AUDIO_STREAM_BATCH = int(os.getenv("AUDIO_STREAM_BATCH", "4"))
+AUDIO_STREAM_CONFIDENCE = float(os.getenv("AUDIO_STREAM_CONFIDENCE", "0.9"))
+AUDIO_STREAM_MIN_SEGMENTS = int(os.getenv("AUDIO_STREAM_MIN_SEGMENTS", "4"))
+
+# Feature parameters the audio model was trained with
+AUDIO_SR = 22050
+SEGMENT_SECONDS = 3.0
+N_FFT = 2048
+HOP_LENGTH = 512
+N_MELS = 128
+TARGET_WIDTH = 109
+AMIN = 1e-10
+TOP_DB = 80.0
+
+def build_audio_model(model_path):
+    """Load the audio classifier from `model_path` (called by the model registry)."""
+    # TFLite conversion of this .h5 when AUDIO_BACKEND asks for one (no TensorFlow import)
+    lite = load_lite(model_path, AUDIO_BACKEND)
+    if lite is not None:
+        return lite
+    print(f"DEBUG: Loading AUDIO model strictly from {model_path}...")
+    import tensorflow as tf  # imported on first load to keep server startup fast
+    model = tf.keras.models.load_model(model_path)
+    print("SUCCESS: Audio model (TensorFlow) loaded.")
+    return model
+
+
+def load_audio_model():
+    """The serving audio model (loaded once by the model registry), or None."""
+    return get_registry().get("audio")
+
+
+def audio_model_version():
+    """Version tag of the serving audio model, used in result cache keys."""
+    version = worker_model_version("audio")
+    if version is not None:
+        return version
+    return get_registry().version("audio")
+
+
+def _audio_forward_local(batch, model=None):
+    if model is None:
+        model = load_audio_model()
+    if model is None:
+        raise RuntimeError("Audio model not loaded")
+    return model.predict(batch, verbose=0)
+
+
+def _audio_forward(batch):
+    # Runs on a model worker process when MODEL_WORKERS > 0 (see model_workers)
+    return run_model("audio", batch, _audio_forward_local)
+
+
+@timed_stage("model_forward")
+def predict_audio(batch):
+    """Run [N, 128, 109, 1] segments through the shared cross-request audio batcher."""
+    return get_batcher("audio", _audio_forward, alloc_fn=batch_buffer).predict(batch)
+
+
+@functools.lru_cache(maxsize=4)
+def _mel_basis(sr):
+    return librosa.filters.mel(sr=sr, n_fft=N_FFT, n_mels=N_MELS).astype(np.float32)
+
+
+def segment_starts(n_samples, sr, max_segments=AUDIO_MAX_SEGMENTS):
+    """Start samples of the 3s windows to analyze, spread evenly over the clip."""
+    seg_len = int(SEGMENT_SECONDS * sr)
+    num_possible_segments = int((n_samples / sr) // SEGMENT_SECONDS)
+    if num_possible_segments <= 0:
+        num_possible_segments = 1
+    step = max(1, num_possible_segments // max_segments)
+    starts = [i * seg_len for i in range(0, num_possible_segments, step) if i * seg_len < n_samples]
+    return starts[:max_segments]
+
+
+@timed_stage("preprocessing")
+def mel_features(segments, sr, out=None):
+    """
+    Mel spectrogram (dB, ref=max per segment) for a [N, samples] batch of equal
+    length segments, written into `out` ([N, 128, 109, 1] float32, allocated if None).
+    One batched STFT and one filterbank matmul replace the per-segment librosa calls.
+    """
+    segments = np.asarray(segments, dtype=np.float32)
+    n = segments.shape[0]
+    if out is None:
+        out = np.empty((n, N_MELS, TARGET_WIDTH, 1), dtype=np.float32)
+
+    spec = np.abs(librosa.stft(segments, n_fft=N_FFT, hop_length=HOP_LENGTH)) ** 2  # [N, 1025, T]
+    mel = np.matmul(_mel_basis(sr), spec)  # [N, 128, T]
+
+    # librosa.power_to_db(mel, ref=np.max) for each segment independently
+    log_spec = 10.0 * np.log10(np.maximum(AMIN, mel))
+    ref = mel.max(axis=(1, 2), keepdims=True)
+    log_spec -= 10.0 * np.log10(np.maximum(AMIN, ref))
+    np.maximum(log_spec, log_spec.max(axis=(1, 2), keepdims=True) - TOP_DB, out=log_spec)
+
+    # Crop / zero-pad the time axis to 109 frames
+    width = min(log_spec.shape[2], TARGET_WIDTH)
+    out[:, :, :width, 0] = log_spec[:, :, :width]
+    out[:, :, width:, 0] = 0.0
+    return out
+
+
+def _rewind(source):
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return source
+
+
+def _gather_windows(y, starts, seg_len):
+    if starts[-1] + seg_len <= len(y):
+        # All windows are full length: zero-copy strided view, then gather
+        return np.lib.stride_tricks.sliding_window_view(y, seg_len)[starts]
+    # Clip shorter than one segment
+    return y[np.newaxis, starts[0]:]
+
+
+def _load_windows_full(source, max_segments):
+    """Decode and resample up to 5 minutes, then cut the sampled windows out of it."""
+    y, sr = librosa.load(_rewind(source), sr=AUDIO_SR, duration=AUDIO_MAX_SECONDS)
+    starts = segment_starts(len(y), sr, max_segments)
+    if not starts:
+        return None
+    return _gather_windows(y, starts, int(SEGMENT_SECONDS * sr))
+
+
+@timed_stage("decode")
+def _load_windows_entire(source):
+    """Decode and resample the entire file, then cut every 3s window out of it (no 5 minute cap)."""
+    y, sr = librosa.load(_rewind(source), sr=AUDIO_SR)
+    if not len(y):
+        return None
+    seg_len = int(SEGMENT_SECONDS * sr)
+    # Same windows as the soundfile reader: back to back, a short clip as one window
+    return _gather_windows(y, list(range(0, max(1, len(y) - seg_len + 1), seg_len)), seg_len)
+
+
+class _SoundFileWindows:
+    """
+    Seekable reader that decodes single 3s windows (plus a small margin for the
+    resampler) and resamples each to 22.05 kHz on its own.
+    Raises if soundfile cannot open or seek in the file.
+    """
+
+    def __init__(self, source, max_seconds=AUDIO_MAX_SECONDS):
+        self.f = sf.SoundFile(_rewind(source))
+        if not self.f.seekable() or self.f.frames <= 0:
+            self.f.close()
+            raise ValueError("audio stream is not seekable")
+        self.native_sr = self.f.samplerate
+        n_native = self.f.frames
+        if max_seconds is not None:
+            n_native = min(n_native, int(round(max_seconds * self.native_sr)))
+        self.n_native = n_native
+        self.n_target = int(np.ceil(n_native * AUDIO_SR / self.native_sr))
+        self.seg_len = int(SEGMENT_SECONDS * AUDIO_SR)
+        self.margin = int(PARTIAL_MARGIN_SECONDS * self.native_sr)
+        # Native samples per whole number of 22.05 kHz samples: reads start on a
+        # multiple of this, so the window lines up exactly with a full-file resample
+        self.align = self.native_sr // math.gcd(self.native_sr, AUDIO_SR)
+
+    def _read(self, native_start, native_end):
+        self.f.seek(native_start)
+        data = self.f.read(native_end - native_start, dtype="float32", always_2d=True).mean(axis=1)
+        if self.native_sr == AUDIO_SR:
+            return data
+        return librosa.resample(data, orig_sr=self.native_sr, target_sr=AUDIO_SR)
+
+    @timed_stage("decode")
+    def read_all(self):
+        return self._read(0, self.n_native)
+
+    @timed_stage("decode")
+    def read_window(self, start, out):
+        """Decode the window starting at target-rate sample `start` into `out`."""
+        native_start = start * self.native_sr / AUDIO_SR
+        read_start = max(0, (int(native_start) - self.margin) // self.align * self.align)
+        read_end = min(self.n_native, int(np.ceil((start + self.seg_len) * self.native_sr / AUDIO_SR)) + self.margin)
+        y = self._read(read_start, read_end)
+        offset = int(round((native_start - read_start) * AUDIO_SR / self.native_sr))
+        chunk = y[offset:offset + self.seg_len]
+        out[:len(chunk)] = chunk
+        out[len(chunk):] = 0.0
+        return out
+
+    def close(self):
+        self.f.close()
+
+
+def _load_windows_soundfile(source, max_segments):
+    """
+    Probe the length, then seek to and decode only the sampled windows.
+    Returns None if soundfile cannot open or seek in the file.
+    """
+    try:
+        reader = _SoundFileWindows(source)
+    except Exception:
+        return None
+    try:
+        starts = segment_starts(reader.n_target, AUDIO_SR, max_segments)
+        if not starts:
+            return None
+        if starts[-1] + reader.seg_len > reader.n_target:
+            return reader.read_all()[np.newaxis, :]
+        windows = np.zeros((len(starts), reader.seg_len), dtype=np.float32)
+        for k, start in enumerate(starts):
+            reader.read_window(start, windows[k])
+        return windows
+    finally:
+        reader.close()
+
+
+def _load_windows_offsets(source, max_segments):
+    """Fallback for formats libsndfile cannot read: per-window librosa.load(offset=...)."""
+    if not isinstance(source, (str, os.PathLike)):
+        return None
+    duration = min(librosa.get_duration(path=source), AUDIO_MAX_SECONDS)
+    n_target = int(np.ceil(duration * AUDIO_SR))
+    seg_len = int(SEGMENT_SECONDS * AUDIO_SR)
+    starts = segment_starts(n_target, AUDIO_SR, max_segments)
+    if not starts:
+        return None
+    if starts[-1] + seg_len > n_target:
+        y, _ = librosa.load(source, sr=AUDIO_SR, duration=duration)
+        return y[np.newaxis, :]
+    windows = np.zeros((len(starts), seg_len), dtype=np.float32)
+    for k, start in enumerate(starts):
+        y, _ = librosa.load(source, sr=AUDIO_SR, offset=start / AUDIO_SR, duration=SEGMENT_SECONDS)
+        windows[k, :min(len(y), seg_len)] = y[:seg_len]
+    return windows
+
+
+@timed_stage("decode")
+def load_audio_windows(source, max_segments=AUDIO_MAX_SEGMENTS, decode_mode=None):
+    """
+    [N, samples] float32 windows at 22.05 kHz for the segments to analyze.
+    decode_mode "partial" decodes only those windows; "full" decodes the
+    first 5 minutes and slices them out (the original behaviour).
+    """
+    decode_mode = decode_mode or AUDIO_DECODE_MODE
+    if decode_mode == "partial":
+        windows = _load_windows_soundfile(source, max_segments)
+        if windows is None:
             try:
-                if not os.path.exists(model_path):
-                    alt = os.path.abspath(ALT_MODEL_PATH)
-                    print(f"DEBUG: Audio Model file not found at {model_path}, trying {alt}...")
-                    if os.path.exists(alt):
-                        model_path = alt
-                    else:
-                        raise FileNotFoundError(f"Audio Model file not found at {model_path} or {alt}")
-
-                print(f"DEBUG: Loading AUDIO model strictly from {model_path}...")
-                _audio_model = tf.keras.models.load_model(model_path)
-                print("SUCCESS: Audio model (TensorFlow) loaded.")
-                
-                # Warmup
-                try:
-                    dummy_in = np.zeros((1, 128, 109, 1))
-                    _audio_model.predict(dummy_in, verbose=0)
-                except Exception as e:
-                    print(f"Audio Warmup failed (minor): {e}")
-                    
+                windows = _load_windows_offsets(source, max_segments)
             except Exception as e:
-                print(f"CRITICAL ERROR loading audio model: {e}")
-                return None
-    return _audio_model
+                print(f"Partial audio decode failed ({e}); decoding in full")
+                windows = None
+        if windows is not None:
+            return windows
+    return _load_windows_full(source, max_segments)
 
 
-def preprocess_audio(file_path, max_segments=10):
+def preprocess_audio(file_path, max_segments=AUDIO_MAX_SEGMENTS, decode_mode=None):
     """
-    Load audio -> Split into segments of 3s -> For each: Mel Spectrogram (DB) -> Resize/Pad to 109 -> Shape (1, 128, 109, 1)
-    Returns a list of tensors for all segments.
+    Load audio -> pick up to `max_segments` 3s windows -> Mel Spectrogram (dB) per window
+    -> crop/pad to 109 frames.
+    Returns one [N, 128, 109, 1] float32 array for all segments (None on failure).
     """
     try:
-        # 1. Load entire Audio (or up to 5 mins if supported)
-        y, sr = librosa.load(file_path, duration=300.0) # Up to 5 mins
-        
-        duration = librosa.get_duration(y=y, sr=sr)
-        segment_len = 3.0 # seconds
-        
-        segments = []
-        
-        # Calculate start points for segments (limit to max_segments for speed)
-        # We can take samples at equal intervals
-        num_possible_segments = int(duration // segment_len)
-        if num_possible_segments <= 0:
-            num_possible_segments = 1
-            
-        step = max(1, num_possible_segments // max_segments)
-        
-        for i in range(0, num_possible_segments, step):
-            start = i * int(segment_len * sr)
-            end = (i + 1) * int(segment_len * sr)
-            
-            if start >= len(y):
-                break
-                
-            y_segment = y[start:min(end, len(y))]
-            
-            # Mel Spectrogram
-            mel_spec = librosa.feature.melspectrogram(y=y_segment, sr=sr, n_mels=128)
-            mel_db = librosa.power_to_db(mel_spec, ref=np.max)
-            
-            # Shape handling (128, 109)
-            target_width = 109
-            if mel_db.shape[1] < target_width:
-                 padding = target_width - mel_db.shape[1]
-                 mel_db = np.pad(mel_db, ((0, 0), (0, padding)), mode='constant')
-            else:
-                 mel_db = mel_db[:, :target_width]
-                 
-            # Add dimensions
-            mel_in = mel_db[np.newaxis, ..., np.newaxis]
-            segments.append(mel_in)
-            
-            if len(segments) >= max_segments:
-                break
-                
-        return segments # Return list of processed segment tensors
+        windows = load_audio_windows(file_path, max_segments, decode_mode)
+        if windows is None:
+            return None
+        return mel_features(windows, AUDIO_SR)
         
     except Exception as e:
         print(f"Error preprocessing audio: {e}")
         return None
 
+
+def _coarse_to_fine(n):
+    """Order 0..n-1 so every prefix covers the whole clip (0, n/2, n/4, 3n/4, ...)."""
+    order = []
+    seen = set()
+    stride = 1 << max(0, (n - 1).bit_length())
+    while stride >= 1:
+        for i in range(0, n, stride):
+            if i not in seen:
+                seen.add(i)
+                order.append(i)
+        stride //= 2
+    return order
+
+
+def stream_audio_features(source, max_segments=None, batch_size=AUDIO_STREAM_BATCH, info=None):
+    """
+    Yield [b, 128, 109, 1] feature batches, decoding windows lazily in
+    coarse-to-fine order so early batches already span the whole clip.
+    max_segments=None analyzes every 3s window of the entire file (no 5 minute cap).
+    `info` (a dict, if given) receives the total number of segments.
+    """
+    info = {} if info is None else info
+    try:
+        reader = _SoundFileWindows(source, max_seconds=None if max_segments is None else AUDIO_MAX_SECONDS)
+    except Exception:
+        reader = None
+
+    if reader is None:
+        # Not seekable with soundfile: decode up front, still score incrementally
+        if max_segments is None:
+            windows = _load_windows_entire(source)
+        else:
+            windows = load_audio_windows(source, max_segments)
+        if windows is None:
+            info["total_segments"] = 0
+            return
+        info["total_segments"] = len(windows)
+        for i in range(0, len(windows), batch_size):
+            yield mel_features(windows[i:i + batch_size], AUDIO_SR)
+        return
+
+    try:
+        seg_len = reader.seg_len
+        if max_segments is None:
+            starts = list(range(0, max(1, reader.n_target - seg_len + 1), seg_len))
+        else:
+            starts = segment_starts(reader.n_target, AUDIO_SR, max_segments)
+        if not starts:
+            info["total_segments"] = 0
+            return
+        if starts[-1] + seg_len > reader.n_target:
+            info["total_segments"] = 1
+            yield mel_features(reader.read_all()[np.newaxis, :], AUDIO_SR)
+            return
+        info["total_segments"] = len(starts)
+        order = [starts[i] for i in _coarse_to_fine(len(starts))]
+        windows = np.empty((batch_size, seg_len), dtype=np.float32)
+        for i in range(0, len(order), batch_size):
+            chunk = order[i:i + batch_size]
+            for k, start in enumerate(chunk):
+                reader.read_window(start, windows[k])
+            yield mel_features(windows[:len(chunk)], AUDIO_SR)
+    finally:
+        reader.close()
+
+
+def evaluate_audio_stream(source, predict_fn=None, confidence=AUDIO_STREAM_CONFIDENCE,
+                          min_segments=AUDIO_STREAM_MIN_SEGMENTS, max_segments=None,
+                          batch_size=AUDIO_STREAM_BATCH):
+    """
+    Score segments in small batches, keeping a running mean of the [fake, real]
+    probabilities. Stops early once the leading class averages at least
+    `confidence` and its 95% interval no longer crosses 0.5; ambiguous clips
+    keep going until every segment has been scored.
+
+    Returns {"probs", "segments", "total_segments", "early_exit"}, or None when
+    no features could be extracted.
+    """
+    predict_fn = predict_fn or predict_audio
+    info = {}
+    scored = []
+    n = 0
+    early_exit = False
+    stream = stream_audio_features(source, max_segments=max_segments, batch_size=batch_size, info=info)
+    try:
+        for feats in stream:
+            scored.append(np.asarray(predict_fn(feats), dtype=np.float64))
+            n += len(feats)
+            if n < min_segments or n >= info.get("total_segments", 0):
+                continue
+            probs = np.concatenate(scored, axis=0)
+            mean = probs.mean(axis=0)
+            lead = int(np.argmax(mean))
+            stderr = probs[:, lead].std(ddof=1) / np.sqrt(n) if n > 1 else 1.0
+            if mean[lead] >= confidence and mean[lead] - 1.96 * stderr > 0.5:
+                early_exit = True
+                break
+    finally:
+        stream.close()
+    if not scored:
+        return None
+    probs = np.concatenate(scored, axis=0)
+    return {
+        "probs": probs.mean(axis=0),
+        "segments": int(n),
+        "total_segments": int(info.get("total_segments", n)),
+        "early_exit": early_exit,
+    }
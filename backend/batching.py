@@ -0,0 +1,199 @@
+"""
+Cross-request dynamic micro-batching.
+
+Each model family gets one MicroBatcher. Concurrent requests submit their
+input arrays, a single worker thread drains the queue until it has
+`max_batch_size` rows or `max_wait_ms` has passed, runs one forward pass on the
+concatenated batch and hands every caller back its own slice of the output.
+`predict_fn` may also return a Future (e.g. a model worker dispatch), in which
+case the next batch is collected while that one is in flight.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "32"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+BATCH_QUEUE_SIZE = int(os.getenv("BATCH_QUEUE_SIZE", "256"))
+BATCH_SUBMIT_TIMEOUT = float(os.getenv("BATCH_SUBMIT_TIMEOUT", "0.5"))
+
+
+class BatcherOverloaded(RuntimeError):
+    """Raised when a model queue is full and the request should be shed."""
+
+
+class _Pending:
+    __slots__ = ("inputs", "rows", "future", "enqueued_at")
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.rows = inputs.shape[0]
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """Collects inputs from concurrent callers and runs them as one batch."""
+
+    def __init__(self, name, predict_fn, max_batch_size=BATCH_MAX_SIZE,
+                 max_wait_ms=BATCH_MAX_WAIT_MS, max_queue_size=BATCH_QUEUE_SIZE, alloc_fn=None):
+        self.name = name
+        self.predict_fn = predict_fn
+        # Optional alloc_fn(shape, dtype) -> array or None: where to concatenate a batch
+        self.alloc_fn = alloc_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue_size)))
+        self._carry = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "rejected": 0,
+            "batches": 0,
+            "rows": 0,
+            "errors": 0,
+            "max_batch_rows": 0,
+            "total_wait_ms": 0.0,
+            "total_forward_ms": 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name=f"batcher-{name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, inputs, timeout=BATCH_SUBMIT_TIMEOUT):
+        """Queue `inputs` ([N, ...] array) and return a Future for its [N, ...] output."""
+        inputs = np.asarray(inputs)
+        item = _Pending(inputs)
+        try:
+            self._queue.put(item, timeout=timeout)
+        except queue.Full:
+            with self._stats_lock:
+                self._stats["rejected"] += 1
+            raise BatcherOverloaded(f"{self.name} inference queue is full")
+        with self._stats_lock:
+            self._stats["requests"] += 1
+        return item.future
+
+    def predict(self, inputs, timeout=None):
+        """Blocking helper: submit and wait for this caller's slice."""
+        return self.submit(inputs).result(timeout=timeout)
+
+    def _next_item(self, timeout):
+        if self._carry is not None:
+            item, self._carry = self._carry, None
+            return item
+        if timeout is None:
+            return self._queue.get()
+        return self._queue.get(timeout=timeout)
+
+    def _collect(self):
+        first = self._next_item(None)
+        items = [first]
+        rows = first.rows
+        deadline = time.perf_counter() + self.max_wait
+        while rows < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._next_item(remaining)
+            except queue.Empty:
+                break
+            if rows + item.rows > self.max_batch_size:
+                # Keep it for the next batch rather than overshooting the cap
+                self._carry = item
+                break
+            items.append(item)
+            rows += item.rows
+        return items, rows
+
+    def _run(self):
+        while True:
+            items, rows = self._collect()
+            started = time.perf_counter()
+            try:
+                if len(items) == 1:
+                    batch = items[0].inputs
+                else:
+                    batch = self._concatenate([it.inputs for it in items], rows)
+                outputs = self.predict_fn(batch)
+            except Exception as e:
+                self._finish(items, rows, started, None, e)
+                continue
+            if isinstance(outputs, Future):
+                # Dispatched elsewhere (model worker process): keep batching meanwhile
+                outputs.add_done_callback(
+                    lambda f, items=items, rows=rows, started=started:
+                        self._finish(items, rows, started, None if f.exception() else f.result(), f.exception())
+                )
+            else:
+                self._finish(items, rows, started, outputs, None)
+
+    def _concatenate(self, arrays, rows):
+        out = None
+        tail = arrays[0].shape[1:]
+        if self.alloc_fn is not None and all(a.shape[1:] == tail for a in arrays):
+            out = self.alloc_fn((rows,) + tail, np.result_type(*arrays))
+        return np.concatenate(arrays, axis=0, out=out)
+
+    def _finish(self, items, rows, started, outputs, error):
+        if error is None:
+            try:
+                outputs = np.asarray(outputs)
+                offset = 0
+                for it in items:
+                    it.future.set_result(outputs[offset:offset + it.rows])
+                    offset += it.rows
+            except Exception as e:
+                error = e
+        if error is not None:
+            print(f"[Batcher:{self.name}] Forward pass failed: {error}")
+            with self._stats_lock:
+                self._stats["errors"] += 1
+            for it in items:
+                if not it.future.done():
+                    it.future.set_exception(error)
+        finished = time.perf_counter()
+        with self._stats_lock:
+            s = self._stats
+            s["batches"] += 1
+            s["rows"] += rows
+            s["max_batch_rows"] = max(s["max_batch_rows"], rows)
+            s["total_wait_ms"] += sum(started - it.enqueued_at for it in items) * 1000.0
+            s["total_forward_ms"] += (finished - started) * 1000.0
+
+    def stats(self):
+        with self._stats_lock:
+            s = dict(self._stats)
+        s["queue_depth"] = self._queue.qsize() + (1 if self._carry is not None else 0)
+        s["queue_capacity"] = self._queue.maxsize
+        s["max_batch_size"] = self.max_batch_size
+        s["max_wait_ms"] = self.max_wait * 1000.0
+        s["avg_batch_rows"] = s["rows"] / s["batches"] if s["batches"] else 0.0
+        s["avg_wait_ms"] = s["total_wait_ms"] / s["requests"] if s["requests"] else 0.0
+        s["avg_forward_ms"] = s["total_forward_ms"] / s["batches"] if s["batches"] else 0.0
+        return s
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def get_batcher(name, predict_fn, **kwargs):
+    """Return the shared batcher for `name`, creating it on first use."""
+    batcher = _batchers.get(name)
+    if batcher is None:
+        with _batchers_lock:
+            batcher = _batchers.get(name)
+            if batcher is None:
+                batcher = MicroBatcher(name, predict_fn, **kwargs)
+                _batchers[name] = batcher
+    return batcher
+
+
+def batcher_stats():
+    """Per-model queue metrics for every batcher created so far."""
+    return {name: b.stats() for name, b in list(_batchers.items())}
@@ -0,0 +1,65 @@
+"""
+Compare full vs partial audio decoding.
+
+"full" decodes and resamples up to 5 minutes before slicing out the windows;
+"partial" seeks to and decodes only the sampled windows. Reports wall time,
+peak traced memory and the largest feature difference between the two modes.
+
+Usage (from backend/):
+    python benchmarks/bench_audio_decode.py --seconds 30 300 1800 --sr 44100
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from audio_utils import preprocess_audio  # noqa: E402
+
+
+def make_clip(path, seconds, sr):
+    rng = np.random.default_rng(0)
+    with sf.SoundFile(path, "w", samplerate=sr, channels=2, subtype="PCM_16") as f:
+        block = sr * 10
+        for start in range(0, int(seconds * sr), block):
+            n = min(block, int(seconds * sr) - start)
+            t = (start + np.arange(n)) / sr
+            tone = 0.3 * np.sin(2 * np.pi * (220 + 60 * np.sin(0.3 * t)) * t)
+            noise = 0.05 * rng.standard_normal((n, 2))
+            f.write((tone[:, None] + noise).astype(np.float32))
+
+
+def run(path, mode):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    feats = preprocess_audio(path, decode_mode=mode)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return feats, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, nargs="+", default=[30, 300, 1800])
+    parser.add_argument("--sr", type=int, default=44100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for seconds in args.seconds:
+            path = os.path.join(tmp, f"clip_{int(seconds)}.wav")
+            make_clip(path, seconds, args.sr)
+            full, t_full, m_full = run(path, "full")
+            part, t_part, m_part = run(path, "partial")
+            diff = float(np.abs(full - part).max()) if full.shape == part.shape else float("inf")
+            print(f"{seconds:7.0f}s  full {t_full * 1000:8.1f} ms / {m_full / 2**20:7.1f} MiB   "
+                  f"partial {t_part * 1000:8.1f} ms / {m_part / 2**20:7.1f} MiB   max|diff|={diff:.3f} dB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark for audio feature extraction.
+
+Times the vectorized preprocess_audio (one batched STFT + mel filterbank
+matmul) against the original per-segment librosa loop on synthetic clips.
+Feature parity between the two is checked by tests/test_audio_features.py.
+
+Usage (from backend/):
+    python benchmarks/bench_audio_features.py --seconds 2 10 45 300
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import librosa
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from audio_utils import preprocess_audio  # noqa: E402
+
+
+def legacy_preprocess_audio(file_path, max_segments=10):
+    y, sr = librosa.load(file_path, duration=300.0)
+    duration = librosa.get_duration(y=y, sr=sr)
+    segment_len = 3.0
+    segments = []
+    num_possible_segments = int(duration // segment_len)
+    if num_possible_segments <= 0:
+        num_possible_segments = 1
+    step = max(1, num_possible_segments // max_segments)
+    for i in range(0, num_possible_segments, step):
+        start = i * int(segment_len * sr)
+        end = (i + 1) * int(segment_len * sr)
+        if start >= len(y):
+            break
+        y_segment = y[start:min(end, len(y))]
+        mel_spec = librosa.feature.melspectrogram(y=y_segment, sr=sr, n_mels=128)
+        mel_db = librosa.power_to_db(mel_spec, ref=np.max)
+        target_width = 109
+        if mel_db.shape[1] < target_width:
+            mel_db = np.pad(mel_db, ((0, 0), (0, target_width - mel_db.shape[1])), mode="constant")
+        else:
+            mel_db = mel_db[:, :target_width]
+        segments.append(mel_db[np.newaxis, ..., np.newaxis])
+        if len(segments) >= max_segments:
+            break
+    return np.vstack(segments)
+
+
+def make_clip(path, seconds, sr=44100):
+    rng = np.random.default_rng(int(seconds * 1000))
+    t = np.arange(int(seconds * sr)) / sr
+    tone = 0.3 * np.sin(2 * np.pi * (220 + 80 * np.sin(0.5 * t)) * t)
+    sf.write(path, (tone + 0.05 * rng.standard_normal(t.shape)).astype(np.float32), sr)
+
+
+def timed(fn, path, repeats):
+    best = float("inf")
+    out = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        out = fn(path)
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, nargs="+", default=[2, 10, 45, 300])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for seconds in args.seconds:
+            path = os.path.join(tmp, f"clip_{seconds}.wav")
+            make_clip(path, seconds)
+            t_old, _ = timed(legacy_preprocess_audio, path, args.repeats)
+            t_new, new = timed(lambda p: preprocess_audio(p, decode_mode="full"), path, args.repeats)
+            print(f"{seconds:6.1f}s  segments={new.shape[0]:2d}  legacy {t_old * 1000:7.1f} ms  "
+                  f"vectorized {t_new * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Load test for history reads as one user's history grows.
+
+For each history size it fills a scratch collection for one user (among
+other users' rows) and times:
+- legacy: the old full find().sort() plus the _id conversion loop
+- first page: history_page() with the default page size
+- deep page: history_page() following next_cursor --pages times
+- count: history_count()
+
+With the (user_email, timestamp, _id) index, the page and count columns
+should stay flat while the legacy column grows linearly. Against a real
+server (--mongo) the explain plan of a deep page is also printed: it should
+be an IXSCAN that examines about one page of keys. mongomock (the default,
+no server needed) has no indexes, so it only shows the effect of limit and
+projection.
+
+Usage (from backend/):
+    python benchmarks/bench_history_queries.py --sizes 100 1000 10000 50000
+    python benchmarks/bench_history_queries.py --mongo mongodb://localhost:27017
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import HISTORY_INDEX, ensure_indexes  # noqa: E402
+from history_queries import SORT, history_count, history_page  # noqa: E402
+
+USER = "heavy@example.com"
+
+
+def fill(collection, size, other_users=5):
+    collection.delete_many({})
+    start = datetime.datetime(2024, 1, 1)
+    docs = []
+    for i in range(size * (1 + other_users)):
+        user = USER if i % (1 + other_users) == 0 else f"user{i % (1 + other_users)}@example.com"
+        docs.append({
+            "user_email": user,
+            "filename": f"file_{i}.jpg",
+            "label": "REAL" if i % 3 else "FAKE",
+            "confidence": 0.5 + (i % 50) / 100.0,
+            "content_type": "image/jpeg",
+            "detail": None,
+            "cached": False,
+            "model_version": "face_real_vs_ai_model.h5@0123456789ab",
+            # Some rows share a timestamp so the _id tie-break is exercised
+            "timestamp": (start + datetime.timedelta(seconds=i // 2)).isoformat(),
+        })
+        if len(docs) == 5000:
+            collection.insert_many(docs)
+            docs = []
+    if docs:
+        collection.insert_many(docs)
+
+
+def timed(fn, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000.0, result
+
+
+def legacy(collection):
+    history = list(collection.find({"user_email": USER}).sort("timestamp", -1))
+    for item in history:
+        item["_id"] = str(item["_id"])
+    return history
+
+
+def deep_page(collection, pages):
+    cursor = None
+    page = None
+    for _ in range(pages):
+        page = history_page(collection, USER, cursor=cursor)
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    return page, cursor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+    parser.add_argument("--pages", type=int, default=10, help="Pages followed for the deep-page timing")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--mongo", help="MongoDB URL (default: in-memory mongomock)")
+    args = parser.parse_args()
+
+    if args.mongo:
+        from pymongo import MongoClient
+        client = MongoClient(args.mongo)
+    else:
+        import mongomock
+        client = mongomock.MongoClient()
+    db = client["bench_history_queries"]
+    ensure_indexes(db)
+    collection = db["history"]
+
+    print(f"{'rows/user':>10s} {'legacy ms':>10s} {'page 1 ms':>10s} {'page ' + str(args.pages) + ' ms':>11s} "
+          f"{'count ms':>9s}")
+    for size in args.sizes:
+        fill(collection, size)
+        legacy_ms, rows = timed(lambda: legacy(collection), args.repeats)
+        first_ms, first = timed(lambda: history_page(collection, USER), args.repeats)
+        deep_ms, (page, cursor) = timed(lambda: deep_page(collection, args.pages), 1)
+        count_ms, count = timed(lambda: history_count(collection, USER), args.repeats)
+        assert count == size == len(rows)
+        print(f"{size:10d} {legacy_ms:10.1f} {first_ms:10.2f} {deep_ms / args.pages:11.2f} {count_ms:9.2f}")
+
+    if args.mongo and cursor:
+        from history_queries import decode_cursor
+        timestamp, oid = decode_cursor(cursor)
+        query = {"user_email": USER,
+                 "$or": [{"timestamp": {"$lt": timestamp}}, {"timestamp": timestamp, "_id": {"$lt": oid}}]}
+        plan = collection.find(query).sort(SORT).limit(51).explain()
+        stats = plan.get("executionStats", {})
+        print(f"Deep page plan: index {HISTORY_INDEX}, keys examined {stats.get('totalKeysExamined')}, "
+              f"docs examined {stats.get('totalDocsExamined')}, returned {stats.get('nReturned')}")
+    client.drop_database("bench_history_queries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Request latency with synchronous history inserts vs the write-behind writer.
+
+Simulates /predict handlers on --threads threads. Each one does --work-ms of
+work and then saves one history record, either with insert_one before it
+"responds" (the old path) or by queueing it on HistoryWriter. Reports
+p50/p95/p99 handler latency and the number of database round trips.
+
+By default the collection is simulated, with log-normal latency (median
+--db-ms, occasional slow calls up to --db-tail-ms) so the run needs no
+server. Pass --mongo to measure against a real MongoDB (records go to a
+scratch collection that is dropped afterwards).
+
+Usage (from backend/):
+    python benchmarks/bench_history_writer.py --requests 2000 --threads 8
+    python benchmarks/bench_history_writer.py --mongo mongodb://localhost:27017
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from history_writer import HistoryWriter  # noqa: E402
+
+
+class SimulatedCollection:
+    """insert_one / insert_many with MongoDB-like latency, counting round trips."""
+
+    def __init__(self, median_ms, tail_ms, seed=0):
+        self.median_ms = median_ms
+        self.tail_ms = tail_ms
+        self.round_trips = 0
+        self.records = 0
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def _sleep(self, n=1):
+        with self._lock:
+            ms = min(self.tail_ms, self._rng.lognormal(np.log(self.median_ms), 0.6))
+            self.round_trips += 1
+            self.records += n
+        # A bulk insert costs a bit more per document
+        time.sleep((ms + 0.02 * n) / 1000.0)
+
+    def insert_one(self, record):
+        self._sleep()
+
+    def insert_many(self, records, ordered=True):
+        self._sleep(len(records))
+
+
+def run(save, requests, threads, work_ms):
+    latencies = []
+    lock = threading.Lock()
+
+    def handler(i):
+        t0 = time.perf_counter()
+        time.sleep(work_ms / 1000.0)
+        save({"user_email": f"user{i % 50}@example.com", "label": "REAL", "confidence": 0.9, "index": i})
+        elapsed = (time.perf_counter() - t0) * 1000.0
+        with lock:
+            latencies.append(elapsed)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(handler, range(requests)))
+    return np.array(latencies), time.perf_counter() - t0
+
+
+def report(name, latencies, wall, round_trips):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    print(f"{name:14s} p50 {p50:7.2f} ms  p95 {p95:7.2f} ms  p99 {p99:7.2f} ms  "
+          f"{len(latencies) / wall:7.0f} req/s  {round_trips} DB round trips")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--work-ms", type=float, default=5.0, help="Simulated inference time per request")
+    parser.add_argument("--db-ms", type=float, default=4.0, help="Median simulated insert latency")
+    parser.add_argument("--db-tail-ms", type=float, default=200.0, help="Cap on simulated slow inserts")
+    parser.add_argument("--mongo", help="MongoDB URL to use instead of the simulation")
+    args = parser.parse_args()
+
+    if args.mongo:
+        from pymongo import MongoClient
+        client = MongoClient(args.mongo)
+        collections = [client["bench_history_writer"][name] for name in ("sync", "write_behind")]
+    else:
+        collections = [SimulatedCollection(args.db_ms, args.db_tail_ms, seed) for seed in (0, 1)]
+
+    sync_col, wb_col = collections
+    latencies, wall = run(sync_col.insert_one, args.requests, args.threads, args.work_ms)
+    report("insert_one", latencies, wall, getattr(sync_col, "round_trips", args.requests))
+
+    spill = os.path.join(tempfile.mkdtemp(prefix="history-bench-"), "spill.jsonl")
+    writer = HistoryWriter(wb_col, spill_path=spill)
+    latencies, wall = run(writer.add, args.requests, args.threads, args.work_ms)
+    t0 = time.perf_counter()
+    writer.stop(timeout=60)
+    drain_ms = (time.perf_counter() - t0) * 1000.0
+    stats = writer.stats()
+    report("write-behind", latencies, wall, stats["batches"])
+    print(f"{'':14s} {stats['written']} records written, {stats['spilled']} spilled, "
+          f"avg insert_many {stats['avg_write_ms']:.1f} ms, final drain {drain_ms:.0f} ms")
+
+    if args.mongo:
+        client.drop_database("bench_history_writer")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark for the shared image decode.
+
+Compares the original image path (PIL open for the watermark corner check,
+then a second full decode for the model input) against one DecodedImage
+shared by both, as /predict runs it: the sparkle check decodes at full
+resolution and the model input is resized from the same buffer. Also reports
+the model input alone (no sparkle check), where large JPEGs are draft-decoded,
+and the order that costs two decodes (model input taken before the corner).
+Reports time and peak traced memory per upload, and how far the model input
+moves from the original.
+
+Usage (from backend/):
+    python benchmarks/bench_image_decode.py --size 6000 4000
+"""
+import argparse
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from image_utils import DecodedImage, IMAGE_TARGET_SIZE, check_ai_watermark, preprocess_image  # noqa: E402
+
+
+def legacy(data):
+    img = Image.open(io.BytesIO(data))
+    width, height = img.size
+    crop_w, crop_h = int(width * 0.15), int(height * 0.15)
+    img.crop((width - crop_w, height - crop_h, width, height)).convert("L").getextrema()
+    img = Image.open(io.BytesIO(data)).convert("RGB").resize(IMAGE_TARGET_SIZE, Image.NEAREST)
+    return np.asarray(img, dtype=np.float32) / 255.0
+
+
+def shared(data):
+    with DecodedImage(io.BytesIO(data)) as image:
+        check_ai_watermark(image)
+        return preprocess_image(image)[0].copy()
+
+
+def input_only(data, min_side):
+    with DecodedImage(io.BytesIO(data), min_side=min_side) as image:
+        return preprocess_image(image)[0].copy()
+
+
+def input_first(data):
+    with DecodedImage(io.BytesIO(data)) as image:
+        out = preprocess_image(image)[0].copy()
+        check_ai_watermark(image)
+        return out
+
+
+def measure(fn, repeats):
+    best = float("inf")
+    peak = 0
+    out = None
+    for _ in range(repeats):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return best, peak, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, nargs=2, default=[6000, 4000], metavar=("W", "H"))
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    w, h = args.size
+    yy, xx = np.mgrid[0:h, 0:w]
+    pixels = np.stack([xx * 255 // w, yy * 255 // h, (xx + yy) % 256], axis=-1).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, "JPEG", quality=92)
+    data = buf.getvalue()
+    print(f"{w}x{h} JPEG, {len(data) / 2**20:.1f} MiB")
+
+    t, peak, ref = measure(lambda: legacy(data), args.repeats)
+    print(f"{'legacy (two decodes)':<23} {t * 1000:8.1f} ms  peak {peak / 2**20:7.1f} MiB")
+    runs = [
+        ("shared (check, input)", lambda: shared(data)),
+        ("input only, full", lambda: input_only(data, 0)),
+        ("input only, draft 512", lambda: input_only(data, 512)),
+        ("input then check (2x)", lambda: input_first(data)),
+    ]
+    for name, fn in runs:
+        t, peak, out = measure(fn, args.repeats)
+        diff = float(np.abs(out - ref).mean())
+        print(f"{name:<23} {t * 1000:8.1f} ms  peak {peak / 2**20:7.1f} MiB  mean |input diff| {diff:.4f}")
+
+
+if __name__ == "__main__":
+    main()
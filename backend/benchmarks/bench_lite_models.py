@@ -0,0 +1,82 @@
+"""
+Cold start, memory and throughput of the Keras vs TFLite audio/image models.
+
+Each (model, backend) pair loads in a fresh Python process, as a new replica
+would. The child reports import + load time, peak RSS and whether TensorFlow
+got imported, then times batches of seeded inputs. Run
+`python lite_models.py convert` first so the TFLite files exist; missing
+conversions show up as the Keras fallback.
+
+Usage (from backend/):
+    python benchmarks/bench_lite_models.py --batch 8 --iters 20
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKENDS = ("keras", "tflite-fp16", "tflite-int8")
+
+
+def child(name, batch_size, iters):
+    import resource
+    sys.path.insert(0, BACKEND_DIR)
+    t0 = time.perf_counter()
+    from lite_models import sample_inputs
+    from model_registry import get_registry
+    registry = get_registry()
+    model = registry.get(name)
+    load_s = time.perf_counter() - t0
+    if model is None:
+        print(json.dumps({"error": registry.entry_status(name)["error"]}))
+        return
+    batch = sample_inputs(name, count=batch_size)
+    model.predict(batch, verbose=0)
+    t0 = time.perf_counter()
+    for _ in range(iters):
+        model.predict(batch, verbose=0)
+    elapsed = time.perf_counter() - t0
+    print(json.dumps({
+        "version": registry.version(name),
+        "load_s": load_s,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        "tensorflow_imported": "tensorflow" in sys.modules,
+        "samples_per_s": batch_size * iters / elapsed,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", default=["audio", "image"])
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--iters", type=int, default=20)
+    parser.add_argument("--child", nargs=1, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child[0], args.batch, args.iters)
+        return
+
+    print(f"{'model':6s} {'backend':12s} {'load s':>7s} {'peak RSS MB':>12s} {'TF':>4s} {'samples/s':>10s}  version")
+    for name in args.models:
+        for backend in BACKENDS:
+            env = dict(os.environ, AUDIO_BACKEND=backend, IMAGE_BACKEND=backend, MODEL_WARMUP="0")
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", name,
+                                  "--batch", str(args.batch), "--iters", str(args.iters)],
+                                 cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+            lines = [line for line in out.stdout.splitlines() if line.startswith("{")]
+            if not lines:
+                print(f"{name:6s} {backend:12s} failed: {out.stderr.strip().splitlines()[-1:]}")
+                continue
+            r = json.loads(lines[-1])
+            if "error" in r:
+                print(f"{name:6s} {backend:12s} failed: {r['error']}")
+                continue
+            print(f"{name:6s} {backend:12s} {r['load_s']:7.2f} {r['peak_rss_mb']:12.0f} "
+                  f"{'yes' if r['tensorflow_imported'] else 'no':>4s} {r['samples_per_s']:10.1f}  {r['version']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Benchmark and verdict check for the image metadata scanner.
+
+Builds large JPEG and PNG files with and without AI markers (EXIF Software,
+XMP packet, PNG tEXt/iTXt, trailing bytes), then compares the original
+full-byte-search check against image_metadata.scan_metadata: verdicts must
+match, and the time per file is reported.
+
+Usage (from backend/):
+    python benchmarks/bench_metadata_scan.py --size 4000 3000
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import piexif
+from PIL import Image, PngImagePlugin
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from image_metadata import AI_KEYWORDS, scan_metadata  # noqa: E402
+
+
+def legacy_scan(data):
+    """Steps 1-3 of the original check_ai_watermark; returns the verdict only."""
+    img = Image.open(io.BytesIO(data))
+    if "exif" in img.info:
+        try:
+            exif_dict = piexif.load(img.info["exif"])
+            for ifd in ("0th", "Exif", "GPS", "1st"):
+                for tag in exif_dict[ifd]:
+                    tag_value = str(exif_dict[ifd][tag]).lower()
+                    if any(kw in tag_value for kw in AI_KEYWORDS):
+                        return True
+        except Exception:
+            pass
+    for value in img.info.values():
+        val_str = str(value).lower()
+        if any(kw in val_str for kw in AI_KEYWORDS):
+            return True
+    head = data[:500 * 1024].lower()
+    tail = data[-500 * 1024:].lower()
+    content = head + tail
+    return any(kw.encode() in content for kw in AI_KEYWORDS)
+
+
+def make_cases(width, height):
+    rng = np.random.default_rng(0)
+    pixels = Image.fromarray(rng.integers(0, 255, size=(height, width, 3), dtype=np.uint8))
+    xmp = (b'<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF><rdf:Description '
+           b'xmlns:xmp="http://ns.adobe.com/xap/1.0/" xmp:CreatorTool="Midjourney v6"/>'
+           b'</rdf:RDF></x:xmpmeta>')
+    cases = {}
+
+    buf = io.BytesIO()
+    pixels.save(buf, "JPEG", quality=95)
+    cases["jpeg/clean"] = buf.getvalue()
+
+    buf = io.BytesIO()
+    exif = piexif.dump({"0th": {piexif.ImageIFD.Software: b"Google Gemini"}})
+    pixels.save(buf, "JPEG", quality=95, exif=exif)
+    cases["jpeg/exif"] = buf.getvalue()
+
+    buf = io.BytesIO()
+    pixels.save(buf, "JPEG", quality=95, xmp=xmp)
+    cases["jpeg/xmp"] = buf.getvalue()
+
+    cases["jpeg/trailer"] = cases["jpeg/clean"] + b"Made by DALL-E"
+
+    buf = io.BytesIO()
+    pixels.save(buf, "PNG")
+    cases["png/clean"] = buf.getvalue()
+
+    info = PngImagePlugin.PngInfo()
+    info.add_text("parameters", "Stable Diffusion, steps: 30")
+    buf = io.BytesIO()
+    pixels.save(buf, "PNG", pnginfo=info)
+    cases["png/text"] = buf.getvalue()
+
+    info = PngImagePlugin.PngInfo()
+    info.add_itxt("Description", "AI-Generated artwork", zip=True)
+    buf = io.BytesIO()
+    pixels.save(buf, "PNG", pnginfo=info)
+    cases["png/itxt"] = buf.getvalue()
+    return cases
+
+
+def timed(fn, repeats):
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, nargs=2, default=[4000, 3000], metavar=("W", "H"))
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    mismatches = 0
+    for name, data in make_cases(*args.size).items():
+        t_old, old = timed(lambda: legacy_scan(data), args.repeats)
+        t_new, found = timed(lambda: scan_metadata(io.BytesIO(data)), args.repeats)
+        new = found is not None
+        mismatches += old != new
+        print(f"{name:14s} {len(data) / 2**20:6.1f} MiB  legacy {t_old * 1000:7.2f} ms ({old})  "
+              f"scanner {t_new * 1000:7.2f} ms ({found})  {'OK' if old == new else 'MISMATCH'}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
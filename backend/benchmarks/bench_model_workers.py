@@ -0,0 +1,74 @@
+"""
+Startup and memory report for the model worker pool.
+
+Starts MODEL_WORKERS forked workers (default 2 here), prints the parent
+preload time, per-worker startup time and RSS / PSS / shared memory, then
+pushes random batches of each available family through the pool and through
+the in-process forward to compare throughput.
+
+Usage (from backend/):
+    python benchmarks/bench_model_workers.py --workers 2 --batches 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import wait
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import model_workers  # noqa: E402
+from model_registry import get_registry  # noqa: E402
+from model_workers import FAMILIES, start_model_workers, stop_model_workers, worker_stats  # noqa: E402
+
+SHAPES = {
+    "audio": (8, 128, 109, 1),
+    "image": (8, 256, 256, 3),
+    "video": (8, 3, 299, 299),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--batches", type=int, default=20)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    pool = start_model_workers(args.workers)
+    print(f"Pool started in {time.perf_counter() - t0:.2f}s")
+    stats = worker_stats()
+    print(json.dumps({k: stats[k] for k in ("preload_s", "parent", "workers")}, indent=2))
+
+    rng = np.random.default_rng(0)
+    for family in FAMILIES:
+        if not pool.models.get(family, {}).get("loaded"):
+            print(f"{family}: model not available, skipped")
+            continue
+        batch = rng.random(SHAPES[family], dtype=np.float32)
+        t0 = time.perf_counter()
+        wait([pool.submit(family, batch) for _ in range(args.batches)])
+        pooled = time.perf_counter() - t0
+
+        spec = get_registry().spec(family)
+        local = spec.attr(spec.forward)
+        model_workers._pool = None
+        try:
+            t0 = time.perf_counter()
+            for _ in range(args.batches):
+                local(batch)
+            inproc = time.perf_counter() - t0
+        finally:
+            model_workers._pool = pool
+        print(f"{family}: {args.batches} batches of {SHAPES[family]}  "
+              f"pool {pooled:.2f}s  in-process {inproc:.2f}s")
+
+    stats = worker_stats()
+    print("After load:", json.dumps(stats["workers"], indent=2))
+    stop_model_workers()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Throughput benchmark for tensor_transport.SlabRing (round trips are checked
+by tests/test_tensor_transport.py).
+
+A forked consumer receives [16, 3, 299, 299] face batches and
+[32, 128, 109, 1] spectrogram batches either as descriptors over a pipe
+(SlabRing) or pickled through a multiprocessing.Queue, and sums them.
+
+Usage (from backend/):
+    python benchmarks/bench_tensor_transport.py --iters 50
+"""
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tensor_transport import SlabRing  # noqa: E402
+
+CASES = {
+    "faces": ((16, 3, 299, 299), np.float32),
+    "spectrograms": ((32, 128, 109, 1), np.float32),
+}
+
+
+def _ring_consumer(ring, conn):
+    while True:
+        desc = conn.recv()
+        if desc is None:
+            break
+        conn.send(float(ring.view(desc).sum()))
+
+
+def _queue_consumer(in_q, out_q):
+    while True:
+        arr = in_q.get()
+        if arr is None:
+            break
+        out_q.put(float(arr.sum()))
+
+
+def throughput(iters):
+    ctx = mp.get_context("fork")
+    rng = np.random.default_rng(1)
+    for name, (shape, dtype) in CASES.items():
+        batch = rng.random(shape, dtype=dtype)
+        mb = batch.nbytes / 2**20
+
+        ring = SlabRing(batch.nbytes, 2)
+        parent, child = ctx.Pipe()
+        p = ctx.Process(target=_ring_consumer, args=(ring, child))
+        p.start()
+        t0 = time.perf_counter()
+        for _ in range(iters):
+            desc = ring.put(batch)
+            parent.send(desc)
+            parent.recv()
+            ring.release(desc)
+        t_ring = time.perf_counter() - t0
+        parent.send(None)
+        p.join()
+        ring.close()
+
+        in_q, out_q = ctx.Queue(), ctx.Queue()
+        p = ctx.Process(target=_queue_consumer, args=(in_q, out_q))
+        p.start()
+        t0 = time.perf_counter()
+        for _ in range(iters):
+            in_q.put(batch)
+            out_q.get()
+        t_queue = time.perf_counter() - t0
+        in_q.put(None)
+        p.join()
+
+        print(f"{name:13s} {mb:6.1f} MiB x {iters}:  slab ring {iters * mb / t_ring:8.0f} MiB/s   "
+              f"pickle+queue {iters * mb / t_queue:8.0f} MiB/s   ({t_queue / t_ring:.1f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iters", type=int, default=50)
+    args = parser.parse_args()
+    throughput(args.iters)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Faces/sec and accuracy check for each Xception inference backend on CPU.
+
+Builds every backend in xception_backends.BACKENDS from one checkpoint,
+compares its softmax outputs with the eager model on the fixed validation set
+(VIDEO_VALIDATION_DIR face crops, or seeded noise) and then times
+[batch, 3, 299, 299] forward passes. Backends whose dependency is missing
+(onnx / onnxruntime) are reported and skipped.
+
+Usage (from backend/):
+    python benchmarks/bench_xception_backends.py --batch 1 8 16 --iters 10
+    python benchmarks/bench_xception_backends.py --random   # no checkpoint: random weights
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import xception_backends  # noqa: E402
+from model_registry import get_registry  # noqa: E402
+from xception import Xception  # noqa: E402
+from xception_backends import BACKENDS, TorchBackend, compare, tolerance, validation_set  # noqa: E402
+
+
+def load_eager(args):
+    if args.random:
+        torch.manual_seed(0)
+        model = Xception(num_classes=2).eval()
+        # Random BN statistics, so folding is actually exercised
+        for m in model.modules():
+            if isinstance(m, torch.nn.BatchNorm2d):
+                m.running_mean.uniform_(-0.1, 0.1)
+                m.running_var.uniform_(0.5, 1.5)
+        path = os.path.join(tempfile.mkdtemp(prefix="xception-bench-"), "random.pth")
+        torch.save(model.state_dict(), path)
+        return model, path
+    path = args.checkpoint or get_registry().spec("video").resolve()
+    from video_utils import load_xception
+    return load_xception(path), path
+
+
+def faces_per_sec(backend, batch_size, iters):
+    batch = np.random.default_rng(1).standard_normal((batch_size,) + xception_backends.INPUT_SHAPE,
+                                                     dtype=np.float32)
+    backend(batch)  # warm-up
+    t0 = time.perf_counter()
+    for _ in range(iters):
+        backend(batch)
+    return batch_size * iters / (time.perf_counter() - t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkpoint", help="Xception .pth (default: the registry's video artifact)")
+    parser.add_argument("--random", action="store_true", help="Use random weights instead of a checkpoint")
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 8, 16])
+    parser.add_argument("--iters", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=0, help="torch/ORT intra-op threads (0 = default)")
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    module, path = load_eager(args)
+    eager = TorchBackend(module)
+    samples = validation_set()
+    print(f"{torch.get_num_threads()} threads, validation set {samples.shape}")
+    print(f"{'backend':12s} {'max diff':>9s} {'agree':>6s} {'ok':>3s}  "
+          + "  ".join(f"{'b=' + str(b):>10s}" for b in args.batch) + "   (faces/sec)")
+    baseline = None
+    for name in BACKENDS:
+        try:
+            backend = eager if name == "eager" else xception_backends.build_optimized(module, path, name)
+        except Exception as e:
+            print(f"{name:12s} unavailable: {type(e).__name__}: {e}")
+            continue
+        report = compare(eager, backend, samples)
+        ok = report["max_abs_diff"] <= tolerance(name)
+        rates = [faces_per_sec(backend, b, args.iters) for b in args.batch]
+        baseline = baseline or rates
+        print(f"{name:12s} {report['max_abs_diff']:9.5f} {report['label_agreement']:6.3f} {'yes' if ok else 'NO':>3s}  "
+              + "  ".join(f"{r:6.1f} {r / base:3.1f}x" for r, base in zip(rates, baseline)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Bulk media scanning for /predict/batch and the offline scanner CLI
+(detect_face_real_or_fake.py scan).
+
+Items are ingested one at a time and submitted to the bulk pool for their
+media type (BULK_<KIND>_WORKERS threads, separate from the /predict pools so
+a large scan never makes interactive calls answer "server_busy"), with at
+most BULK_MAX_IN_FLIGHT in the air. An item is a multipart file, a member of
+a .zip archive, or a local path. Items of one kind that are in flight
+together meet in that model's cross-request batcher, so the detectors see
+full batches. With MODEL_WORKERS > 0 the forward passes run
+on the model worker processes. Results are yielded in completion order, and
+history records are written with insert_many in chunks of BULK_INSERT_SIZE.
+"""
+import json
+import os
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from analysis import analyze_and_close, result_record
+from executors import bulk_executor
+from metrics import observe_stage
+from upload_utils import ingest_upload
+
+BULK_MAX_IN_FLIGHT = int(os.getenv("BULK_MAX_IN_FLIGHT", "32"))
+BULK_INSERT_SIZE = int(os.getenv("BULK_INSERT_SIZE", "500"))
+# Largest archive member accepted (uncompressed, as declared in the zip)
+BULK_MAX_ITEM_BYTES = int(os.getenv("BULK_MAX_ITEM_BYTES", str(512 * 1024 * 1024)))
+
+ZIP_TYPES = ("application/zip", "application/x-zip-compressed")
+
+
+def is_zip(name, content_type=None):
+    return content_type in ZIP_TYPES or (name or "").lower().endswith(".zip")
+
+
+def _open_member(zf, info):
+    if info.file_size > BULK_MAX_ITEM_BYTES:
+        raise ValueError(f"{info.filename} is {info.file_size} bytes (limit {BULK_MAX_ITEM_BYTES})")
+    return zf.open(info)
+
+
+def _failing_opener(error):
+    def opener():
+        raise error
+    return opener
+
+
+def expand_items(name, opener, content_type=None):
+    """
+    Yield (name, opener, content_type) for one item, or for every file in it
+    when it is a zip archive (named "<archive>/<member>"). `opener()` returns
+    a binary file object that the scanner closes.
+    """
+    if not is_zip(name, content_type):
+        yield name, opener, content_type
+        return
+    try:
+        with opener() as f, zipfile.ZipFile(f) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or info.filename.startswith("__MACOSX/"):
+                    continue
+                yield f"{name}/{info.filename}", (lambda info=info: _open_member(zf, info)), None
+    except (OSError, zipfile.BadZipFile) as e:
+        # Reported as a failed item, the rest of the scan goes on
+        yield name, _failing_opener(e), None
+
+
+def iter_path_items(target):
+    """
+    Items for a directory (walked recursively, in sorted order) or a manifest
+    file: one path per line, or JSON lines with a "path" field. Relative
+    manifest paths are resolved against the manifest's folder. Zip files
+    found either way are expanded.
+    """
+    if os.path.isdir(target):
+        paths = (os.path.join(root, f)
+                 for root, dirs, files in sorted(os.walk(target))
+                 for f in sorted(files))
+    else:
+        base = os.path.dirname(os.path.abspath(target))
+        with open(target) as f:
+            lines = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+        paths = (os.path.join(base, json.loads(line)["path"] if line.startswith("{") else line) for line in lines)
+    for path in paths:
+        yield from expand_items(path, lambda path=path: open(path, "rb"))
+
+
+class HistoryBatch:
+    """History records for one user, written with insert_many every `size` records."""
+
+    def __init__(self, collection, user_email, size=BULK_INSERT_SIZE):
+        self.collection = collection
+        self.user_email = user_email
+        self.size = max(1, int(size))
+        self.written = 0
+        self._records = []
+
+    def add(self, record):
+        if self.collection is None or not self.user_email:
+            return
+        self._records.append({"user_email": self.user_email, **record})
+        if len(self._records) >= self.size:
+            self.flush()
+
+    def flush(self):
+        if not self._records:
+            return
+        records, self._records = self._records, []
+        try:
+            t0 = time.perf_counter()
+            self.collection.insert_many(records, ordered=False)
+            observe_stage("db_write", time.perf_counter() - t0)
+            self.written += len(records)
+            print(f"Saved {len(records)} history records for {self.user_email}")
+        except Exception as e:
+            print(f"Error saving history batch: {e}")
+
+
+def _drain(pending, history):
+    done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+    for future in done:
+        index, name, upload = pending.pop(future)
+        try:
+            analysis = future.result()
+        except Exception as e:
+            analysis = {"error": "prediction_failed", "detail": str(e)}
+        if "error" in analysis:
+            yield {"index": index, "filename": name, **analysis}
+            continue
+        record = result_record(upload, analysis)
+        history.add(record)
+        yield {"index": index, **record}
+
+
+def scan(items, user_email=None, history_col=None, audio_mode=None, max_in_flight=BULK_MAX_IN_FLIGHT):
+    """
+    Analyze (name, opener, content_type) items and yield one result dict per
+    item ({"index", "filename", ...} or an error), as each completes. With
+    `user_email` and `history_col`, results also go to history in bulk.
+    """
+    history = HistoryBatch(history_col, user_email)
+    pending = {}
+    try:
+        for index, (name, opener, content_type) in enumerate(items):
+            try:
+                with opener() as f:
+                    upload = ingest_upload(f, name, content_type)
+            except Exception as e:
+                yield {"index": index, "filename": name, "error": "file_save_failed", "detail": str(e)}
+                continue
+            # Bulk pool for this kind (not /predict's); waits for a slot instead of shedding the item
+            future = bulk_executor(upload.kind).submit(analyze_and_close, upload, audio_mode=audio_mode, block=True)
+            pending[future] = (index, name, upload)
+            if len(pending) >= max_in_flight:
+                yield from _drain(pending, history)
+        while pending:
+            yield from _drain(pending, history)
+    finally:
+        history.flush()
@@ -1,5 +1,7 @@
-from pymongo import MongoClient
+from pymongo import ASCENDING, DESCENDING, MongoClient
+from pymongo.monitoring import ConnectionPoolListener
 import os
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -7,25 +9,192 @@ load_dotenv()
 MONGODB_URL = os.getenv("MONGODB_URL")
 DB_NAME = os.getenv("DB_NAME", "deepfake_db")
 
+# Connection pool, timeouts and write concern of the per-process client
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000"))
+# Write concern: unset values keep whatever MONGODB_URL (e.g. w=majority) or the server says
+MONGO_WRITE_CONCERN = os.getenv("MONGO_WRITE_CONCERN", "")
+MONGO_WRITE_JOURNAL = os.getenv("MONGO_WRITE_JOURNAL", "")
+MONGO_WRITE_TIMEOUT_MS = os.getenv("MONGO_WRITE_TIMEOUT_MS", "")
+
 client = None
 db = None
+# Process that created `client`: a forked child (uvicorn --workers, model workers)
+# must not reuse its parent's sockets and monitor threads
+_client_pid = None
+_client_lock = threading.Lock()
 
-def connect_db():
-    global client, db
+# Serves history pages (keyset on timestamp/_id), counts and clears for one user
+HISTORY_INDEX = [("user_email", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)]
+
+
+class PoolStats(ConnectionPoolListener):
+    """Connection pool counters for this process, from PyMongo's CMAP events"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = {"created": 0, "closed": 0, "checked_out": 0, "checked_in": 0,
+                           "checkout_failed": 0, "pools_cleared": 0}
+
+    def _inc(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._inc("pools_cleared")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._inc("created")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._inc("closed")
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._inc("checkout_failed")
+
+    def connection_checked_out(self, event):
+        self._inc("checked_out")
+
+    def connection_checked_in(self, event):
+        self._inc("checked_in")
+
+    def snapshot(self):
+        with self._lock:
+            c = dict(self.counts)
+        c["open"] = c["created"] - c["closed"]
+        c["in_use"] = c["checked_out"] - c["checked_in"]
+        return c
+
+
+_pool_stats = PoolStats()
+
+def ensure_indexes(database):
+    """Create the indexes the queries rely on (no-op when they already exist)"""
     try:
-        client = MongoClient(MONGODB_URL)
-        db = client[DB_NAME]
-        print("Connected to MongoDB")
+        database["history"].create_index(HISTORY_INDEX, name="user_email_timestamp_id")
+        print("MongoDB indexes ready")
     except Exception as e:
-        print(f"Could not connect to MongoDB: {e}")
+        print(f"Could not create MongoDB indexes: {e}")
+
+def _write_concern():
+    """MongoClient keyword arguments for the configured write concern"""
+    options = {}
+    if MONGO_WRITE_CONCERN:
+        w = MONGO_WRITE_CONCERN
+        options["w"] = int(w) if w.isdigit() else w
+    if MONGO_WRITE_JOURNAL:
+        options["journal"] = MONGO_WRITE_JOURNAL == "1"
+    if MONGO_WRITE_TIMEOUT_MS:
+        options["wTimeoutMS"] = int(MONGO_WRITE_TIMEOUT_MS)
+    return options
+
+def connect_db():
+    """
+    Create this process's client once (again after a fork). Calling it when
+    the client already exists is a no-op, so the pool is never replaced.
+    """
+    global client, db, _client_pid
+    with _client_lock:
+        if client is not None and _client_pid == os.getpid():
+            return db
+        if client is not None:
+            # Inherited across fork: drop the reference without closing the parent's sockets
+            print("MongoDB client inherited from parent process; creating a new one")
+            _pool_stats.reset()
+        try:
+            # connect=False: no sockets or monitor threads until the first operation
+            client = MongoClient(
+                MONGODB_URL,
+                connect=False,
+                appname="deepfake-backend",
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+                waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                event_listeners=[_pool_stats],
+                **_write_concern(),
+            )
+            _client_pid = os.getpid()
+            db = client[DB_NAME]
+            print(f"MongoDB client ready (pid {_client_pid}, maxPoolSize {MONGO_MAX_POOL_SIZE})")
+            # In the background: an unreachable server must not hold up startup
+            threading.Thread(target=ensure_indexes, args=(db,), name="mongo-indexes", daemon=True).start()
+        except Exception as e:
+            client = db = _client_pid = None
+            print(f"Could not connect to MongoDB: {e}")
+    return db
 
 def get_db():
-    if db is None:
-        connect_db()
+    if db is None or _client_pid != os.getpid():
+        return connect_db()
     return db
 
+def get_collection(name):
+    database = get_db()
+    if database is None:
+        raise RuntimeError("MongoDB is not configured")
+    return database[name]
+
+def get_users_col():
+    """FastAPI dependency: the users collection of this process's client"""
+    return get_collection("users")
+
+def get_history_col():
+    """FastAPI dependency: the history collection of this process's client"""
+    return get_collection("history")
+
+def db_health():
+    """Ping the server and report the client's pool settings and counters"""
+    status = {
+        "pid": os.getpid(),
+        "client_pid": _client_pid,
+        "pool": {
+            "max_size": MONGO_MAX_POOL_SIZE,
+            "min_size": MONGO_MIN_POOL_SIZE,
+            **_pool_stats.snapshot(),
+        },
+    }
+    try:
+        database = get_db()
+        status["write_concern"] = database.write_concern.document
+        database.client.admin.command("ping")
+        status["ok"] = True
+    except Exception as e:
+        status["ok"] = False
+        status["error"] = f"{type(e).__name__}: {e}"
+    return status
+
 def close_db():
-    global client
-    if client:
-        client.close()
-        print("MongoDB connection closed.")
+    global client, db, _client_pid
+    with _client_lock:
+        if client is not None and _client_pid == os.getpid():
+            client.close()
+            print("MongoDB connection closed.")
+        client = db = _client_pid = None
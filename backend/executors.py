@@ -0,0 +1,179 @@
+"""
+Per-model execution pools.
+
+Each model family (Keras audio, Keras image, torch video) runs on its own
+bounded thread pool, and blocking MongoDB calls run on a small separate pool.
+Async handlers await work on these pools instead of sharing Starlette's default
+threadpool, so a burst of video uploads can only fill the video pool and never
+delays logins or history reads. Bulk scans (/predict/batch, the scan CLI) use
+separate, wider "bulk-<kind>" pools: they keep enough items in flight to fill
+the model batchers without taking the slots interactive /predict calls need.
+
+Model pool widths default to the number of concurrent requests that make
+one full micro-batch (batch size / rows per request), so under load the
+batcher actually forms batches. Wider pools mean more requests preprocess in
+parallel (CPU and memory); set the *_WORKERS variables lower to trade
+batching for a smaller footprint.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from batching import BATCH_MAX_SIZE
+
+
+def _requests_per_batch(batch_rows, rows_per_request):
+    """Concurrent requests it takes to fill one batch of `batch_rows`"""
+    return max(1, -(-int(batch_rows) // max(1, int(rows_per_request))))
+
+
+# Rows one request puts in its model's batcher: one image, up to AUDIO_MAX_SEGMENTS
+# audio segments, up to VIDEO_NUM_FRAMES faces (batched by at most VIDEO_BATCH_MAX_SIZE)
+_DEFAULT_WORKERS = {
+    "audio": _requests_per_batch(BATCH_MAX_SIZE, os.getenv("AUDIO_MAX_SEGMENTS", "10")),
+    "image": _requests_per_batch(BATCH_MAX_SIZE, 1),
+    "video": _requests_per_batch(os.getenv("VIDEO_BATCH_MAX_SIZE", "16"), os.getenv("VIDEO_NUM_FRAMES", "8")),
+}
+
+AUDIO_EXECUTOR_WORKERS = int(os.getenv("AUDIO_EXECUTOR_WORKERS", str(_DEFAULT_WORKERS["audio"])))
+IMAGE_EXECUTOR_WORKERS = int(os.getenv("IMAGE_EXECUTOR_WORKERS", str(_DEFAULT_WORKERS["image"])))
+VIDEO_EXECUTOR_WORKERS = int(os.getenv("VIDEO_EXECUTOR_WORKERS", str(_DEFAULT_WORKERS["video"])))
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "4"))
+BULK_AUDIO_WORKERS = int(os.getenv("BULK_AUDIO_WORKERS", str(_DEFAULT_WORKERS["audio"])))
+BULK_IMAGE_WORKERS = int(os.getenv("BULK_IMAGE_WORKERS", str(_DEFAULT_WORKERS["image"])))
+BULK_VIDEO_WORKERS = int(os.getenv("BULK_VIDEO_WORKERS", str(_DEFAULT_WORKERS["video"])))
+EXECUTOR_QUEUE_SIZE = int(os.getenv("EXECUTOR_QUEUE_SIZE", "16"))
+
+_POOL_WORKERS = {
+    "audio": AUDIO_EXECUTOR_WORKERS,
+    "image": IMAGE_EXECUTOR_WORKERS,
+    "video": VIDEO_EXECUTOR_WORKERS,
+    "db": DB_EXECUTOR_WORKERS,
+    "bulk-audio": BULK_AUDIO_WORKERS,
+    "bulk-image": BULK_IMAGE_WORKERS,
+    "bulk-video": BULK_VIDEO_WORKERS,
+}
+
+
+class ExecutorBusy(RuntimeError):
+    """Raised when a pool already has its maximum of queued + running tasks."""
+
+
+class BoundedExecutor:
+    """ThreadPoolExecutor that admits at most `workers + max_queue` tasks at a time."""
+
+    def __init__(self, name, workers, max_queue=EXECUTOR_QUEUE_SIZE):
+        self.name = name
+        self.workers = max(1, int(workers))
+        self.capacity = self.workers + max(0, int(max_queue))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"pool-{name}")
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "rejected": 0, "running": 0, "completed": 0, "failed": 0,
+                       "total_queue_ms": 0.0, "total_run_ms": 0.0}
+
+    def submit(self, fn, *args, block=False, **kwargs):
+        """
+        Run `fn(*args, **kwargs)` on this pool and return its Future. Raises
+        ExecutorBusy when the pool is full, unless `block` is set (bulk scans
+        wait for a slot instead of being shed).
+        """
+        if not self._slots.acquire(blocking=block):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise ExecutorBusy(f"{self.name} pool is full")
+        with self._lock:
+            self._stats["submitted"] += 1
+        submitted_at = time.perf_counter()
+        try:
+            future = self._executor.submit(self._call, submitted_at, fn, args, kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        # Released on completion or cancellation, so a slot can never leak
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _call(self, submitted_at, fn, args, kwargs):
+        started = time.perf_counter()
+        with self._lock:
+            self._stats["running"] += 1
+            self._stats["total_queue_ms"] += (started - submitted_at) * 1000.0
+        ok = False
+        try:
+            result = fn(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            with self._lock:
+                self._stats["running"] -= 1
+                self._stats["completed" if ok else "failed"] += 1
+                self._stats["total_run_ms"] += (time.perf_counter() - started) * 1000.0
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Await `fn(*args, **kwargs)` on this pool from an async handler. If the
+        awaiting request is cancelled the task still runs to completion, so it
+        can clean up after itself.
+        """
+        return await asyncio.shield(asyncio.wrap_future(self.submit(fn, *args, **kwargs)))
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+        finished = s["completed"] + s["failed"]
+        started = finished + s["running"]
+        s["workers"] = self.workers
+        s["capacity"] = self.capacity
+        s["queued"] = max(0, s["submitted"] - started)
+        s["avg_queue_ms"] = s.pop("total_queue_ms") / started if started else 0.0
+        s["avg_run_ms"] = s.pop("total_run_ms") / finished if finished else 0.0
+        return s
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait)
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name):
+    """Shared pool for "audio", "image", "video", "db" or "bulk-<kind>"."""
+    ex = _executors.get(name)
+    if ex is None:
+        with _executors_lock:
+            ex = _executors.get(name)
+            if ex is None:
+                if name not in _POOL_WORKERS:
+                    raise ValueError(f"Unknown executor pool: {name}")
+                ex = _executors[name] = BoundedExecutor(name, _POOL_WORKERS[name])
+    return ex
+
+
+def model_executor(kind):
+    """Pool for an upload kind; anything unrecognized shares the image pool."""
+    return get_executor(kind if kind in ("audio", "image", "video") else "image")
+
+
+def bulk_executor(kind):
+    """Bulk-scan pool for an upload kind, separate from the interactive one."""
+    return get_executor("bulk-" + (kind if kind in ("audio", "image", "video") else "image"))
+
+
+async def run_db(fn, *args, **kwargs):
+    """Await a blocking pymongo call on the DB pool."""
+    return await get_executor("db").run(fn, *args, **kwargs)
+
+
+def executor_stats():
+    with _executors_lock:
+        return {name: ex.stats() for name, ex in _executors.items()}
+
+
+def shutdown_executors(wait=False):
+    with _executors_lock:
+        for ex in _executors.values():
+            ex.shutdown(wait=wait)
@@ -0,0 +1,221 @@
+"""
+Frame sampling strategies for video analysis.
+
+Seeking with CAP_PROP_POS_FRAMES makes the decoder restart from the previous
+keyframe for every sample, which on long-GOP H.264 costs nearly as much as
+decoding the whole clip. This module picks, per file, the cheapest way to pull
+`num_frames` evenly spaced frames:
+
+- "seek":     cap.set() + read() per target (cheap when the GOP is short)
+- "scan":     one sequential pass with grab(), retrieve() only on targets
+- "keyframe": decode keyframes only (PyAV) and take the ones nearest the targets
+- "stream":   single pass for files whose frame count is unknown
+"""
+import os
+from collections import Counter
+
+import cv2
+import numpy as np
+
+VIDEO_FRAME_SAMPLER = os.getenv("VIDEO_FRAME_SAMPLER", "auto")
+VIDEO_ASSUMED_GOP = int(os.getenv("VIDEO_ASSUMED_GOP", "250"))
+GOP_PROBE_PACKETS = 600
+
+STRATEGIES = ("auto", "seek", "scan", "keyframe", "stream")
+
+
+def target_indices(frame_count, num_frames):
+    """Evenly spaced frame indices, the same ones analyze_video always used."""
+    return np.linspace(0, frame_count - 1, num_frames, dtype=int)
+
+
+def probe_gop(video_path):
+    """Average keyframe interval from demuxed packets (no decoding). Needs PyAV."""
+    try:
+        import av
+    except ImportError:
+        return None
+    try:
+        with av.open(video_path) as container:
+            stream = container.streams.video[0]
+            keyframes = []
+            for n, packet in enumerate(container.demux(stream)):
+                if packet.size and packet.is_keyframe:
+                    keyframes.append(n)
+                if n >= GOP_PROBE_PACKETS:
+                    break
+        if len(keyframes) < 2:
+            return None
+        return float(np.mean(np.diff(keyframes)))
+    except Exception as e:
+        print(f"[Sampler] GOP probe failed: {e}")
+        return None
+
+
+def choose_strategy(frame_count, num_frames, gop=None):
+    """
+    Pick seek vs scan from a simple decode-cost model: a seek decodes on average
+    half a GOP, a scan decodes every frame up to the last target.
+    """
+    if frame_count <= 0:
+        return "stream"
+    gop = gop or VIDEO_ASSUMED_GOP
+    seek_cost = num_frames * (gop / 2.0 + 1)
+    scan_cost = frame_count
+    return "scan" if scan_cost <= seek_cost else "seek"
+
+
+def _sample_seek(cap, indices):
+    for i in indices:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(i))
+        ret, frame = cap.read()
+        if ret:
+            yield int(i), frame
+
+
+def _sample_scan(cap, indices):
+    wanted = Counter(int(i) for i in indices)
+    last = max(wanted)
+    pos = 0
+    while pos <= last:
+        if not cap.grab():
+            break
+        if pos in wanted:
+            ret, frame = cap.retrieve()
+            if ret:
+                for _ in range(wanted[pos]):
+                    yield pos, frame
+        pos += 1
+
+
+def _sample_stream(cap, num_frames):
+    """
+    One pass over a clip of unknown length: keep every `stride`-th frame and
+    double the stride whenever the buffer fills, so memory stays bounded and
+    only kept frames are color-converted.
+    """
+    capacity = max(2, num_frames * 2)
+    stride = 1
+    kept = []
+    pos = 0
+    while cap.grab():
+        if pos % stride == 0:
+            ret, frame = cap.retrieve()
+            if ret:
+                kept.append((pos, frame))
+            if len(kept) >= capacity:
+                kept = kept[::2]
+                stride *= 2
+        pos += 1
+    if not kept:
+        return [], pos
+    picks = target_indices(len(kept), num_frames)
+    return [kept[i] for i in picks], pos
+
+
+def _sample_keyframes(video_path, indices):
+    """
+    Yield the keyframe nearest each target, walking the keyframes as a stream:
+    only the previous keyframe is held, a target is emitted as soon as the
+    next keyframe is farther from it, and decoding stops after the last target.
+    """
+    import av
+
+    indices = [int(i) for i in indices]
+    t = 0
+    prev = None  # [position, av frame, bgr ndarray or None]
+
+    def emit(kf):
+        if kf[2] is None:
+            kf[2] = kf[1].to_ndarray(format="bgr24")
+        return kf[0], kf[2]
+
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        stream.codec_context.skip_frame = "NONKEY"
+        fps = float(stream.average_rate or stream.guessed_rate or 25)
+        for frame in container.decode(stream):
+            ts = float(frame.pts * frame.time_base) if frame.pts is not None else 0.0
+            pos = int(round(ts * fps))
+            # Targets closer to the previous keyframe than to this one (ties go to the earlier)
+            while t < len(indices) and prev is not None and abs(prev[0] - indices[t]) <= abs(pos - indices[t]):
+                yield emit(prev)
+                t += 1
+            if t == len(indices):
+                return
+            prev = [pos, frame, None]
+    while prev is not None and t < len(indices):
+        yield emit(prev)
+        t += 1
+
+
+def iter_frames(video_path, num_frames, strategy=None, info=None):
+    """
+    Yield (frame_index, bgr_frame) for `num_frames` evenly spaced frames as they
+    are decoded. `info` (a dict, if given) receives the strategy used and the
+    frame count; info["opened"] is False when the file cannot be opened.
+    """
+    info = {} if info is None else info
+    strategy = strategy or VIDEO_FRAME_SAMPLER
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown frame sampling strategy: {strategy}")
+    info.update(strategy=strategy, frame_count=0, opened=True)
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        info["opened"] = False
+        return
+    try:
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        info["frame_count"] = frame_count
+
+        if strategy == "keyframe" and frame_count > 0:
+            yielded = False
+            try:
+                for item in _sample_keyframes(video_path, target_indices(frame_count, num_frames)):
+                    yielded = True
+                    yield item
+                if yielded:
+                    return
+            except ImportError:
+                print("[Sampler] PyAV not installed; falling back to sequential scan")
+            except Exception as e:
+                if yielded:
+                    # Part of the frames are out already; a rescan would repeat them
+                    print(f"[Sampler] Keyframe decode stopped early ({e})")
+                    return
+                print(f"[Sampler] Keyframe decode failed ({e}); falling back to sequential scan")
+            strategy = "scan"
+
+        if strategy == "auto":
+            gop = probe_gop(video_path) if frame_count > 0 else None
+            strategy = choose_strategy(frame_count, num_frames, gop)
+
+        if frame_count <= 0 or strategy == "stream":
+            info["strategy"] = "stream"
+            frames, counted = _sample_stream(cap, num_frames)
+            info["frame_count"] = counted
+            yield from frames
+            return
+
+        info["strategy"] = strategy
+        indices = target_indices(frame_count, num_frames)
+        if strategy == "scan":
+            yield from _sample_scan(cap, indices)
+        else:
+            yield from _sample_seek(cap, indices)
+    finally:
+        cap.release()
+
+
+def sample_frames(video_path, num_frames, strategy=None):
+    """
+    Return ([(frame_index, bgr_frame), ...], info) for `num_frames` evenly spaced
+    frames, or (None, info) if the video cannot be opened. `info` records the
+    strategy used and the frame count.
+    """
+    info = {}
+    frames = list(iter_frames(video_path, num_frames, strategy=strategy, info=info))
+    if not info.get("opened", False):
+        return None, info
+    return frames, info
@@ -0,0 +1,81 @@
+"""
+Paginated history reads.
+
+Pages are ordered newest first by (timestamp, _id) and fetched by keyset:
+the cursor handed to the client encodes the last row's timestamp and _id,
+and the next page starts strictly after it. Every page is then one bounded
+walk of the (user_email, timestamp, _id) index created by connect_db, no
+matter how deep into the history it is, and no skip() is needed.
+"""
+import base64
+import os
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "500"))
+
+# Fields a client may ask for; _id and timestamp always come back (they make the cursor)
+HISTORY_FIELDS = ("filename", "label", "confidence", "content_type", "detail", "cached", "model_version",
+                  "timestamp")
+SORT = [("timestamp", -1), ("_id", -1)]
+
+
+class InvalidCursor(ValueError):
+    """Raised for a cursor that was not produced by encode_cursor."""
+
+
+def encode_cursor(item):
+    raw = f"{item['timestamp']}|{item['_id']}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, _, oid = raw.rpartition("|")
+        return timestamp, ObjectId(oid)
+    except (ValueError, UnicodeDecodeError, InvalidId) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+
+def parse_fields(fields):
+    """Projection for a comma-separated field list (None = every field)."""
+    if not fields:
+        return None
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in names if f not in HISTORY_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)} (choose from {', '.join(HISTORY_FIELDS)})")
+    return {name: 1 for name in set(names) | {"timestamp"}}
+
+
+def history_page(collection, email, limit=HISTORY_PAGE_SIZE, cursor=None, fields=None):
+    """
+    One page of `email`'s history, newest first:
+    {"history": [...], "next_cursor": str or None}.
+    limit=None without a cursor returns the whole history (the original
+    unpaginated response, for clients that don't follow next_cursor).
+    """
+    query = {"user_email": email}
+    if limit is None and not cursor:
+        items = list(collection.find(query, parse_fields(fields)).sort(SORT))
+        for item in items:
+            item["_id"] = str(item["_id"])
+        return {"history": items, "next_cursor": None}
+    limit = max(1, min(int(limit or HISTORY_PAGE_SIZE), HISTORY_MAX_PAGE_SIZE))
+    if cursor:
+        timestamp, oid = decode_cursor(cursor)
+        query["$or"] = [{"timestamp": {"$lt": timestamp}}, {"timestamp": timestamp, "_id": {"$lt": oid}}]
+    # One extra row tells whether another page exists
+    items = list(collection.find(query, parse_fields(fields)).sort(SORT).limit(limit + 1))
+    next_cursor = encode_cursor(items[limit - 1]) if len(items) > limit else None
+    items = items[:limit]
+    for item in items:
+        item["_id"] = str(item["_id"])
+    return {"history": items, "next_cursor": next_cursor}
+
+
+def history_count(collection, email):
+    return collection.count_documents({"user_email": email})
@@ -0,0 +1,307 @@
+"""
+Write-behind buffer for prediction history.
+
+/predict and /jobs hand their history record to the writer and respond right
+away. A background thread collects records and writes them with one
+insert_many whenever HISTORY_BATCH_SIZE are queued or HISTORY_FLUSH_INTERVAL
+seconds have passed. Failed writes are retried with exponential backoff.
+Batches that still fail, and records that arrive while the queue is full, are
+appended to a local JSON-lines spill file. The file is replayed into
+MongoDB once writes succeed again. Records keep the _id assigned on the
+first attempt, so a replay never duplicates a record that did reach the
+database.
+
+Each process spills to its own file (HISTORY_SPILL_FILE with the pid added
+before the extension), so uvicorn workers never append to or replay the same
+file. A replay first claims the file by renaming it. Besides its own file, a
+process also claims the files of processes that have exited, so nothing is
+stranded after a restart.
+
+stop() drains the queue before the process exits (called from the shutdown
+handler).
+"""
+import glob
+import os
+import queue
+import re
+import threading
+import time
+
+from bson import json_util
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from metrics import observe_stage
+
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "1") != "0"
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "100"))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0"))
+HISTORY_QUEUE_SIZE = int(os.getenv("HISTORY_QUEUE_SIZE", "10000"))
+HISTORY_MAX_RETRIES = int(os.getenv("HISTORY_MAX_RETRIES", "3"))
+HISTORY_RETRY_BACKOFF = float(os.getenv("HISTORY_RETRY_BACKOFF", "0.5"))
+HISTORY_SPILL_FILE = os.getenv("HISTORY_SPILL_FILE") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "history_spill.jsonl"
+)
+# Seconds between attempts to replay the spill file
+HISTORY_REPLAY_INTERVAL = float(os.getenv("HISTORY_REPLAY_INTERVAL", "30"))
+
+DUPLICATE_KEY = 11000
+REPLAY_SUFFIX = ".replay"
+
+
+def process_spill_path(base, pid=None):
+    """history_spill.jsonl -> history_spill.<pid>.jsonl"""
+    root, ext = os.path.splitext(base)
+    return f"{root}.{os.getpid() if pid is None else pid}{ext}"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class HistoryWriter:
+    def __init__(self, collection, batch_size=HISTORY_BATCH_SIZE, flush_interval=HISTORY_FLUSH_INTERVAL,
+                 max_queue=HISTORY_QUEUE_SIZE, spill_path=HISTORY_SPILL_FILE, retries=HISTORY_MAX_RETRIES,
+                 backoff=HISTORY_RETRY_BACKOFF):
+        self.collection = collection
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+        self.spill_base = spill_path
+        self.spill_path = process_spill_path(spill_path)
+        self.retries = retries
+        self.backoff = backoff
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._stopping = threading.Event()
+        self._spill_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._last_replay = 0.0
+        self._stats = {"queued": 0, "written": 0, "batches": 0, "retries": 0, "spilled": 0, "replayed": 0,
+                       "last_error": None, "total_write_ms": 0.0}
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def add(self, record):
+        """Queue one history record; never blocks (spills when the queue is full)."""
+        try:
+            self._queue.put_nowait(record)
+            self._count("queued")
+        except queue.Full:
+            self._spill([record])
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self._stats[key] += n
+
+    def _run(self):
+        self._guarded(self._replay_spill)
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = []
+            try:
+                batch = self._next_batch()
+                if batch:
+                    self._write(batch)
+                    batch = []
+            except Exception as e:
+                # Keep the thread alive whatever happens; the batch in hand is spilled
+                self._set_error(e)
+                print(f"[History] Writer error: {type(e).__name__}: {e}")
+                if batch:
+                    self._spill(batch)
+            if time.monotonic() - self._last_replay > HISTORY_REPLAY_INTERVAL and not self._stopping.is_set():
+                self._guarded(self._replay_spill)
+
+    def _guarded(self, fn):
+        try:
+            fn()
+        except Exception as e:
+            self._set_error(e)
+            print(f"[History] {fn.__name__} failed: {type(e).__name__}: {e}")
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if self._stopping.is_set() or remaining <= 0:
+                    # Take what is already queued, without waiting for more
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        """insert_many with retries; whatever can't be written is spilled. True if nothing was spilled."""
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            t0 = time.perf_counter()
+            try:
+                self.collection.insert_many(batch, ordered=False)
+                self._record_write(len(batch), t0)
+                return True
+            except BulkWriteError as e:
+                # Per-record failures: already-present _ids count as written, the rest are spilled
+                errors = e.details.get("writeErrors", [])
+                failed = [batch[err["index"]] for err in errors if err.get("code") != DUPLICATE_KEY]
+                self._record_write(len(batch) - len(failed), t0)
+                if failed:
+                    self._set_error(e)
+                    self._spill(failed)
+                return not failed
+            except PyMongoError as e:
+                self._set_error(e)
+                # Don't hold shutdown up with backoff sleeps
+                if attempt == self.retries or self._stopping.is_set():
+                    break
+                self._count("retries")
+                time.sleep(delay)
+                delay *= 2
+            except Exception as e:
+                # Not a server error (e.g. an unencodable record): retrying won't help
+                self._set_error(e)
+                break
+        print(f"[History] Could not write {len(batch)} records, spilling to {self.spill_path}")
+        self._spill(batch)
+        return False
+
+    def _record_write(self, n, t0):
+        elapsed = time.perf_counter() - t0
+        observe_stage("db_write", elapsed)
+        with self._stats_lock:
+            self._stats["written"] += n
+            self._stats["batches"] += 1
+            self._stats["total_write_ms"] += elapsed * 1000.0
+
+    def _set_error(self, e):
+        with self._stats_lock:
+            self._stats["last_error"] = f"{type(e).__name__}: {e}"
+
+    def _spill(self, records):
+        try:
+            with self._spill_lock, open(self.spill_path, "a") as f:
+                for record in records:
+                    f.write(json_util.dumps(record) + "\n")
+            self._count("spilled", len(records))
+        except Exception as e:
+            print(f"[History] Could not spill {len(records)} records: {e}")
+
+    def _spill_files(self):
+        """
+        Spill files this process may replay: its own, and those (live or
+        mid-replay) of processes that have exited. Mid-replay files come first.
+        """
+        root, ext = os.path.splitext(self.spill_base)
+        pattern = re.compile(re.escape(root) + r"(?:\.(\d+))?" + re.escape(ext)
+                             + "(?:" + re.escape(REPLAY_SUFFIX) + r"(?:-(\d+))?)?$")
+        files = []
+        for path in glob.glob(glob.escape(root) + "*"):
+            match = pattern.match(path)
+            if not match:
+                continue
+            owner = match.group(2) or match.group(1)
+            if owner is None or int(owner) == os.getpid() or not _pid_alive(int(owner)):
+                files.append((REPLAY_SUFFIX not in path[len(root):], path))
+        return [path for _, path in sorted(files)]
+
+    def _replay_spill(self):
+        self._last_replay = time.monotonic()
+        for path in self._spill_files():
+            self._replay_file(path)
+
+    def _replay_file(self, path):
+        # Claim the file by renaming it: another process doing the same gets ENOENT
+        claimed = path.split(REPLAY_SUFFIX)[0] + f"{REPLAY_SUFFIX}-{os.getpid()}"
+        if claimed != path:
+            try:
+                with self._spill_lock:
+                    os.replace(path, claimed)
+            except FileNotFoundError:
+                return
+        try:
+            with open(claimed) as f:
+                records = [json_util.loads(line) for line in f if line.strip()]
+        except Exception as e:
+            print(f"[History] Could not read spill file {claimed}: {e}")
+            return
+        print(f"[History] Replaying {len(records)} spilled records from {path}")
+        for i in range(0, len(records), self.batch_size):
+            chunk = records[i:i + self.batch_size]
+            if self._write(chunk):
+                self._count("replayed", len(chunk))
+        # Failed chunks were spilled again to this process's live file
+        try:
+            os.remove(claimed)
+        except FileNotFoundError:
+            pass
+
+    def stop(self, timeout=10.0):
+        """Flush everything still queued and stop the thread."""
+        self._stopping.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            print(f"[History] Writer did not drain in {timeout}s; {self._queue.qsize()} records left")
+
+    def stats(self):
+        with self._stats_lock:
+            s = dict(self._stats)
+        batches = s["batches"]
+        s["avg_write_ms"] = s.pop("total_write_ms") / batches if batches else 0.0
+        s["pending"] = self._queue.qsize()
+        s["spill_file"] = self.spill_path if os.path.exists(self.spill_path) else None
+        return s
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def start_history_writer(collection):
+    """Start the process-wide writer for `collection` (no-op with HISTORY_WRITE_BEHIND=0)."""
+    global _writer
+    if not HISTORY_WRITE_BEHIND:
+        return None
+    with _writer_lock:
+        if _writer is None:
+            _writer = HistoryWriter(collection)
+    return _writer
+
+
+def write_history(collection, record):
+    """Queue `record` on the writer, or insert it right away when write-behind is off."""
+    writer = _writer
+    if writer is not None:
+        writer.add(record)
+        return
+    t0 = time.perf_counter()
+    collection.insert_one(record)
+    observe_stage("db_write", time.perf_counter() - t0)
+
+
+def history_writer_running():
+    """True when write_history() only queues (no blocking insert)"""
+    return _writer is not None
+
+
+def history_writer_stats():
+    writer = _writer
+    if writer is None:
+        return {"enabled": False}
+    return {"enabled": True, **writer.stats()}
+
+
+def stop_history_writer(timeout=10.0):
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.stop(timeout)
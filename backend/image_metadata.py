@@ -0,0 +1,227 @@
+"""
+Targeted image metadata scanner.
+
+Walks only the container segments that can carry provenance metadata (JPEG
+APPn/COM, PNG tEXt/zTXt/iTXt/eXIf, WebP EXIF/XMP, plus any trailer after the
+end of the image) and matches every AI keyword in one regex pass per buffer.
+Pixel data is skipped with seeks instead of being read, and nothing is
+lowercased: the pattern is case-insensitive. Formats without a parser fall
+back to a bounded head/tail byte scan.
+"""
+import re
+import struct
+import zlib
+
+AI_KEYWORDS = [
+    "google", "gemini", "synthetic", "ai-generated", "dall-e", "midjourney",
+    "stable diffusion", "stablediffusion", "artificial", "adobe firefly",
+    "synthid", "imagogen", "parti", "deepfake", "generated with", "creator: google",
+    "software: google", "google ai", "imagen", "vertex ai"
+]
+
+# Longest first so overlapping keywords resolve to the longest match at a position;
+# shorter keywords inside a match are recovered in _keywords_in.
+_KEYWORD_RE = re.compile(
+    b"|".join(re.escape(kw.encode()) for kw in sorted(AI_KEYWORDS, key=len, reverse=True)),
+    re.IGNORECASE,
+)
+_KEYWORD_RANK = {kw: i for i, kw in enumerate(AI_KEYWORDS)}
+
+MAX_SEGMENT_BYTES = 1024 * 1024
+MAX_TOTAL_BYTES = 4 * 1024 * 1024
+TRAILER_BYTES = 64 * 1024
+FALLBACK_BYTES = 500 * 1024
+
+_JPEG_APP_NAMES = {
+    0xE0: "JFIF", 0xE2: "icc_profile", 0xE3: "APP3", 0xEB: "jumbf", 0xEC: "APP12",
+    0xED: "photoshop", 0xEE: "adobe",
+}
+
+
+def _keywords_in(match):
+    text = match.lower().decode("ascii", "ignore")
+    return [kw for kw in AI_KEYWORDS if kw in text]
+
+
+def find_keyword(buf):
+    """Highest-priority AI keyword (by AI_KEYWORDS order) in `buf`, or None."""
+    best = None
+    for m in _KEYWORD_RE.finditer(buf):
+        for kw in _keywords_in(m.group()):
+            if best is None or _KEYWORD_RANK[kw] < _KEYWORD_RANK[best]:
+                best = kw
+                if _KEYWORD_RANK[best] == 0:
+                    return best
+    return best
+
+
+def _read_exact(f, n):
+    data = f.read(n)
+    if len(data) < n:
+        raise EOFError("truncated segment")
+    return data
+
+
+def _jpeg_segments(f):
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return
+        if byte != b"\xff":
+            continue
+        marker = f.read(1)
+        while marker == b"\xff":
+            marker = f.read(1)
+        if not marker:
+            return
+        m = marker[0]
+        if m in (0xD8, 0x01) or 0xD0 <= m <= 0xD7:
+            continue
+        if m == 0xD9:
+            return
+        length = struct.unpack(">H", _read_exact(f, 2))[0] - 2
+        if m == 0xDA:
+            # Start of scan: metadata is over, only the trailer is left
+            break
+        if 0xE0 <= m <= 0xEF or m == 0xFE:
+            payload = f.read(min(length, MAX_SEGMENT_BYTES))
+            if m == 0xE1:
+                if payload.startswith(b"Exif\x00"):
+                    name = "exif"
+                elif b"ns.adobe.com/xap" in payload[:64]:
+                    name = "XML:com.adobe.xmp"
+                else:
+                    name = "APP1"
+            elif m == 0xFE:
+                name = "comment"
+            else:
+                name = _JPEG_APP_NAMES.get(m, f"APP{m - 0xE0}")
+            yield name, payload
+            if length > len(payload):
+                f.seek(length - len(payload), 1)
+        else:
+            f.seek(length, 1)
+    yield from _trailer(f, b"\xff\xd9")
+
+
+def _trailer(f, end_marker):
+    """Bytes appended after the end-of-image marker (bounded)."""
+    f.seek(0, 2)
+    size = f.tell()
+    f.seek(max(0, size - TRAILER_BYTES))
+    tail = f.read()
+    end = tail.rfind(end_marker)
+    if end != -1 and end + len(end_marker) < len(tail):
+        yield "file", tail[end + len(end_marker):]
+
+
+def _png_text(ctype, data):
+    if ctype == b"tEXt":
+        key, _, text = data.partition(b"\x00")
+        return key.decode("latin-1"), text
+    if ctype == b"zTXt":
+        key, _, rest = data.partition(b"\x00")
+        return key.decode("latin-1"), zlib.decompressobj().decompress(rest[1:], MAX_SEGMENT_BYTES)
+    if ctype == b"iTXt":
+        key, _, rest = data.partition(b"\x00")
+        compressed = rest[:1] == b"\x01"
+        rest = rest[2:]
+        _, _, rest = rest.partition(b"\x00")  # language tag
+        _, _, text = rest.partition(b"\x00")  # translated keyword
+        if compressed:
+            text = zlib.decompressobj().decompress(text, MAX_SEGMENT_BYTES)
+        return key.decode("latin-1"), text
+    return ctype.decode("latin-1"), data
+
+
+def _png_segments(f):
+    f.seek(8)
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        length, ctype = struct.unpack(">I4s", header)
+        if ctype in (b"tEXt", b"zTXt", b"iTXt", b"eXIf", b"iCCP"):
+            data = f.read(min(length, MAX_SEGMENT_BYTES))
+            if length > len(data):
+                f.seek(length - len(data), 1)
+            f.seek(4, 1)  # CRC
+            if ctype == b"eXIf":
+                yield "exif", data
+            elif ctype == b"iCCP":
+                key, _, rest = data.partition(b"\x00")
+                yield "icc_profile", key + b"\x00" + zlib.decompressobj().decompress(rest[1:], MAX_SEGMENT_BYTES)
+            else:
+                yield _png_text(ctype, data)
+        elif ctype == b"IEND":
+            break
+        else:
+            f.seek(length + 4, 1)
+    yield from _trailer(f, b"IEND\xaeB`\x82")
+
+
+def _webp_segments(f):
+    f.seek(12)
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        ctype, length = struct.unpack("<4sI", header)
+        padded = length + (length & 1)
+        if ctype in (b"EXIF", b"XMP "):
+            data = f.read(min(length, MAX_SEGMENT_BYTES))
+            f.seek(padded - len(data), 1)
+            yield ("exif" if ctype == b"EXIF" else "XML:com.adobe.xmp"), data
+        else:
+            f.seek(padded, 1)
+
+
+def _raw_segments(f):
+    head = f.read(FALLBACK_BYTES)
+    yield "file", head
+    f.seek(0, 2)
+    size = f.tell()
+    if size > len(head):
+        f.seek(max(len(head), size - FALLBACK_BYTES))
+        yield "file", f.read()
+
+
+def _segments(f):
+    sig = f.read(12)
+    f.seek(0)
+    if sig.startswith(b"\xff\xd8"):
+        return _jpeg_segments(f)
+    if sig.startswith(b"\x89PNG\r\n\x1a\n"):
+        return _png_segments(f)
+    if sig[:4] == b"RIFF" and sig[8:12] == b"WEBP":
+        return _webp_segments(f)
+    return _raw_segments(f)
+
+
+def scan_metadata(source):
+    """
+    Look for AI keywords in the metadata of an image (path or seekable file).
+    Returns (keyword, where) with where = "exif", a metadata key such as
+    "XML:com.adobe.xmp", or "file" for trailer/raw bytes; None if nothing matched.
+    """
+    if hasattr(source, "read"):
+        source.seek(0)
+        return _scan(source)
+    with open(source, "rb") as f:
+        return _scan(f)
+
+
+def _scan(f):
+    budget = MAX_TOTAL_BYTES
+    try:
+        for where, payload in _segments(f):
+            kw = find_keyword(payload)
+            if kw is not None:
+                return kw, where
+            budget -= len(payload)
+            if budget <= 0:
+                break
+    except (EOFError, struct.error, zlib.error) as e:
+        print(f"Metadata scan stopped early: {e}")
+    return None
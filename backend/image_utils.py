@@ -1,114 +1,182 @@
 from PIL import Image
-import tensorflow as tf
 import numpy as np
 import os
-import piexif
+from batching import get_batcher
+from model_workers import batch_buffer, run_model, worker_model_version
+from model_registry import get_registry
+from lite_models import IMAGE_BACKEND, load_lite
+from preprocessing import BatchPreprocessor, thread_local_preprocessor
+from image_metadata import scan_metadata
+from metrics import stage, timed_stage
 
 # Suppress TF logs
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
-_image_model = None
+IMAGE_TARGET_SIZE = (256, 256)
+# Smallest side JPEGs are draft-decoded to (DCT scaling by 1/2, 1/4 or 1/8);
+# 0 always decodes at full resolution
+IMAGE_DECODE_MIN_SIDE = int(os.getenv("IMAGE_DECODE_MIN_SIDE", "512"))
+HF_IMAGE_MODEL = "dima806/deepfake_vs_real_image_detection"
 
-# Verified Absolute Path for this workspace
-IMAGE_MODEL_PATH = r"v:\Road2Tech\Project_3\Image and Audio Real or Fake Detection System\trained\face_real_vs_ai_model.h5"
-ALT_IMAGE_MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "trained", "face_real_vs_ai_model.h5")
+def build_image_model(model_path):
+    """Load the image classifier from `model_path` (called by the model registry)."""
+    model = load_lite(model_path, IMAGE_BACKEND)
+    if model is None:
+        print(f"DEBUG: Loading IMAGE model from: {model_path}")
+        import tensorflow as tf  # imported on first load to keep server startup fast
+        model = tf.keras.models.load_model(model_path)
 
-def load_image_model(model_path=IMAGE_MODEL_PATH):
-    global _image_model
-    if _image_model is None:
+    # Verify input shape to prevent audio/image mismatch
+    input_shape = model.input_shape
+    if len(input_shape) == 4 and input_shape[1] == 128:
+        raise ValueError(f"{os.path.basename(model_path)} appears to be an AUDIO model")
+
+    print(f"SUCCESS: Image model loaded from: {model_path}")
+    return model
+
+def load_image_model():
+    """The serving image model (loaded once by the model registry), or None."""
+    return get_registry().get("image")
+
+def local_image_model_version():
+    """Version tag of the local image model."""
+    version = worker_model_version("image")
+    if version is not None:
+        return version
+    return get_registry().version("image")
+
+def image_model_version():
+    """Version tag of the image classifier in use, used in result cache keys."""
+    if os.getenv("HUGGINGFACE_API_TOKEN"):
+        return f"hf:{HF_IMAGE_MODEL}"
+    return local_image_model_version()
+
+
+def _image_forward_local(batch, model=None):
+    if model is None:
+        model = load_image_model()
+    if model is None:
+        raise RuntimeError("Image model not loaded")
+    return model.predict(batch, verbose=0)
+
+
+def _image_forward(batch):
+    return run_model("image", batch, _image_forward_local)
+
+
+@timed_stage("model_forward")
+def predict_image(img_tensor):
+    """Run [N, 256, 256, 3] images through the shared cross-request image batcher."""
+    return get_batcher("image", _image_forward, alloc_fn=batch_buffer).predict(img_tensor)
+
+class DecodedImage:
+    """
+    One upload decoded once and shared by the watermark check and the model
+    preprocessing. `source` (a path or seekable file) is kept for the metadata
+    scan; pixels are decoded lazily into a single RGB image. The sparkle check
+    needs full resolution, so corner() decodes the full image and the model
+    input is resized from that same buffer. Only when the pixels are first
+    needed for the model input (no sparkle check ran) do JPEGs use PIL's draft
+    mode, decoding a multi-megapixel photo at a reduced scale that still
+    covers IMAGE_DECODE_MIN_SIDE and the model input size.
+    """
+
+    def __init__(self, source, min_side=None):
+        self.source = source
+        self._img = Image.open(source)
+        self.format = self._img.format
+        self.size = self._img.size
+        self.min_side = IMAGE_DECODE_MIN_SIDE if min_side is None else min_side
+        self._rgb = None
+
+    def _decode(self, draft):
+        with stage("decode"):
+            img = self._img
+            if draft and self.min_side and img.format == "JPEG":
+                side = max(self.min_side, *IMAGE_TARGET_SIZE)
+                width, height = img.size
+                # Keep the aspect ratio: the shorter side must stay >= side
+                scale = max(side / width, side / height)
+                img.draft("RGB", (int(width * scale), int(height * scale)))
+            rgb = img.convert("RGB") if img.mode != "RGB" else img
+            rgb.load()
+            if rgb is not img:
+                img.close()
+            self._img = self._rgb = rgb
+        return rgb
+
+    @property
+    def rgb(self):
+        """Decoded RGB PIL image (reduced-size for large JPEGs unless corner() decoded it first)."""
+        if self._rgb is None:
+            self._decode(draft=True)
+        return self._rgb
+
+    def corner(self, fraction):
+        """
+        Bottom-right `fraction` of the image at full resolution: downscaling
+        changes both the corner's content and its extrema. Call it before the
+        model input is taken so the full-size decode is the only one; if the
+        pixels were already draft-decoded the source has to be decoded again.
+        """
+        img = self._rgb if self._rgb is not None else self._decode(draft=False)
+        full = None
+        if img.size != self.size:
+            if hasattr(self.source, "seek"):
+                self.source.seek(0)
+            img = full = Image.open(self.source)
         try:
-            # 1. Try Primary Path
-            if not os.path.exists(model_path):
-                alt = os.path.abspath(ALT_IMAGE_MODEL_PATH)
-                print(f"DEBUG: Image Model not found at {model_path}, trying {alt}...")
-                if os.path.exists(alt):
-                    model_path = alt
-                else:
-                    # Final attempts in common relative locations
-                    if os.path.exists('trained/novelty.h5'):
-                        model_path = 'trained/novelty.h5'
-                    elif os.path.exists('../trained/novelty.h5'):
-                        model_path = '../trained/novelty.h5'
-                    else:
-                        print(f"CRITICAL ERROR: Image Model file not found anywhere!")
-                        return None
-            
-            print(f"DEBUG: Loading IMAGE model from: {model_path}")
-            _image_model = tf.keras.models.load_model(model_path)
-            
-            # Verify input shape to prevent audio/image mismatch
-            input_shape = _image_model.input_shape
-            if len(input_shape) == 4 and input_shape[1] == 128:
-                 print("CRITICAL WARNING: The file novelty.h5 appears to be an AUDIO model!")
-                 _image_model = None
-                 return None
-
-            print(f"SUCCESS: Image model loaded from: {model_path}")
-        except Exception as e:
-            print(f"CRITICAL ERROR loading image model: {e}")
-            return None
-    return _image_model
+            width, height = img.size
+            crop_w, crop_h = int(width * fraction), int(height * fraction)
+            return img.crop((width - crop_w, height - crop_h, width, height))
+        finally:
+            if full is not None:
+                full.close()
+
+    def close(self):
+        self._img.close()
+        self._rgb = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
-def check_ai_watermark(image_path):
+
+def _as_decoded(image):
+    return image if isinstance(image, DecodedImage) else DecodedImage(image)
+
+
+@timed_stage("heuristic_scoring")
+def check_ai_watermark(image):
     """
-    Check for Gemini/Google AI watermarks in metadata (EXIF, IPTC, XMP) or raw bytes.
+    Check for Gemini/Google AI watermarks in metadata (EXIF, IPTC, XMP, PNG text)
+    or bytes trailing the image, then for the visual sparkle marker.
+    `image` may be a DecodedImage, a path or a seekable file-like object.
     """
     try:
-        img = Image.open(image_path)
-        ai_keywords = [
-            "google", "gemini", "synthetic", "ai-generated", "dall-e", "midjourney", 
-            "stable diffusion", "stablediffusion", "artificial", "adobe firefly", 
-            "synthid", "imagogen", "parti", "deepfake", "generated with", "creator: google",
-            "software: google", "google ai", "imagen", "vertex ai"
-        ]
+        img = _as_decoded(image)
         
-        # 1. Check EXIF specifically
-        if "exif" in img.info:
-            try:
-                exif_dict = piexif.load(img.info["exif"])
-                for ifd in ("0th", "Exif", "GPS", "1st"):
-                    for tag in exif_dict[ifd]:
-                        tag_value = str(exif_dict[ifd][tag]).lower()
-                        for kw in ai_keywords:
-                            if kw in tag_value:
-                                print(f"AI Marker found in EXIF ({ifd}:{tag}): {kw}")
-                                return True, 0.99, f"AI marker ({kw}) detected in EXIF metadata"
-            except Exception as e:
-                print(f"EXIF parsing error: {e}")
-
-        # 2. Check general image info (XMP, IPTC, ICC profiles often show up here)
-        for key, value in img.info.items():
-            val_str = str(value).lower()
-            for kw in ai_keywords:
-                if kw in val_str:
-                    print(f"AI Marker found in info['{key}']: {kw}")
-                    return True, 0.99, f"AI-generated tag ({kw}) found in {key} metadata"
-
-        # 3. Aggressive Byte Search (Search first 500KB and last 500KB)
+        # 1-3. EXIF, XMP/IPTC/text chunks and trailing bytes, in one targeted pass
         try:
-            with open(image_path, 'rb') as f:
-                # Read first 500KB
-                head = f.read(500 * 1024).lower()
-                # Read last 500KB
-                f.seek(0, 2)
-                file_size = f.tell()
-                f.seek(max(0, file_size - 500 * 1024))
-                tail = f.read().lower()
-                
-                content = head + tail
-                for kw in ai_keywords:
-                    if kw.encode() in content:
-                        print(f"AI String Found in Bytes: {kw}")
-                        return True, 0.99, f"AI digital trace ({kw}) found in file"
+            found = scan_metadata(img.source)
         except Exception as e:
-            print(f"Raw byte search error: {e}")
+            print(f"Metadata scan error: {e}")
+            found = None
+        if found is not None:
+            kw, where = found
+            print(f"AI Marker found in {where}: {kw}")
+            if where == "exif":
+                return True, 0.99, f"AI marker ({kw}) detected in EXIF metadata"
+            if where == "file":
+                return True, 0.99, f"AI digital trace ({kw}) found in file"
+            return True, 0.99, f"AI-generated tag ({kw}) found in {where} metadata"
 
         # 4. Visual Marker Check (Bottom Right Corner for Gemini Sparkle)
         try:
-            width, height = img.size
-            # Crop the bottom-right 10% of the image
-            crop_w, crop_h = int(width * 0.15), int(height * 0.15)
-            bottom_right = img.crop((width - crop_w, height - crop_h, width, height))
+            # Crop the bottom-right 10% of the image (full resolution, not the draft decode)
+            bottom_right = img.corner(0.15)
             
             # Convert to grayscale to find bright patterns
             bw = bottom_right.convert("L")
@@ -132,18 +200,22 @@ def check_ai_watermark(image_path):
         return False, 0.0, f"Error: {str(e)}"
 
 
-def preprocess_image(file_path):
+_image_preprocessor = thread_local_preprocessor(
+    lambda: BatchPreprocessor(IMAGE_TARGET_SIZE, channels_first=False)
+)
+
+
+@timed_stage("preprocessing")
+def preprocess_image(image):
     """
-    Load image, resize to [256, 256], and normalize.
+    Resize a DecodedImage (or path/file) to [256, 256] and normalize.
+    Returns a [1, 256, 256, 3] float32 view of this thread's preallocated buffer.
     """
-    target_size = (256, 256)
+    target_size = IMAGE_TARGET_SIZE
     try:
-        img = tf.keras.utils.load_img(file_path, target_size=target_size)
-        img_array = tf.keras.utils.img_to_array(img)
-        img_array = img_array / 255.0
-        img_array = np.expand_dims(img_array, axis=0)
-        return img_array
+        # Same resize as tf.keras.utils.load_img (RGB, nearest neighbour)
+        img = _as_decoded(image).rgb.resize(target_size, Image.NEAREST)
+        return _image_preprocessor()([np.asarray(img)])
     except Exception as e:
         print(f"Error processing image: {e}")
         return None
-
@@ -0,0 +1,140 @@
+"""
+Background analysis jobs.
+
+Long-running media (mostly video) is analyzed on a dedicated, bounded worker
+pool so it never occupies the HTTP threadpool. Clients poll job status and
+per-frame progress by id.
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "32"))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+
+
+class JobQueueFull(RuntimeError):
+    """Raised when too many jobs are already queued or running."""
+
+
+class JobFailed(RuntimeError):
+    """Raised by a job function to report an error dict as the job result."""
+
+    def __init__(self, error):
+        super().__init__(error.get("error", "job_failed"))
+        self.error = error
+
+
+class Job:
+    def __init__(self, kind=None, filename=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.filename = filename
+        self.status = "queued"
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def set_progress(self, done, total):
+        with self._lock:
+            self.done = int(done)
+            self.total = int(total)
+
+    def to_dict(self):
+        with self._lock:
+            progress = self.done / self.total if self.total else (1.0 if self.status == "done" else 0.0)
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "kind": self.kind,
+                "filename": self.filename,
+                "progress": {"done": self.done, "total": self.total, "fraction": round(progress, 4)},
+                "result": self.result,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class JobManager:
+    """Bounded worker pool plus an in-memory job table."""
+
+    def __init__(self, workers=JOB_WORKERS, max_pending=JOB_QUEUE_SIZE, retention=JOB_RETENTION_SECONDS):
+        self.max_pending = max(1, int(max_pending))
+        self.retention = float(retention)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="job")
+        self._jobs = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn, kind=None, filename=None):
+        """Queue `fn(job)`; its return value becomes the job result."""
+        with self._lock:
+            self._prune()
+            if self._pending >= self.max_pending:
+                raise JobQueueFull(f"{self._pending} jobs already pending")
+            job = Job(kind=kind, filename=filename)
+            self._jobs[job.id] = job
+            self._pending += 1
+        self._executor.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job, fn):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.result = fn(job)
+            job.status = "done"
+        except JobFailed as e:
+            job.error = e.error
+            job.status = "failed"
+        except Exception as e:
+            print(f"Job {job.id} failed: {e}")
+            job.error = {"error": "job_failed", "detail": str(e)}
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._pending -= 1
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        expired = [jid for jid, j in self._jobs.items() if j.finished_at is not None and j.finished_at < cutoff]
+        for jid in expired:
+            del self._jobs[jid]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for j in self._jobs.values():
+                counts[j.status] = counts.get(j.status, 0) + 1
+            return {"pending": self._pending, "max_pending": self.max_pending, "jobs": counts}
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait)
+
+
+_job_manager = None
+_job_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    global _job_manager
+    if _job_manager is None:
+        with _job_manager_lock:
+            if _job_manager is None:
+                _job_manager = JobManager()
+    return _job_manager
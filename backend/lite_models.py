@@ -0,0 +1,226 @@
+"""
+TFLite versions of the Keras audio and image classifiers.
+
+`python lite_models.py convert` (from backend/) converts audio_classifier.h5
+and the image .h5 to float16 and int8 TFLite files. The files go into the
+"optimized" folder next to each .h5 and are named by the .h5 checksum, so a
+replaced .h5 never picks up a stale conversion. Each conversion writes a
+parity report (<file>.json) comparing its outputs with the Keras model.
+
+AUDIO_BACKEND / IMAGE_BACKEND = tflite-fp16 | tflite-int8 then serve that file
+through the TFLite interpreter. The interpreter comes from tflite_runtime when
+it is installed, so TensorFlow itself is never imported. When the conversion
+is missing or failed parity, the Keras model serves instead.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+
+AUDIO_BACKEND = os.getenv("AUDIO_BACKEND", "keras").lower()
+IMAGE_BACKEND = os.getenv("IMAGE_BACKEND", "keras").lower()
+# Default: an "optimized" folder next to the .h5
+LITE_MODEL_DIR = os.getenv("LITE_MODEL_DIR", "")
+LITE_FP16_TOLERANCE = float(os.getenv("LITE_FP16_TOLERANCE", "0.01"))
+LITE_INT8_TOLERANCE = float(os.getenv("LITE_INT8_TOLERANCE", "0.05"))
+
+VARIANTS = ("tflite-fp16", "tflite-int8")
+# Model input per sample and the value range of real inputs (parity noise)
+INPUTS = {
+    "audio": ((128, 109, 1), (-80.0, 0.0)),   # mel dB, ref=max, top_db=80
+    "image": ((256, 256, 3), (0.0, 1.0)),     # RGB / 255
+}
+
+
+def _interpreter_class():
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        # Full TensorFlow: works, but loses the import-time and memory savings
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+def lite_path(h5_path, variant):
+    from model_registry import file_sha256
+    out_dir = LITE_MODEL_DIR or os.path.join(os.path.dirname(h5_path), "optimized")
+    digest = file_sha256(h5_path)[:12]
+    return os.path.join(out_dir, f"{os.path.basename(h5_path)}.{digest}.{variant.split('-')[1]}.tflite")
+
+
+class LiteModel:
+    """TFLite interpreter with the slice of the Keras API the forwards use (predict)."""
+
+    def __init__(self, path, variant, validation=None):
+        self.path = path
+        self.variant = variant
+        self.validation = validation
+        self._interpreter = _interpreter_class()(model_path=path)
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]["index"]
+        self._output = self._interpreter.get_output_details()[0]["index"]
+        self._batch = None
+        # One interpreter, one invocation at a time
+        self._lock = threading.Lock()
+
+    @property
+    def input_shape(self):
+        shape = self._interpreter.get_input_details()[0]["shape_signature"]
+        return (None,) + tuple(int(d) for d in shape[1:])
+
+    def predict(self, batch, verbose=0):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        with self._lock:
+            if batch.shape[0] != self._batch:
+                self._interpreter.resize_tensor_input(self._input, batch.shape)
+                self._interpreter.allocate_tensors()
+                self._batch = batch.shape[0]
+            self._interpreter.set_tensor(self._input, batch)
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output)
+
+
+def load_lite(h5_path, backend):
+    """
+    The converted model for `backend`, or None to use the Keras model
+    (backend "keras", no conversion for this .h5 yet, or it failed parity).
+    """
+    if backend == "keras":
+        return None
+    if backend not in VARIANTS:
+        print(f"[Lite] Unknown backend {backend!r} (choose keras, {', '.join(VARIANTS)}); using Keras")
+        return None
+    path = lite_path(h5_path, backend)
+    report = None
+    try:
+        with open(path + ".json") as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        pass
+    if not os.path.exists(path) or report is None:
+        print(f"[Lite] No {backend} conversion of {os.path.basename(h5_path)} "
+              f"(run `python lite_models.py convert`); using Keras")
+        return None
+    if not report.get("passed"):
+        print(f"[Lite] {os.path.basename(path)} failed parity "
+              f"(max diff {report.get('max_abs_diff')}); using Keras")
+        return None
+    print(f"[Lite] Loading {backend} model from {path}")
+    return LiteModel(path, backend, validation=report)
+
+
+def _labels(out):
+    return (out[:, 0] > 0.5).astype(int) if out.shape[-1] == 1 else out.argmax(axis=1)
+
+
+def parity(reference, candidate):
+    return {
+        "samples": len(reference),
+        "max_abs_diff": float(np.abs(reference - candidate).max()),
+        "mean_abs_diff": float(np.abs(reference - candidate).mean()),
+        "label_agreement": float((_labels(reference) == _labels(candidate)).mean()),
+    }
+
+
+def sample_inputs(name, directory=None, count=32):
+    """
+    Representative inputs: audio files / images from `directory` through the
+    serving preprocessing, else seeded uniform noise over the input range.
+    """
+    shape, (low, high) = INPUTS[name]
+    batches = []
+    if directory:
+        files = sorted(os.path.join(directory, f) for f in os.listdir(directory))
+        for path in files:
+            if sum(len(b) for b in batches) >= count:
+                break
+            if name == "audio":
+                from audio_utils import preprocess_audio
+                batch = preprocess_audio(path)
+            else:
+                from image_utils import preprocess_image
+                batch = preprocess_image(path)
+            if batch is not None and len(batch):
+                batches.append(np.array(batch, dtype=np.float32))
+    if batches:
+        return np.concatenate(batches)[:count]
+    rng = np.random.default_rng(0)
+    return rng.uniform(low, high, size=(count,) + shape).astype(np.float32)
+
+
+def convert(keras_model, h5_path, variant, samples, tolerance=None):
+    """
+    Convert `keras_model` to `variant`, check parity on `samples` and write
+    the .tflite file with its .json report. Returns the report.
+    """
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if variant == "tflite-fp16":
+        converter.target_spec.supported_types = [tf.float16]
+    else:
+        # Full int8 weights and activations, calibrated on the samples; float in/out
+        converter.representative_dataset = lambda: ([samples[i:i + 1]] for i in range(len(samples)))
+    data = converter.convert()
+
+    path = lite_path(h5_path, variant)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+    if tolerance is None:
+        tolerance = LITE_FP16_TOLERANCE if variant == "tflite-fp16" else LITE_INT8_TOLERANCE
+    report = parity(keras_model.predict(samples, verbose=0), LiteModel(path, variant).predict(samples))
+    report.update({
+        "source": os.path.basename(h5_path),
+        "variant": variant,
+        "tolerance": tolerance,
+        "passed": report["max_abs_diff"] <= tolerance,
+        "size_mb": round(len(data) / 2**20, 2),
+        "source_mb": round(os.path.getsize(h5_path) / 2**20, 2),
+    })
+    with open(path + ".json", "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["convert"])
+    parser.add_argument("--models", nargs="+", default=["audio", "image"], choices=list(INPUTS))
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=VARIANTS)
+    parser.add_argument("--calibration-audio", help="Folder of audio files for int8 calibration and parity")
+    parser.add_argument("--calibration-image", help="Folder of images for int8 calibration and parity")
+    parser.add_argument("--samples", type=int, default=32)
+    args = parser.parse_args()
+
+    import tensorflow as tf
+    from model_registry import get_registry
+    registry = get_registry()
+    failed = False
+    for name in args.models:
+        try:
+            h5_path = registry.spec(name).resolve()
+        except FileNotFoundError as e:
+            print(f"{name}: {e}")
+            failed = True
+            continue
+        keras_model = tf.keras.models.load_model(h5_path)
+        samples = sample_inputs(name, getattr(args, f"calibration_{name}"), args.samples)
+        for variant in args.variants:
+            report = convert(keras_model, h5_path, variant, samples)
+            failed = failed or not report["passed"]
+            print(f"{name} {variant}: {report['source_mb']} MB -> {report['size_mb']} MB, "
+                  f"max diff {report['max_abs_diff']:.5f}, label agreement {report['label_agreement']:.3f} "
+                  f"{'PASS' if report['passed'] else 'FAIL'} ({lite_path(h5_path, variant)})")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,28 @@
-from fastapi import FastAPI, File, UploadFile
+import asyncio
+from fastapi import Depends, FastAPI, File, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from typing import List, Optional
 from pydantic import BaseModel
-from database import connect_db, get_db, close_db
-import datetime
+from database import connect_db, close_db, db_health, get_history_col, get_users_col
+import io
+import json
 import random
-import numpy as np
-from audio_utils import load_audio_model, preprocess_audio
+from analysis import analyze_and_close, result_record
+from batching import batcher_stats
+from bulk import expand_items, scan
+from history_queries import history_count, history_page
+from history_writer import (history_writer_running, history_writer_stats, start_history_writer,
+                            stop_history_writer, write_history)
+from metrics import render_metrics
+from upload_utils import ingest_upload
+from result_cache import get_result_cache
+from jobs import get_job_manager, JobFailed, JobQueueFull
+from model_registry import MODEL_PRELOAD, MODEL_PRELOAD_FAMILIES, get_registry
+from model_workers import (MODEL_WORKERS, reload_model, start_model_workers_background, stop_model_workers,
+                           worker_stats)
+from executors import ExecutorBusy, executor_stats, model_executor, run_db, shutdown_executors
+from starlette.concurrency import run_in_threadpool
 from bson import ObjectId
 
 app = FastAPI()
@@ -27,22 +43,23 @@ class LoginRequest(BaseModel):
     email: str
     password: str
 
-# Use the existing get_db helper to interact with collections
-db = get_db()
-users_col = db["users"]
-history_col = db["history"]
-
 @app.post("/register")
-async def register(user: User):
-    if users_col.find_one({"email": user.email}):
-        return {"error": "User already exists"}
-    
-    users_col.insert_one(user.dict())
+async def register(user: User, users_col=Depends(get_users_col)):
+    try:
+        if await run_db(users_col.find_one, {"email": user.email}):
+            return {"error": "User already exists"}
+
+        await run_db(users_col.insert_one, user.dict())
+    except ExecutorBusy as e:
+        return {"error": "server_busy", "detail": str(e)}
     return {"message": "User registered successfully"}
 
 @app.post("/login")
-async def login(req: LoginRequest):
-    user = users_col.find_one({"email": req.email, "password": req.password})
+async def login(req: LoginRequest, users_col=Depends(get_users_col)):
+    try:
+        user = await run_db(users_col.find_one, {"email": req.email, "password": req.password})
+    except ExecutorBusy as e:
+        return {"error": "server_busy", "detail": str(e)}
     if not user:
         return {"error": "Invalid credentials"}
     
@@ -55,17 +72,32 @@ async def login(req: LoginRequest):
     }
 
 @app.get("/history/{email}")
-async def get_history(email: str):
-    history = list(history_col.find({"user_email": email}).sort("timestamp", -1))
-    # Convert ObjectId to string for JSON serialization
-    for item in history:
-        item["_id"] = str(item["_id"])
-    return {"history": history}
+async def get_history(email: str, limit: Optional[int] = None, cursor: Optional[str] = None,
+                      fields: Optional[str] = None, history_col=Depends(get_history_col)):
+    """
+    Newest-first history of a user. Without `limit` or `cursor` the whole history
+    is returned, as before; with them, one page (HISTORY_PAGE_SIZE by default)
+    and a next_cursor for the following page. `fields` (comma-separated) limits
+    the fields returned.
+    """
+    try:
+        return await run_db(history_page, history_col, email, limit=limit, cursor=cursor, fields=fields)
+    except ValueError as e:
+        return JSONResponse({"error": "invalid_request", "detail": str(e)}, status_code=400)
+    except ExecutorBusy as e:
+        return {"error": "server_busy", "detail": str(e)}
+
+@app.get("/history/{email}/count")
+async def get_history_count(email: str, history_col=Depends(get_history_col)):
+    try:
+        return {"count": await run_db(history_count, history_col, email)}
+    except ExecutorBusy as e:
+        return {"error": "server_busy", "detail": str(e)}
 
 @app.delete("/history/{item_id}")
-async def delete_history_item(item_id: str):
+async def delete_history_item(item_id: str, history_col=Depends(get_history_col)):
     try:
-        result = history_col.delete_one({"_id": ObjectId(item_id)})
+        result = await run_db(history_col.delete_one, {"_id": ObjectId(item_id)})
         if result.deleted_count == 0:
             return {"error": "Item not found"}
         return {"message": "Item deleted successfully"}
@@ -73,213 +105,250 @@ async def delete_history_item(item_id: str):
         return {"error": str(e)}
 
 @app.delete("/history/clear/{email}")
-async def clear_history(email: str):
+async def clear_history(email: str, history_col=Depends(get_history_col)):
     try:
-        result = history_col.delete_many({"user_email": email})
+        # Same user_email prefix of the history index as the reads
+        result = await run_db(history_col.delete_many, {"user_email": email})
         return {"message": f"Deleted {result.deleted_count} items"}
     except Exception as e:
         return {"error": str(e)}
 
 # Existing models and setup...
 
-# Hold loaded models in app.state for reuse between requests
-app.state.audio_model = None
-
 @app.on_event("shutdown")
 async def shutdown_event():
     print("Shutting down...")
+    get_job_manager().shutdown(wait=False)
+    shutdown_executors(wait=False)
+    stop_model_workers()
+    # Write out queued history before the client goes away
+    stop_history_writer()
     close_db()
 
 @app.on_event("startup")
 async def startup_event():
-    # Attempt to connect DB (if implemented) and preload audio model
+    if MODEL_WORKERS > 0:
+        # Models live in the forked worker processes, not in the API process.
+        # They load on a background thread (/ready reports 503 meanwhile); only
+        # the fork is awaited, so it happens before the DB index and history
+        # writer threads exist.
+        forked = start_model_workers_background()
+        while not forked.is_set():
+            await asyncio.sleep(0.05)
+
+    # Attempt to connect DB (if implemented) and start preloading models
     try:
         connect_db()
     except Exception as e:
         print(f"Warning: connect_db() failed on startup: {e}")
+    try:
+        start_history_writer(get_history_col())
+    except Exception as e:
+        print(f"Warning: history writer not started: {e}")
+
+    if MODEL_WORKERS > 0:
+        return
 
+    # Load and warm up in background threads; /ready reports 200 once done
+    registry = get_registry()
+    registry.preload(registry.expand(MODEL_PRELOAD_FAMILIES), mode=MODEL_PRELOAD)
+    print(f"Model preload started (mode: {MODEL_PRELOAD})")
+
+@app.get("/health")
+async def get_health():
+    """Liveness plus a MongoDB ping and this process's connection pool counters"""
     try:
-        print("Preloading audio model on startup...")
-        m = load_audio_model()
-        if m is not None:
-            app.state.audio_model = m
-            print("Audio model preloaded and stored on app.state.audio_model")
-        else:
-            print("Audio model returned None on preload. Will attempt lazy load on first request.")
+        db = await run_db(db_health)
+    except ExecutorBusy as e:
+        # The process is up; only the DB pool is saturated
+        db = {"error": "server_busy", "detail": str(e)}
+    return {"status": "ok", "db": db}
+
+@app.get("/ready")
+async def get_ready():
+    """200 once the preloaded models are loaded and warmed up (503 before), with per-model timings"""
+    status = get_registry().status()
+    if MODEL_WORKERS > 0:
+        workers = worker_stats()
+        status["workers"] = workers.get("models", {})
+        # Start progress of the worker processes: preloading / starting / ready / failed
+        status["worker_pool"] = {key: workers.get(key) for key in ("state", "size", "ready_workers", "error")}
+        status["ready"] = (status["ready"] and workers.get("state") == "ready"
+                           and all(m.get("loaded") for f, m in status["workers"].items() if f in MODEL_PRELOAD_FAMILIES))
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/models")
+async def get_models():
+    """Loaded models: artifact path, SHA-256, version tag and reload count"""
+    status = get_registry().status()
+    if MODEL_WORKERS > 0:
+        status["workers"] = worker_stats().get("models", {})
+    return status
+
+@app.post("/models/{name}/reload")
+async def reload_model_endpoint(name: str, artifact: Optional[str] = None):
+    """
+    Hot-swap a model to `artifact` (a file in MODEL_DIR; default: the configured one).
+    In-flight requests finish on the old model.
+    """
+    try:
+        return await run_in_threadpool(reload_model, name, artifact)
+    except KeyError as e:
+        return JSONResponse({"error": "unknown_model", "detail": str(e)}, status_code=404)
     except Exception as e:
-        print(f"Error preloading audio model: {e}")
+        print(f"Reload of {name} failed: {e}")
+        return JSONResponse({"error": "reload_failed", "detail": str(e)}, status_code=400)
+
+@app.get("/batching/stats")
+async def get_batching_stats():
+    """Queue depth, batch sizes and latency counters for each model batcher"""
+    return {"batchers": batcher_stats()}
+
+@app.get("/executors/stats")
+async def get_executor_stats():
+    """Workers, queued/running tasks and latency for each model and DB pool"""
+    return {"executors": executor_stats()}
+
+@app.get("/workers/stats")
+async def get_worker_stats():
+    """Model worker processes: startup time, request counts and RSS/PSS/shared memory"""
+    return worker_stats()
+
+@app.get("/history/writer/stats")
+async def get_history_writer_stats():
+    """Queued, written, retried and spilled history records"""
+    return history_writer_stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text format: per-stage latency histograms, queue depths and model load gauges"""
+    rendered = await run_in_threadpool(render_metrics)
+    if rendered is None:
+        return JSONResponse({"error": "metrics_unavailable", "detail": "prometheus_client is not installed"},
+                            status_code=503)
+    body, content_type = rendered
+    return Response(body, media_type=content_type)
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """Hit/miss counters for the /predict result cache"""
+    return get_result_cache().stats()
+
+def save_history(user_email, result_data):
+    """Store a finished prediction in the user's history (queued on the write-behind writer)"""
+    try:
+        write_history(get_history_col(), {
+            "user_email": user_email,
+            **result_data
+        })
+    except Exception as e:
+        print(f"Error saving history: {e}")
 
 @app.post("/predict")
-def predict_file(file: UploadFile = File(...), user_email: Optional[str] = None):
+async def predict_file(file: UploadFile = File(...), user_email: Optional[str] = None,
+                 audio_mode: Optional[str] = None, full_audio: bool = False):
     filename = file.filename
     content_type = file.content_type
     print(f"DEBUG: Filename={filename}, Content-Type={content_type}")
-    
-    if content_type is None:
-        content_type = "application/octet-stream"
 
-    label = "PROCESSING_ERROR"
-    confidence = 0.0
-    
-    # Save temp file for processing (librosa needs path)
-    import shutil
-    import os
-    temp_filename = f"temp_{filename}"
+    # Ingest once: small images/audio stay in memory, videos go to a unique spool file
     try:
-        with open(temp_filename, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        upload = await run_in_threadpool(ingest_upload, file.file, filename, content_type)
     except Exception as e:
         print(f"File Save Error: {e}")
         return {"error": "file_save_failed", "detail": str(e)}
     try:
-        if content_type.startswith("audio/"):
-            # Audio Prediction Logic
-            print("Processing Audio...")
-            # Try to reuse preloaded model
-            model = getattr(app.state, 'audio_model', None)
-            if model is None:
-                print("No preloaded model found; attempting to load now...")
-                model = load_audio_model()
-                app.state.audio_model = model
-            if model:
-                segments = preprocess_audio(temp_filename)
-                if segments:
-                    # Batch prediction for efficiency
-                    batch = np.vstack(segments)
-                    print(f"Analyzing {len(segments)} audio segments (Batch shape: {batch.shape})...")
-                    
-                    try:
-                        probs = model.predict(batch, verbose=0) # [N, 2]
-                        # Average probabilities across all segments
-                        avg_probs = np.mean(probs, axis=0)
-                    except Exception as e:
-                         print(f"Model prediction error: {e}")
-                         raise e
-
-                    print(f"AVERAGE PREDICTION (Probs): {avg_probs}")
-                    
-                    fake_prob = float(avg_probs[0])
-                    real_prob = float(avg_probs[1])
-                    
-                    if real_prob > fake_prob:
-                        label = "REAL"
-                        confidence = real_prob
-                    else:
-                        label = "FAKE"
-                        confidence = fake_prob
-
-                    print(f"Result: {label} (REAL_PROB: {real_prob:.4f}, FAKE_PROB: {fake_prob:.4f})")
-                else:
-                    print("Feature extraction failed.")
-                    return {"error": "Could not extract features"}
-            else:
-                print("Audio model refused to load.")
-                return {"error": "model_not_loaded", "detail": "Audio model could not be loaded. Check server logs and model file."}
-
-        elif content_type.startswith("image/"):
-             # Image Prediction Logic
-             print("Processing Image...")
-             print("Processing Image...")
-             from image_utils import load_image_model, preprocess_image, check_ai_watermark
-             
-             # 1. First check for AI watermarks (Gemini/Google)
-             is_ai, water_conf, reason = check_ai_watermark(temp_filename)
-             if is_ai:
-                 print(f"Watermark Detection: {reason}")
-                 label = "FAKE"
-                 confidence = water_conf
-                 detection_detail = reason
-             else:
-                 detection_detail = None
-                 # 2. Falling back to ML model if no metadata watermark found
-                 import os
-                 hf_token = os.getenv("HUGGINGFACE_API_TOKEN")
-                 if hf_token:
-                     print("Hugging Face API token found. Using Hugging Face InferenceClient...")
-                     try:
-                         from huggingface_hub import InferenceClient
-                         client = InferenceClient(token=hf_token)
-                         result = client.image_classification(temp_filename, model="dima806/deepfake_vs_real_image_detection")
-                         print(f"HF API Response: {result}")
-                         if result and len(result) > 0:
-                             top_pred = result[0]
-                             pred_label = getattr(top_pred, "label", None) or (top_pred.get("label", "") if isinstance(top_pred, dict) else "")
-                             pred_score = getattr(top_pred, "score", None) or (top_pred.get("score", 0.0) if isinstance(top_pred, dict) else 0.0)
-                             label = "REAL" if "real" in str(pred_label).lower() else "FAKE"
-                             confidence = float(pred_score)
-                         else:
-                             print(f"Unexpected HF API response format: {result}")
-                             return {"error": "hf_api_error", "detail": "Unexpected response from Hugging Face API"}
-                     except Exception as e:
-                         print(f"Error calling Hugging Face API: {e}")
-                         # Fallback to local model
-                         hf_token = None
-                         
-                 # If HF token is not present or API failed, use local model
-                 if not hf_token:
-                     model = load_image_model()
-                     if model:
-                         print("Image Model loaded. Preprocessing...")
-                         img_tensor = preprocess_image(temp_filename)
-                         if img_tensor is not None:
-                             print(f"Image processed: {img_tensor.shape}. Predicting...")
-                             pred = model.predict(img_tensor)
-                             print(f"Prediction raw: {pred}")
-                             
-                             # Assume binary sigmoid output [0=Fake, 1=Real] or similar
-                             score = float(pred[0][0]) if pred.shape[-1] == 1 else float(pred[0][1])
-                             confidence = score if score > 0.5 else 1 - score
-                             label = "REAL" if score > 0.5 else "FAKE"
-                             print(f"Result: {label} ({confidence})")
-                         else:
-                             return {"error": "Could not process image"}
-                     else:
-                        return {"error": "model_load_failed", "detail": "Image detection model failed to load. Check trained/ folder."}
-
-
-        
-        elif content_type.startswith("video/"):
-             # Video Prediction - Hybrid Detection (Xception + Heuristics)
-             print("Processing Video (Hybrid Neural + Heuristic)...")
-             from video_utils import predict_video
-             video_result = predict_video(temp_filename)
-             
-             if "error" in video_result:
-                 label = "ERROR"
-                 confidence = 0.0
-                 print(f"Video Error: {video_result['error']}")
-             else:
-                 label = video_result['result']
-                 confidence = float(video_result['confidence'])
-                 print(f"Video Result: {label} ({confidence}) Raw: {video_result.get('raw')}")
-        else:
-             return {"error": "Unsupported media type"}
-             
-    except Exception as e:
-        print(f"Prediction Error: {e}")
-        return {"error": "prediction_failed", "detail": str(e)}
-    # Process cleanup
-    if os.path.exists(temp_filename):
-        os.remove(temp_filename)
-    
-    result_data = {
-        "filename": filename,
-        "label": label,
-        "confidence": confidence,
-        "content_type": content_type,
-        "detail": detection_detail if 'detection_detail' in locals() else None,
-        "timestamp": datetime.datetime.utcnow().isoformat()
-    }
+        # Inference runs on the pool for this model family, never on the event loop
+        analysis = await model_executor(upload.kind).run(
+            analyze_and_close, upload, audio_mode=audio_mode, full_audio=full_audio
+        )
+    except ExecutorBusy as e:
+        print(f"Prediction rejected: {e}")
+        upload.close()
+        analysis = {"error": "server_busy", "detail": str(e)}
+    if "error" in analysis:
+        return analysis
 
-    # Save to history if user is logged in
+    result_data = result_record(upload, analysis)
+
+    # Save to history if user is logged in; the response doesn't wait for MongoDB
     if user_email:
-        try:
-            history_col.insert_one({
-                "user_email": user_email,
-                **result_data
-            })
-            print(f"Saved history for {user_email}")
-        except Exception as e:
-            print(f"Error saving history: {e}")
+        if history_writer_running():
+            save_history(user_email, result_data)
+        else:
+            # Write-behind off or not started: insert_one blocks, keep it off the event loop
+            try:
+                await run_db(save_history, user_email, result_data)
+            except ExecutorBusy as e:
+                print(f"Error saving history: {e}")
+
+    return result_data
+
+def _take_file(file):
+    """
+    Detach the spooled file from an UploadFile: FastAPI closes request files
+    when the handler returns, before a streamed body is produced.
+    """
+    f, file.file = file.file, io.BytesIO()
+    return f
+
+@app.post("/predict/batch")
+def predict_batch(files: List[UploadFile] = File(...), user_email: Optional[str] = None,
+                  audio_mode: Optional[str] = None, history_col=Depends(get_history_col)):
+    """
+    Analyze many files at once; .zip uploads are expanded member by member.
+    Streams one NDJSON line per item as it completes (in completion order,
+    with the item's "index"); history is written in bulk.
+    """
+    taken = [(file.filename, _take_file(file), file.content_type) for file in files]
+    items = (item
+             for name, f, content_type in taken
+             for item in expand_items(name, lambda f=f: f, content_type))
+    lines = (json.dumps(result) + "\n"
+             for result in scan(items, user_email=user_email, history_col=history_col, audio_mode=audio_mode))
+    return StreamingResponse(lines, media_type="application/x-ndjson")
 
+def _run_job(job, upload, user_email, audio_mode=None, full_audio=False):
+    # Runs on the job pool's own thread (JOB_WORKERS), not on the per-model pools
+    # /predict uses: long jobs never take an interactive request's slot
+    analysis = analyze_and_close(upload, progress_callback=job.set_progress,
+                                 audio_mode=audio_mode, full_audio=full_audio)
+    if "error" in analysis:
+        raise JobFailed(analysis)
+    result_data = result_record(upload, analysis)
+    if user_email:
+        save_history(user_email, result_data)
     return result_data
+
+@app.post("/jobs")
+def create_job(file: UploadFile = File(...), user_email: Optional[str] = None,
+               audio_mode: Optional[str] = None, full_audio: bool = False):
+    """Queue media for background analysis and return a job id to poll"""
+    try:
+        upload = ingest_upload(file.file, file.filename, file.content_type)
+    except Exception as e:
+        print(f"File Save Error: {e}")
+        return {"error": "file_save_failed", "detail": str(e)}
+    try:
+        job = get_job_manager().submit(
+            lambda job: _run_job(job, upload, user_email, audio_mode, full_audio),
+            kind=upload.kind,
+            filename=upload.filename,
+        )
+    except JobQueueFull as e:
+        upload.close()
+        return {"error": "server_busy", "detail": str(e)}
+    return {"job_id": job.id, "status": job.status}
+
+@app.get("/jobs/stats")
+async def get_job_stats():
+    """Pending job count and jobs by status"""
+    return get_job_manager().stats()
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status, per-frame progress and (when finished) the result of a job"""
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return {"error": "Job not found"}
+    return job.to_dict()
@@ -0,0 +1,247 @@
+"""
+Per-stage latency metrics and the Prometheus /metrics exposition.
+
+analyze_upload() opens a trace for each request. Functions decorated with
+timed_stage() (decode, face detection, preprocessing, model forward,
+heuristic scoring) add their wall time to the trace of the request they run
+for. When stages nest, the time goes to the innermost one, so nothing is
+counted twice (pipelined video stages do overlap across threads, so their
+totals can exceed the analysis time). When the request finishes, each
+stage total is observed once in
+deepfake_stage_seconds{stage, media, model_version}. Stages outside an
+analysis are observed directly with observe_stage(): upload receive and temp
+write during ingestion, and history DB writes (these have no model_version,
+and DB writes are per insert rather than per request).
+
+Queue depths and model load state are read from the existing stats
+functions at scrape time. Metrics are per process.
+
+Needs prometheus_client. Without it the timers still run (for
+METRICS_LOG_STAGES) and /metrics reports that it is unavailable.
+"""
+import contextlib
+import contextvars
+import functools
+import os
+import threading
+import time
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Histogram, generate_latest
+    from prometheus_client.core import GaugeMetricFamily
+except ImportError:
+    REGISTRY = None
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+# Print one line of stage timings per analyzed upload
+METRICS_LOG_STAGES = os.getenv("METRICS_LOG_STAGES", "0") == "1"
+
+# Seconds; from a cached image lookup up to a long full-audio or video analysis
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_current = contextvars.ContextVar("metrics_trace", default=None)
+# Open stages of this thread: [name, start, trace], innermost last
+_local = threading.local()
+
+if REGISTRY is not None:
+    STAGE_SECONDS = Histogram(
+        "deepfake_stage_seconds", "Time spent in one pipeline stage for one upload",
+        ["stage", "media", "model_version"], buckets=BUCKETS,
+    )
+    ANALYSIS_SECONDS = Histogram(
+        "deepfake_analysis_seconds", "Analysis time of one upload (after ingestion)",
+        ["media", "model_version", "outcome"], buckets=BUCKETS,
+    )
+
+
+class Trace:
+    """Stage totals for one analyzed upload (shared by the threads working on it)"""
+
+    def __init__(self, media):
+        self.media = media or "unknown"
+        self.model_version = None
+        # "ok", "cached" or "error"; set by the caller once the result is known
+        self.outcome = "error"
+        self.stages = {}
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def finish(self):
+        total = time.perf_counter() - self.started
+        version = self.model_version or "unknown"
+        with self._lock:
+            stages = dict(self.stages)
+        if REGISTRY is not None:
+            for name, seconds in stages.items():
+                STAGE_SECONDS.labels(name, self.media, version).observe(seconds)
+            ANALYSIS_SECONDS.labels(self.media, version, self.outcome).observe(total)
+        if METRICS_LOG_STAGES:
+            spans = " ".join(f"{name}={seconds * 1000.0:.1f}ms" for name, seconds in stages.items())
+            print(f"[Metrics] {self.media} {version} {self.outcome} total={total * 1000.0:.1f}ms {spans}")
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+@contextlib.contextmanager
+def request_trace(media):
+    """Collect the stages run for one upload; observed when the block exits"""
+    if not METRICS_ENABLED:
+        yield None
+        return
+    trace = Trace(media)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+        trace.finish()
+
+
+def set_model_version(version):
+    """Label the current request's stages with the model version that served it"""
+    trace = _current.get()
+    if trace is not None:
+        trace.model_version = version
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Time a block as stage `name` of the current request (no-op outside one)"""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    stack = _stack()
+    now = time.perf_counter()
+    if stack:
+        # Pause the enclosing stage: nested time belongs to the inner one
+        outer = stack[-1]
+        outer[2].add(outer[0], now - outer[1])
+    frame = [name, now, trace]
+    stack.append(frame)
+    try:
+        yield
+    finally:
+        now = time.perf_counter()
+        stack.pop()
+        trace.add(name, now - frame[1])
+        if stack:
+            stack[-1][1] = now
+
+
+def timed_stage(name):
+    """Decorator: time every call of the function as stage `name`"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return fn(*args, **kwargs)
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def timed_iter(name, iterable):
+    """Yield from `iterable`, timing each step of it (not the consumer) as stage `name`"""
+    it = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+        yield item
+
+
+def in_context(fn):
+    """`fn` bound to the caller's context, for threads that work on the current request"""
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def observe_stage(name, seconds, media="", model_version=""):
+    """Record a stage timed outside an analysis (ingestion, history writes)"""
+    if METRICS_ENABLED and REGISTRY is not None:
+        STAGE_SECONDS.labels(name, media or "", model_version or "").observe(seconds)
+
+
+def _gauge(name, doc, labels, samples):
+    family = GaugeMetricFamily(name, doc, labels=labels)
+    for label_values, value in samples:
+        if value is not None:
+            family.add_metric(label_values, float(value))
+    return family
+
+
+def _model_statuses():
+    """(model, status) pairs from the model workers when enabled, else this process's registry"""
+    from model_registry import get_registry
+    from model_workers import worker_stats
+    workers = worker_stats()
+    if workers.get("enabled"):
+        return list(workers.get("models", {}).items()), workers
+    models = get_registry().status()["models"]
+    return [(name, {**s, "loaded": s["state"] in ("ready", "reloading")}) for name, s in models.items()], None
+
+
+class StatsCollector:
+    """Gauges read from the batcher, executor, job, history writer and model stats at scrape time"""
+
+    def collect(self):
+        for collect in (self._queues, self._models):
+            try:
+                yield from collect()
+            except Exception as e:
+                print(f"[Metrics] {collect.__name__} failed: {e}")
+
+    def _queues(self):
+        from batching import batcher_stats
+        from executors import executor_stats
+        from history_writer import history_writer_stats
+        from jobs import get_job_manager
+        batchers = batcher_stats()
+        yield _gauge("deepfake_batcher_queue_depth", "Requests waiting in a model's micro-batcher",
+                     ["model"], [([name], s["queue_depth"]) for name, s in batchers.items()])
+        executors = executor_stats()
+        yield _gauge("deepfake_executor_queued", "Tasks waiting for a worker of a model or DB pool",
+                     ["pool"], [([name], s["queued"]) for name, s in executors.items()])
+        yield _gauge("deepfake_executor_running", "Tasks running on a model or DB pool",
+                     ["pool"], [([name], s["running"]) for name, s in executors.items()])
+        yield _gauge("deepfake_jobs_pending", "Background jobs queued or running",
+                     [], [([], get_job_manager().stats()["pending"])])
+        writer = history_writer_stats()
+        yield _gauge("deepfake_history_writer_pending", "History records queued for the write-behind writer",
+                     [], [([], writer.get("pending", 0))])
+
+    def _models(self):
+        statuses, workers = _model_statuses()
+        yield _gauge("deepfake_model_loaded", "1 when the model is loaded and serving",
+                     ["model", "model_version"],
+                     [([name, s.get("version") or ""], 1 if s.get("loaded") else 0) for name, s in statuses])
+        yield _gauge("deepfake_model_load_seconds", "Time the last load of the model took",
+                     ["model"], [([name], s.get("load_s")) for name, s in statuses])
+        yield _gauge("deepfake_model_warmup_seconds", "Time the warm-up of the model took",
+                     ["model"], [([name], s.get("warmup_s")) for name, s in statuses])
+        if workers is not None:
+            yield _gauge("deepfake_model_workers_idle", "Model worker processes waiting for work",
+                         [], [([], workers["idle"])])
+
+
+if REGISTRY is not None:
+    REGISTRY.register(StatsCollector())
+
+
+def render_metrics():
+    """(body, content_type) in the Prometheus text format, or None without prometheus_client"""
+    if REGISTRY is None:
+        return None
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,353 @@
+"""
+Model registry: artifact resolution, loading, warm-up, hot reload and readiness.
+
+Every model (Keras audio, Keras image, Xception video, MTCNN face detector) is
+an entry that loads exactly once under its own lock, importing its module on
+first use. Artifact paths come from config (AUDIO_MODEL_PATH / IMAGE_MODEL_PATH /
+VIDEO_MODEL_PATH, else the first known file name found in MODEL_DIR) and are
+SHA-256 checksummed; the version tag "<file>@<sha256[:12]>" goes into result
+cache keys and /predict responses.
+
+reload() builds and warms the new artifact next to the serving one and then
+swaps a single handle reference, so in-flight requests finish on the model
+they started with and concurrent reloads queue behind the entry lock instead
+of loading in parallel.
+
+At startup the registry can preload entries in parallel background threads while
+the server already accepts connections (MODEL_PRELOAD=parallel), one after
+another (sequential), or not at all (lazy, for dev: each model loads on its
+first request). After loading, each model is warmed up with zero batches at
+the sizes it will actually see, so the first real request doesn't pay for
+kernel selection and graph tracing. Load and warm-up times are kept per model
+and served by /ready.
+"""
+import hashlib
+import importlib
+import os
+import threading
+import time
+
+import numpy as np
+
+MODEL_PRELOAD = os.getenv("MODEL_PRELOAD", "parallel").lower()
+MODEL_PRELOAD_FAMILIES = [f.strip() for f in os.getenv("MODEL_PRELOAD_FAMILIES", "audio,image,video").split(",")
+                          if f.strip()]
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "1") != "0"
+MODEL_DIR = os.path.abspath(
+    os.getenv("MODEL_DIR") or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "trained")
+)
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ModelSpec:
+    """
+    Where a model lives: `builder` (in `module`) builds it from an artifact
+    path, the `path_setting` env var or the first of `artifacts` found in
+    MODEL_DIR (models without artifacts are built with no arguments and use
+    `fixed_version`). Warm-up runs `forward(batch, model)` on zeros of
+    `input_shape` for each batch size read from the module settings named in
+    `batch_sizes` (capped by `max_batch`), or calls a custom `warmup(model)`.
+    """
+
+    def __init__(self, module, builder, artifacts=(), path_setting=None, forward=None, input_shape=None,
+                 batch_sizes=(), max_batch=None, warmup=None, fixed_version=None):
+        self.module = module
+        self.builder = builder
+        self.artifacts = artifacts
+        self.path_setting = path_setting
+        self.forward = forward
+        self.input_shape = input_shape
+        self.batch_sizes = batch_sizes
+        self.max_batch = max_batch
+        self.warmup = warmup
+        self.fixed_version = fixed_version
+
+    def attr(self, name):
+        return getattr(importlib.import_module(self.module), name)
+
+    def resolve(self, artifact=None):
+        """
+        Artifact path to load: `artifact` (a file name inside MODEL_DIR), else
+        the configured path, else the first known file present in MODEL_DIR.
+        None for models without artifacts.
+        """
+        if not self.artifacts:
+            return None
+        if artifact:
+            path = os.path.realpath(os.path.join(MODEL_DIR, artifact))
+            if not path.startswith(os.path.realpath(MODEL_DIR) + os.sep):
+                raise ValueError(f"Artifact must be inside MODEL_DIR: {artifact}")
+            candidates = [path]
+        elif self.path_setting and os.getenv(self.path_setting):
+            candidates = [os.path.abspath(os.getenv(self.path_setting))]
+        else:
+            candidates = [os.path.join(MODEL_DIR, name) for name in self.artifacts]
+        for path in candidates:
+            if os.path.isfile(path):
+                return path
+        raise FileNotFoundError(f"Model artifact not found (tried {', '.join(candidates)})")
+
+    def warmup_sizes(self):
+        sizes = {int(self.attr(n)) for n in self.batch_sizes} or {1}
+        if self.max_batch:
+            cap = int(self.attr(self.max_batch))
+            sizes = {min(s, cap) for s in sizes}
+        return sorted(s for s in sizes if s > 0)
+
+
+SPECS = {
+    "audio": ModelSpec("audio_utils", "build_audio_model", artifacts=("audio_classifier.h5",),
+                       path_setting="AUDIO_MODEL_PATH", forward="_audio_forward_local",
+                       input_shape=(128, 109, 1), batch_sizes=("AUDIO_STREAM_BATCH", "AUDIO_MAX_SEGMENTS")),
+    "image": ModelSpec("image_utils", "build_image_model", artifacts=("face_real_vs_ai_model.h5", "novelty.h5"),
+                       path_setting="IMAGE_MODEL_PATH", forward="_image_forward_local",
+                       input_shape=(256, 256, 3)),
+    "video": ModelSpec("video_utils", "build_video_model", artifacts=("ffpp_c23.pth",),
+                       path_setting="VIDEO_MODEL_PATH", forward="_xception_forward_local",
+                       input_shape=(3, 299, 299), batch_sizes=("VIDEO_NUM_FRAMES", "VIDEO_BATCH_MAX_SIZE"),
+                       max_batch="VIDEO_BATCH_MAX_SIZE"),
+    "mtcnn": ModelSpec("video_utils", "build_mtcnn", warmup="warmup_mtcnn", fixed_version="facenet-pytorch-mtcnn"),
+}
+
+# Upload kinds -> the models they need
+FAMILIES = {"audio": ("audio",), "image": ("image",), "video": ("video", "mtcnn")}
+
+
+class ModelHandle:
+    """One loaded artifact; swapped as a whole on reload."""
+
+    __slots__ = ("model", "version", "path", "sha256", "loaded_at")
+
+    def __init__(self, model, version, path, sha256):
+        self.model = model
+        self.version = version
+        self.path = path
+        self.sha256 = sha256
+        self.loaded_at = time.time()
+
+
+class ModelEntry:
+    def __init__(self, name, spec):
+        self.name = name
+        self.spec = spec
+        self.state = "pending"
+        self.handle = None
+        self.error = None
+        self.load_s = None
+        self.warmup_s = None
+        self.reloads = 0
+        self._lock = threading.Lock()
+
+    def ensure(self):
+        """Current handle, loading it first if needed; concurrent callers wait for one load."""
+        handle = self.handle
+        if handle is not None:
+            return handle
+        with self._lock:
+            if self.handle is not None:
+                return self.handle
+            # A failed model is retried on the next call, like the old lazy loaders
+            self.state = "loading"
+            self.error = None
+            try:
+                self.handle = self._build(self.spec.resolve())
+                self.state = "ready"
+            except Exception as e:
+                self.error = str(e)
+                self.state = "failed"
+                print(f"[Registry] {self.name} failed to load: {e}")
+            return self.handle
+
+    def reload(self, artifact=None):
+        """
+        Build `artifact` (or the configured one) next to the serving model,
+        warm it up and swap it in. Raises if the new artifact fails to load;
+        the old model keeps serving in that case.
+        """
+        with self._lock:
+            old = self.handle
+            path = self.spec.resolve(artifact)
+            digest = file_sha256(path) if path else None
+            if old is not None and path and old.path == path and old.sha256 == digest:
+                return {"status": "unchanged", "version": old.version}
+            self.state = "reloading" if old is not None else "loading"
+            try:
+                new = self._build(path, digest)
+            except Exception as e:
+                self.error = str(e)
+                self.state = "ready" if old is not None else "failed"
+                print(f"[Registry] {self.name} reload failed, keeping {old.version if old else 'nothing'}: {e}")
+                raise
+            # Single reference swap: requests that already hold `old` finish on it
+            self.handle = new
+            self.state = "ready"
+            self.error = None
+            self.reloads += 1
+            print(f"[Registry] {self.name} swapped {old.version if old else None} -> {new.version}")
+            return {"status": "reloaded", "previous": old.version if old else None, "version": new.version}
+
+    def _build(self, path, digest=None):
+        spec = self.spec
+        if path and digest is None:
+            digest = file_sha256(path)
+        t0 = time.perf_counter()
+        builder = spec.attr(spec.builder)
+        model = builder(path) if spec.artifacts else builder()
+        self.load_s = time.perf_counter() - t0
+        if model is None:
+            raise RuntimeError("builder returned no model")
+        if MODEL_WARMUP:
+            t0 = time.perf_counter()
+            self._warmup(model)
+            self.warmup_s = time.perf_counter() - t0
+        version = f"{os.path.basename(path)}@{digest[:12]}" if path else spec.fixed_version
+        variant = getattr(model, "variant", None)
+        if variant:
+            # Optimized backends don't reproduce eager outputs bit for bit
+            version = f"{version}+{variant}"
+        print(f"[Registry] {self.name} {version} ready (load {self.load_s:.2f}s"
+              + (f", warm-up {self.warmup_s:.2f}s)" if MODEL_WARMUP else ")"))
+        return ModelHandle(model, version, path, digest)
+
+    def _warmup(self, model):
+        spec = self.spec
+        if spec.warmup:
+            spec.attr(spec.warmup)(model)
+            return
+        if not spec.forward:
+            return
+        forward = spec.attr(spec.forward)
+        for n in spec.warmup_sizes():
+            forward(np.zeros((n,) + spec.input_shape, dtype=np.float32), model)
+
+    def status(self):
+        handle = self.handle
+        return {
+            "state": self.state,
+            "version": handle.version if handle else None,
+            "path": handle.path if handle else None,
+            "sha256": handle.sha256 if handle else None,
+            "validation": getattr(handle.model, "validation", None) if handle else None,
+            "reloads": self.reloads,
+            "load_s": None if self.load_s is None else round(self.load_s, 3),
+            "warmup_s": None if self.warmup_s is None else round(self.warmup_s, 3),
+            "error": self.error,
+        }
+
+
+class ModelRegistry:
+    def __init__(self, specs=SPECS):
+        self._entries = {name: ModelEntry(name, spec) for name, spec in specs.items()}
+        self._expected = set()
+        self._started_at = None
+        self._finished_at = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def expand(families):
+        """Model names for a list of upload kinds / model names."""
+        names = []
+        for f in families:
+            for name in FAMILIES.get(f, (f,)):
+                if name in SPECS and name not in names:
+                    names.append(name)
+        return names
+
+    def handle(self, name):
+        """Current ModelHandle, loading it now if needed; None if it cannot be loaded."""
+        return self._entries[name].ensure()
+
+    def get(self, name):
+        """The loaded model, loading it now if needed; None if it cannot be loaded."""
+        handle = self._entries[name].ensure()
+        return handle.model if handle is not None else None
+
+    def version(self, name):
+        handle = self._entries[name].ensure()
+        return handle.version if handle is not None else "missing"
+
+    def reload(self, name, artifact=None):
+        """Hot-swap `name` to a new artifact (see ModelEntry.reload)."""
+        if name not in self._entries:
+            raise KeyError(f"Unknown model: {name}")
+        return self._entries[name].reload(artifact)
+
+    def spec(self, name):
+        return self._entries[name].spec
+
+    def is_loaded(self, name):
+        return self._entries[name].handle is not None
+
+    def entry_status(self, name):
+        return self._entries[name].status()
+
+    def preload(self, names, mode="parallel", wait=False):
+        """
+        Load and warm up the models `names` in background threads: all at once
+        ("parallel") or one by one ("sequential"). `wait` blocks until they
+        are done. "lazy" loads nothing up front.
+        """
+        names = [n for n in names if n in self._entries]
+        if mode == "lazy" or not names:
+            return
+        with self._lock:
+            self._expected.update(names)
+            self._started_at = self._started_at or time.perf_counter()
+        if mode == "sequential":
+            threads = [threading.Thread(target=self._load_all, args=(names,), name="preload", daemon=True)]
+        else:
+            threads = [threading.Thread(target=self._load_all, args=([n],), name=f"preload-{n}", daemon=True)
+                       for n in names]
+        for t in threads:
+            t.start()
+        if wait:
+            for t in threads:
+                t.join()
+
+    def _load_all(self, names):
+        for name in names:
+            self.get(name)
+        with self._lock:
+            if all(self._entries[n].state in ("ready", "failed") for n in self._expected):
+                self._finished_at = self._finished_at or time.perf_counter()
+
+    def ready(self):
+        """True once every preloaded model is loaded and warmed up."""
+        with self._lock:
+            expected = list(self._expected)
+        return all(self._entries[n].handle is not None for n in expected)
+
+    def status(self):
+        with self._lock:
+            expected = sorted(self._expected)
+            elapsed = None
+            if self._started_at is not None and self._finished_at is not None:
+                elapsed = round(self._finished_at - self._started_at, 3)
+        return {
+            "ready": self.ready(),
+            "mode": MODEL_PRELOAD,
+            "model_dir": MODEL_DIR,
+            "preloaded": expected,
+            "preload_s": elapsed,
+            "models": {name: e.status() for name, e in self._entries.items()},
+        }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ModelRegistry()
+    return _registry
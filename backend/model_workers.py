@@ -0,0 +1,485 @@
+"""
+Multi-process model serving.
+
+With MODEL_WORKERS > 0 the API process stops running model forward passes
+itself and hands each batch to a fixed set of forked worker processes:
+
+- families listed in MODEL_WORKER_PRELOAD are loaded once in the parent before
+  fork (and the GC is frozen), so their weight pages stay shared copy-on-write;
+  the rest are loaded in each worker after fork. TensorFlow's runtime is not
+  fork-safe once initialized, so by default only the torch video model is
+  preloaded
+- input tensors travel through a shared-memory SlabRing (tensor_transport):
+  batches are concatenated straight into a slab and only a small descriptor
+  crosses the pipe; outputs are small and come back over the pipe
+- a dispatch returns a Future, so one batcher can keep every worker busy
+- a worker that dies is replaced with a *spawned* process: by then the API
+  process runs executor, batcher and writer threads, and forking it could
+  leave the child stuck on a lock some other thread held at fork time. The
+  replacement loads every model itself (no copy-on-write sharing) and
+  attaches to the SlabRing by name
+
+The API process then never loads the TensorFlow models itself: availability
+and version tags come from the workers. The API starts them on a background
+thread (start_model_workers_background) and only waits for the fork, so it
+serves /health and /ready while they load. Startup progress, time and
+RSS/PSS/shared memory per worker are reported by worker_stats().
+"""
+import gc
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from model_registry import get_registry
+from tensor_transport import SlabArray, SlabRing
+
+MODEL_WORKERS = int(os.getenv("MODEL_WORKERS", "0"))
+MODEL_WORKER_PRELOAD = [f.strip() for f in os.getenv("MODEL_WORKER_PRELOAD", "video").split(",") if f.strip()]
+MODEL_WORKER_SLAB_MB = int(os.getenv("MODEL_WORKER_SLAB_MB", "32"))
+# 0 = one more slab than there are workers
+MODEL_WORKER_SLABS = int(os.getenv("MODEL_WORKER_SLABS", "0"))
+MODEL_WORKER_START_TIMEOUT = float(os.getenv("MODEL_WORKER_START_TIMEOUT", "300"))
+
+# Model families served by the workers (see model_registry.SPECS)
+FAMILIES = ("audio", "image", "video")
+# Version prefix while workers serve different artifacts of a model
+MIXED_VERSION = "mixed:"
+# Version while the workers are still loading their models
+STARTING_VERSION = "starting"
+
+_pool = None
+_pool_lock = threading.Lock()
+_start_error = None
+
+
+def _proc_memory(pid):
+    """RSS / PSS / shared memory of a process in MB (Linux /proc)."""
+    mem = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("Rss", "Pss", "Shared_Clean", "Shared_Dirty"):
+                    mem[key] = int(rest.split()[0]) / 1024.0
+    except OSError:
+        return {}
+    return {
+        "rss_mb": round(mem.get("Rss", 0.0), 1),
+        "pss_mb": round(mem.get("Pss", 0.0), 1),
+        "shared_mb": round(mem.get("Shared_Clean", 0.0) + mem.get("Shared_Dirty", 0.0), 1),
+    }
+
+
+def _model_status(registry, name):
+    return {**registry.entry_status(name), "loaded": registry.is_loaded(name)}
+
+
+def _worker_main(index, conn, ring, threads, inherited=MODEL_WORKER_PRELOAD):
+    """Serve forward passes and reloads; `inherited` families were loaded before fork"""
+    global _pool
+    _pool = None  # inherited from the parent; this process runs models locally
+    started = time.perf_counter()
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except Exception:
+        pass
+    try:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except Exception:
+        # Already initialized (preloaded before fork)
+        pass
+    registry = get_registry()
+    registry.preload([f for f in FAMILIES if f not in inherited], wait=True)
+    conn.send(("ready", {family: _model_status(registry, family) for family in FAMILIES}))
+
+    forwards = {}
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            break
+        if msg is None:
+            break
+        try:
+            if msg[0] == "reload":
+                _, name, artifact = msg
+                result = registry.reload(name, artifact)
+                conn.send(("ok", {**result, "model": _model_status(registry, name)}))
+                continue
+            _, family, desc, inline = msg
+            batch = inline if desc is None else ring.view(desc)
+            fn = forwards.get(family)
+            if fn is None:
+                spec = registry.spec(family)
+                fn = forwards[family] = spec.attr(spec.forward)
+            conn.send(("ok", np.asarray(fn(batch))))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+    conn.close()
+    os._exit(0)
+
+
+def _spawned_worker_main(index, conn, ring_spec, threads):
+    """Entry point of a replacement worker started with spawn: nothing is inherited"""
+    name, slab_bytes, slabs = ring_spec
+    ring = SlabRing(slab_bytes, slabs, name=name, create=False)
+    _worker_main(index, conn, ring, threads, inherited=())
+
+
+class _Worker:
+    def __init__(self, index, process, conn, spawned_at):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.spawned_at = spawned_at
+        self.startup_s = None
+        self.requests = 0
+        self.errors = 0
+        # name -> artifact reloaded on this worker, replayed on its replacement
+        self.artifacts = {}
+
+
+class ModelWorkerPool:
+    """Fixed set of forked model processes fed through shared memory."""
+
+    def __init__(self, workers=MODEL_WORKERS, slab_mb=MODEL_WORKER_SLAB_MB, slabs=MODEL_WORKER_SLABS):
+        self.size = max(1, int(workers))
+        self.ring = SlabRing(max(1, int(slab_mb)) * 1024 * 1024, slabs or self.size + 1)
+        self.threads = max(1, (os.cpu_count() or 1) // self.size)
+        self.preload_s = 0.0
+        self.models = {}
+        # preloading -> starting -> ready (or failed)
+        self.state = "preloading"
+        self._ctx = mp.get_context("fork")
+        # Replacements start from a fresh interpreter (see the module docstring)
+        self._respawn_ctx = mp.get_context("spawn")
+        self._workers = []
+        self._idle = queue.Queue()
+        self._dispatch = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="model-dispatch")
+        self._closed = False
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._reloaded = {}  # name -> artifact every worker serves, restored when a roll fails
+
+    def start(self, forked=None):
+        """Preload, fork the workers and wait until each is ready; `forked` is set once they exist"""
+        try:
+            t0 = time.perf_counter()
+            registry = get_registry()
+            registry.preload(registry.expand([f for f in MODEL_WORKER_PRELOAD if f in FAMILIES]), wait=True)
+            self.preload_s = time.perf_counter() - t0
+            # Keep the GC from touching (and so un-sharing) every preloaded object
+            gc.collect()
+            gc.freeze()
+            self.state = "starting"
+            for i in range(self.size):
+                self._workers.append(self._spawn(i))
+        finally:
+            if forked is not None:
+                forked.set()
+        for w in self._workers:
+            self.models = self._wait_ready(w)
+            self._idle.put(w)
+        self.state = "ready"
+        print(f"[Workers] {self.size} model workers ready (parent preload {self.preload_s:.2f}s, "
+              f"{self.threads} threads each)")
+
+    def _spawn(self, index, replacement=False):
+        ctx = self._respawn_ctx if replacement else self._ctx
+        parent_conn, child_conn = ctx.Pipe()
+        if replacement:
+            target = _spawned_worker_main
+            ring = (self.ring.name, self.ring.slab_bytes, self.ring.slabs)
+        else:
+            target, ring = _worker_main, self.ring
+        process = ctx.Process(target=target, name=f"model-worker-{index}",
+                              args=(index, child_conn, ring, self.threads), daemon=True)
+        spawned_at = time.perf_counter()
+        process.start()
+        child_conn.close()
+        return _Worker(index, process, parent_conn, spawned_at)
+
+    def _wait_ready(self, worker):
+        if not worker.conn.poll(MODEL_WORKER_START_TIMEOUT):
+            raise RuntimeError(f"model worker {worker.index} did not start")
+        _, models = worker.conn.recv()
+        worker.startup_s = time.perf_counter() - worker.spawned_at
+        print(f"[Workers] worker {worker.index} (pid {worker.process.pid}) ready in {worker.startup_s:.2f}s")
+        return models
+
+    def submit(self, family, batch):
+        """
+        Dispatch one forward pass and return a Future for its output. Blocks
+        while every worker is busy, so callers keep batching in the meantime.
+        """
+        inline = None
+        if isinstance(batch, SlabArray) and batch.ring is self.ring:
+            # Built in place by the batcher (see batch_buffer): hand over by reference
+            desc = batch.descriptor
+        elif self.ring.fits(batch.shape, batch.dtype):
+            desc = self.ring.put(batch)
+        else:
+            print(f"[Workers] {family} batch of {batch.nbytes} bytes exceeds a slab; sending inline")
+            desc, inline = None, np.ascontiguousarray(batch)
+        worker = self._idle.get()
+        return self._dispatch.submit(self._roundtrip, worker, ("forward", family, desc, inline))
+
+    def _roundtrip(self, worker, msg):
+        try:
+            worker.conn.send(msg)
+            status, payload = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            self._replace(worker)
+            raise RuntimeError(f"model worker {worker.index} died: {e}")
+        finally:
+            if msg[0] == "forward" and msg[2] is not None:
+                self.ring.release(msg[2])
+        worker.requests += 1
+        self._idle.put(worker)
+        if status != "ok":
+            worker.errors += 1
+            raise RuntimeError(payload)
+        return payload
+
+    def reload(self, name, artifact=None):
+        """
+        Rolling reload: take idle workers one at a time and have each swap
+        `name` in place, so the rest keep serving requests meanwhile. While
+        the workers disagree the version reads "mixed:..." (not cached, see
+        version_settled). If a worker fails, the workers already reloaded
+        are rolled back to the previous artifact and the error is re-raised.
+        """
+        with self._reload_lock:
+            before = self.models.get(name, {})
+            previous = self._reloaded.get(name)
+            self.models[name] = {**before, "version": f"{MIXED_VERSION}{before.get('version')}"}
+            done = []
+            try:
+                result = self._roll(name, artifact, [w.index for w in self._workers], done)
+            except Exception as e:
+                print(f"[Workers] {name} reload failed ({e}); rolling back {len(done)} worker(s)")
+                try:
+                    rolled_back = self._roll(name, previous, done, [])
+                except Exception as rollback_error:
+                    # Left mixed until the next successful reload
+                    print(f"[Workers] {name} rollback failed, version stays mixed: {rollback_error}")
+                    raise e
+                self.models[name] = rolled_back.pop("model") if rolled_back else before
+                raise
+            self._reloaded[name] = artifact
+            self.models[name] = result.pop("model")
+            return result
+
+    def _roll(self, name, artifact, indices, done):
+        """Reload `name` on the workers `indices` one at a time; `done` collects those finished"""
+        pending = set(indices)
+        result = None
+        while pending:
+            worker = self._idle.get()
+            if worker.index not in pending:
+                # Not part of this roll: give it back and wait for another one
+                self._idle.put(worker)
+                time.sleep(0.01)
+                continue
+            result = self._roundtrip(worker, ("reload", name, artifact))
+            worker.artifacts[name] = artifact
+            pending.discard(worker.index)
+            done.append(worker.index)
+            print(f"[Workers] worker {worker.index} {name}: {result['status']} {result['version']}")
+        return result
+
+    def _replace(self, worker):
+        print(f"[Workers] worker {worker.index} (pid {worker.process.pid}) exited; respawning")
+        worker.process.join(timeout=1)
+        with self._lock:
+            if self._closed:
+                return
+            new = self._spawn(worker.index, replacement=True)
+            self._workers[worker.index] = new
+        try:
+            # The pool's model status is left alone: the replay below brings
+            # the replacement to the artifacts the dead worker was serving
+            self._wait_ready(new)
+            for name, artifact in list(worker.artifacts.items()):
+                new.conn.send(("reload", name, artifact))
+                status, payload = new.conn.recv()
+                if status != "ok":
+                    raise RuntimeError(f"reload of {name} failed: {payload}")
+                new.artifacts[name] = artifact
+            self._idle.put(new)
+        except Exception as e:
+            print(f"[Workers] Could not respawn worker {worker.index}: {e}")
+
+    def stats(self):
+        workers = []
+        for w in list(self._workers):
+            workers.append({
+                "index": w.index,
+                "pid": w.process.pid,
+                "alive": w.process.is_alive(),
+                "startup_s": None if w.startup_s is None else round(w.startup_s, 3),
+                "requests": w.requests,
+                "errors": w.errors,
+                **_proc_memory(w.process.pid),
+            })
+        return {
+            "state": self.state,
+            "size": self.size,
+            "ready_workers": sum(1 for w in workers if w["startup_s"] is not None),
+            "workers": workers,
+            "idle": self._idle.qsize(),
+            "preload_s": round(self.preload_s, 3),
+            "preloaded": MODEL_WORKER_PRELOAD,
+            "models": self.models,
+            "slabs": {"total": self.ring.slabs, "free": self.ring.available(),
+                      "slab_mb": self.ring.slab_bytes // (1024 * 1024)},
+            "parent": {"pid": os.getpid(), **_proc_memory(os.getpid())},
+        }
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+        for w in self._workers:
+            try:
+                w.conn.send(None)
+            except Exception:
+                pass
+        for w in self._workers:
+            w.process.join(timeout=5)
+            if w.process.is_alive():
+                w.process.terminate()
+        self._dispatch.shutdown(wait=False)
+        self.ring.close()
+
+
+def start_model_workers(workers=MODEL_WORKERS, forked=None):
+    """
+    Preload shared weights, fork the worker processes and wait until they are
+    ready (no-op when workers == 0). The pool is published up front, so
+    worker_stats() reports its progress and requests wait for the workers
+    instead of loading models in this process. `forked` (an Event) is set
+    once the processes exist or the start failed.
+    """
+    global _pool, _start_error
+    try:
+        if workers <= 0:
+            return None
+        with _pool_lock:
+            if _pool is not None:
+                return _pool
+            pool = _pool = ModelWorkerPool(workers)
+            _start_error = None
+        try:
+            pool.start(forked)
+        except Exception as e:
+            pool.state = "failed"
+            with _pool_lock:
+                current = _pool
+                if current is pool:
+                    # Fall back to loading models in this process, as without workers
+                    _pool = None
+                    _start_error = str(e)
+            if current is pool:
+                pool.shutdown()
+            raise
+        return pool
+    finally:
+        if forked is not None:
+            forked.set()
+
+
+def start_model_workers_background(workers=MODEL_WORKERS):
+    """
+    start_model_workers() on a daemon thread. Returns an Event set once the
+    worker processes are forked; they finish loading in the background.
+    """
+    forked = threading.Event()
+
+    def run():
+        try:
+            start_model_workers(workers, forked)
+        except Exception as e:
+            print(f"[Workers] Error starting model workers: {e}")
+
+    threading.Thread(target=run, name="model-workers-start", daemon=True).start()
+    return forked
+
+
+def run_model(family, batch, local_fn):
+    """Forward `batch` on a worker process (returns a Future) or in-process via `local_fn`."""
+    pool = _pool
+    if pool is None:
+        return local_fn(batch)
+    return pool.submit(family, batch)
+
+
+def model_available(family):
+    """Whether `family` can serve requests: as reported by the workers, else loaded in-process."""
+    pool = _pool
+    if pool is None:
+        return get_registry().get(family) is not None
+    return pool.models.get(family, {}).get("loaded", False)
+
+
+def worker_model_version(family):
+    """Model version reported by the workers ("starting" before they report), or None when running in-process."""
+    pool = _pool
+    if pool is None:
+        return None
+    status = pool.models.get(family)
+    if status is None:
+        return STARTING_VERSION
+    return status.get("version") or "missing"
+
+
+def version_settled(version):
+    """False while the workers start or disagree on an artifact (results aren't cacheable then)."""
+    if not isinstance(version, str):
+        return True
+    return version != STARTING_VERSION and not version.startswith(MIXED_VERSION)
+
+
+def reload_model(name, artifact=None):
+    """Hot-swap a model on every worker (rolling) or in this process."""
+    pool = _pool
+    if pool is None or name not in FAMILIES:
+        return get_registry().reload(name, artifact)
+    return pool.reload(name, artifact)
+
+
+def batch_buffer(shape, dtype):
+    """
+    MicroBatcher alloc_fn: a free slab to concatenate a batch into, so it
+    reaches the worker without another copy. None when workers are off or
+    no slab is free right now.
+    """
+    pool = _pool
+    if pool is None or not pool.ring.fits(shape, dtype):
+        return None
+    return pool.ring.alloc(shape, dtype, timeout=0)
+
+
+def worker_stats():
+    pool = _pool
+    if pool is None:
+        status = {"enabled": False, "process": {"pid": os.getpid(), **_proc_memory(os.getpid())}}
+        if _start_error is not None:
+            status.update(state="failed", error=_start_error)
+        return status
+    return {"enabled": True, **pool.stats()}
+
+
+def stop_model_workers():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
@@ -0,0 +1,143 @@
+"""
+Content-hash result cache for /predict.
+
+Results are keyed by the SHA-256 of the upload plus the model version and the
+preprocessing parameters, so a new model or a different `num_frames` /
+`max_segments` never serves a stale verdict. The in-process tier is a bounded
+LRU with a TTL; RESULT_CACHE_DB optionally adds a persistent SQLite tier that
+survives restarts and is shared by workers on the same node.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1024"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "86400"))
+RESULT_CACHE_DB = os.getenv("RESULT_CACHE_DB") or None
+
+
+def make_cache_key(digest, kind, model_version, **params):
+    """Build a cache key from the content hash, model version and preprocessing params."""
+    param_str = ",".join(f"{k}={params[k]}" for k in sorted(params))
+    return f"{kind}:{model_version}:{param_str}:{digest}"
+
+
+class ResultCache:
+    """Thread-safe LRU + TTL cache with an optional SQLite second tier."""
+
+    def __init__(self, max_entries=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL, db_path=RESULT_CACHE_DB):
+        self.max_entries = max(0, int(max_entries))
+        self.ttl = float(ttl)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "persistent_hits": 0, "evictions": 0, "expired": 0}
+        self._db = None
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, created REAL)"
+                )
+                self._db.commit()
+                print(f"Result cache persistent tier at {db_path}")
+            except Exception as e:
+                print(f"Could not open result cache DB {db_path}: {e}")
+                self._db = None
+
+    def _expired(self, created):
+        return self.ttl > 0 and time.time() - created > self.ttl
+
+    def _db_get(self, key):
+        row = self._db.execute("SELECT value, created FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, created = row
+        if self._expired(created):
+            self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+            self._db.commit()
+            self._stats["expired"] += 1
+            return None
+        return json.loads(value), created
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, created = entry
+                if not self._expired(created):
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return dict(value)
+                del self._entries[key]
+                self._stats["expired"] += 1
+            if self._db is not None:
+                try:
+                    found = self._db_get(key)
+                except Exception as e:
+                    print(f"Result cache DB read error: {e}")
+                    found = None
+                if found is not None:
+                    self._insert(key, *found)
+                    self._stats["hits"] += 1
+                    self._stats["persistent_hits"] += 1
+                    return dict(found[0])
+            self._stats["misses"] += 1
+            return None
+
+    def _insert(self, key, value, created):
+        if self.max_entries == 0:
+            return
+        self._entries[key] = (value, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def put(self, key, value):
+        created = time.time()
+        value = dict(value)
+        with self._lock:
+            self._insert(key, value, created)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO results (key, value, created) VALUES (?, ?, ?)",
+                        (key, json.dumps(value), created),
+                    )
+                    self._db.commit()
+                except Exception as e:
+                    print(f"Result cache DB write error: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s["entries"] = len(self._entries)
+        lookups = s["hits"] + s["misses"]
+        s["hit_rate"] = s["hits"] / lookups if lookups else 0.0
+        s["max_entries"] = self.max_entries
+        s["ttl_seconds"] = self.ttl
+        s["persistent"] = self._db is not None
+        return s
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    global _result_cache
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                _result_cache = ResultCache()
+    return _result_cache
@@ -0,0 +1,108 @@
+"""
+Zero-copy tensor transport over shared memory.
+
+A SlabRing is one multiprocessing.shared_memory segment cut into fixed-size
+slabs. A producer writes an array into a free slab (or allocates the slab and
+builds the array in place) and sends only a small TensorDescriptor
+(slab, offset, shape, dtype) to the consumer, which maps the same bytes as a
+numpy view. Nothing is pickled. The slab goes back to the ring when the
+producer releases the descriptor.
+
+The free list lives in the creating process. Consumers (e.g. forked model
+workers) only call view().
+"""
+import queue
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+TensorDescriptor = namedtuple("TensorDescriptor", ["slab", "offset", "shape", "dtype"])
+
+
+class TensorTooLarge(ValueError):
+    """Raised when an array does not fit in one slab."""
+
+
+class SlabArray(np.ndarray):
+    """ndarray view of a slab that remembers its descriptor."""
+
+    descriptor = None
+    ring = None
+
+    def __array_finalize__(self, obj):
+        # Slices and other derived arrays are not slab-backed as a whole
+        self.descriptor = None
+        self.ring = None
+
+
+class SlabRing:
+    def __init__(self, slab_bytes, slabs, name=None, create=True):
+        self.slab_bytes = int(slab_bytes)
+        self.slabs = max(1, int(slabs))
+        self._shm = shared_memory.SharedMemory(name=name, create=create, size=self.slab_bytes * self.slabs)
+        self._owner = create
+        self._free = queue.Queue()
+        if create:
+            for i in range(self.slabs):
+                self._free.put(i)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def fits(self, shape, dtype):
+        return int(np.prod(shape)) * np.dtype(dtype).itemsize <= self.slab_bytes
+
+    def alloc(self, shape, dtype, timeout=None):
+        """
+        Reserve a slab for an array of `shape`/`dtype` and return a writable
+        SlabArray over it (`.descriptor` is set). Blocks up to `timeout` seconds
+        for a free slab (None = forever, 0 = don't wait) and returns None when
+        none became free.
+        """
+        shape = tuple(int(d) for d in shape)
+        dtype = np.dtype(dtype)
+        if not self.fits(shape, dtype):
+            raise TensorTooLarge(f"{shape} {dtype} does not fit in a {self.slab_bytes} byte slab")
+        try:
+            slab = self._free.get(block=timeout != 0, timeout=timeout or None)
+        except queue.Empty:
+            return None
+        desc = TensorDescriptor(slab, slab * self.slab_bytes, shape, dtype.str)
+        arr = self.view(desc).view(SlabArray)
+        arr.descriptor = desc
+        arr.ring = self
+        return arr
+
+    def put(self, array, timeout=None):
+        """Copy `array` into a free slab and return its descriptor (None on timeout)."""
+        array = np.asarray(array)
+        arr = self.alloc(array.shape, array.dtype, timeout=timeout)
+        if arr is None:
+            return None
+        np.copyto(arr, array, casting="no")
+        return arr.descriptor
+
+    def view(self, desc):
+        """Array over the bytes a descriptor points to (no copy)."""
+        return np.ndarray(desc.shape, dtype=np.dtype(desc.dtype), buffer=self._shm.buf, offset=desc.offset)
+
+    def release(self, desc):
+        """Return a descriptor's slab to the ring."""
+        self._free.put(desc.slab)
+
+    def available(self):
+        return self._free.qsize()
+
+    def close(self):
+        try:
+            self._shm.close()
+        except BufferError:
+            # Views are still alive; the mapping goes away with them
+            pass
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
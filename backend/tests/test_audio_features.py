@@ -0,0 +1,52 @@
+"""
+Feature parity of preprocess_audio with the original per-segment librosa loop
+(benchmarks/bench_audio_features.py times the two).
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("librosa")
+pytest.importorskip("soundfile")
+
+from audio_utils import preprocess_audio  # noqa: E402
+from benchmarks.bench_audio_features import legacy_preprocess_audio, make_clip  # noqa: E402
+
+# dB; features span [-80, 0]
+FULL_ATOL = 1e-3
+# "partial" resamples each window on its own; reads are aligned to whole
+# 22.05 kHz samples, so it should stay this close to a full-file resample
+PARTIAL_ATOL = 1e-2
+
+
+@pytest.fixture(scope="module")
+def clips(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp("audio")
+    cache = {}
+
+    def clip(seconds, sr=44100):
+        if (seconds, sr) not in cache:
+            path = str(tmp / f"clip_{seconds}_{sr}.wav")
+            make_clip(path, seconds, sr)
+            cache[seconds, sr] = (path, legacy_preprocess_audio(path))
+        return cache[seconds, sr]
+
+    return clip
+
+
+@pytest.mark.parametrize("seconds", [2, 10, 45, 300])
+def test_full_decode_matches_legacy(clips, seconds):
+    path, ref = clips(seconds)
+    out = preprocess_audio(path, decode_mode="full")
+    assert out.shape == ref.shape
+    assert out.dtype == np.float32
+    assert np.abs(out - ref).max() <= FULL_ATOL
+
+
+@pytest.mark.parametrize("sr", [44100, 48000, 16000])
+@pytest.mark.parametrize("seconds", [2, 10, 45, 300])
+def test_partial_decode_matches_legacy(clips, seconds, sr):
+    path, ref = clips(seconds, sr)
+    out = preprocess_audio(path, decode_mode="partial")
+    assert out.shape == ref.shape
+    assert out.dtype == np.float32
+    assert np.abs(out - ref).max() <= PARTIAL_ATOL
@@ -0,0 +1,106 @@
+"""
+Round trips through tensor_transport.SlabRing
+(benchmarks/bench_tensor_transport.py measures its throughput).
+"""
+import multiprocessing as mp
+import zlib
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from tensor_transport import SlabRing, TensorTooLarge  # noqa: E402
+
+
+@pytest.fixture
+def ring():
+    ring = SlabRing(8 * 1024 * 1024, 3)
+    yield ring
+    ring.close()
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.uint8, np.float64])
+def test_put_view(ring, dtype):
+    a = (np.random.default_rng(0).random((4, 3, 64, 64)) * 255).astype(dtype)
+    desc = ring.put(a)
+    view = ring.view(desc)
+    assert view.dtype == a.dtype
+    assert np.array_equal(view, a)
+    ring.release(desc)
+
+
+def test_empty_batch(ring):
+    empty = np.zeros((0, 128, 109, 1), dtype=np.float32)
+    desc = ring.put(empty)
+    assert ring.view(desc).shape == empty.shape
+    ring.release(desc)
+
+
+def test_non_contiguous_input(ring):
+    strided = np.random.default_rng(0).random((8, 3, 32, 32), dtype=np.float32)[::2, :, ::2]
+    desc = ring.put(strided)
+    assert np.array_equal(ring.view(desc), strided)
+    ring.release(desc)
+
+
+def test_alloc_in_place(ring):
+    arr = ring.alloc((2, 5), np.float32)
+    arr[...] = 7
+    assert np.all(ring.view(arr.descriptor) == 7)
+    # Slices are plain views, not handed over by descriptor
+    assert arr[:1].descriptor is None
+    ring.release(arr.descriptor)
+
+
+def test_exhausted_ring_and_reuse(ring):
+    held = [ring.put(np.ones(10)) for _ in range(ring.slabs)]
+    assert ring.put(np.ones(10), timeout=0) is None
+    for desc in held:
+        ring.release(desc)
+    assert ring.available() == ring.slabs
+
+
+def test_oversized_array_rejected(ring):
+    with pytest.raises(TensorTooLarge):
+        ring.put(np.zeros(ring.slab_bytes // 4 + 1, dtype=np.float32))
+
+
+def _checksum_child(ring, conn):
+    desc = conn.recv()
+    conn.send(zlib.crc32(ring.view(desc).tobytes()))
+
+
+@pytest.mark.skipif("fork" not in mp.get_all_start_methods(), reason="needs fork")
+def test_forked_consumer_sees_same_bytes(ring):
+    ctx = mp.get_context("fork")
+    a = np.random.default_rng(0).random((16, 3, 64, 64), dtype=np.float32)
+    desc = ring.put(a)
+    parent, child = ctx.Pipe()
+    p = ctx.Process(target=_checksum_child, args=(ring, child))
+    p.start()
+    parent.send(desc)
+    remote = parent.recv()
+    p.join()
+    ring.release(desc)
+    assert remote == zlib.crc32(a.tobytes())
+
+
+def _attach_checksum_child(spec, desc, conn):
+    name, slab_bytes, slabs = spec
+    ring = SlabRing(slab_bytes, slabs, name=name, create=False)
+    conn.send(zlib.crc32(ring.view(desc).tobytes()))
+
+
+def test_spawned_consumer_attaches_by_name(ring):
+    # How replacement model workers reach the ring (see model_workers)
+    ctx = mp.get_context("spawn")
+    a = np.random.default_rng(1).random((4, 128, 109, 1), dtype=np.float32)
+    desc = ring.put(a)
+    parent, child = ctx.Pipe()
+    p = ctx.Process(target=_attach_checksum_child,
+                    args=((ring.name, ring.slab_bytes, ring.slabs), desc, child))
+    p.start()
+    remote = parent.recv() if parent.poll(60) else None
+    p.join()
+    ring.release(desc)
+    assert remote == zlib.crc32(a.tobytes())
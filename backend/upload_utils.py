@@ -0,0 +1,191 @@
+"""
+Upload ingestion.
+
+Reads an incoming upload once, sniffs its media type from the leading bytes
+and keeps small images/audio in memory so decoders can read them straight
+from a buffer. Videos (and anything that grows past UPLOAD_MEMORY_LIMIT) are
+spilled to a uniquely named spool file that is removed when the upload is
+closed, whatever happens to the request.
+"""
+import hashlib
+import io
+import os
+import tempfile
+import time
+
+from metrics import observe_stage
+
+UPLOAD_MEMORY_LIMIT = int(os.getenv("UPLOAD_MEMORY_LIMIT", str(32 * 1024 * 1024)))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+SNIFF_BYTES = 64
+
+# (kind, mime, decodable from memory); unrecognized data goes to a spool file,
+# since decoders like audioread/ffmpeg need a real path
+_MEDIA_UNKNOWN = (None, None, False)
+# Audio that libsndfile can decode straight from a buffer
+IN_MEMORY_AUDIO = ("audio/wav", "audio/flac", "audio/ogg", "audio/mpeg")
+
+
+def sniff_media_type(head):
+    """Guess (kind, mime, in_memory_ok) from the first bytes of a file."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image", "image/jpeg", True
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image", "image/png", True
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image", "image/gif", True
+    if head.startswith(b"BM"):
+        return "image", "image/bmp", True
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return "image", "image/tiff", True
+    if head[:4] == b"RIFF":
+        fourcc = head[8:12]
+        if fourcc == b"WEBP":
+            return "image", "image/webp", True
+        if fourcc == b"WAVE":
+            return "audio", "audio/wav", True
+        if fourcc == b"AVI ":
+            return "video", "video/x-msvideo", False
+    if head.startswith(b"fLaC"):
+        return "audio", "audio/flac", True
+    if head.startswith(b"OggS"):
+        return "audio", "audio/ogg", True
+    if len(head) > 1 and head[0] == 0xFF and (head[1] & 0xF6) == 0xF0:
+        # ADTS AAC: frame sync with layer bits 00
+        return "audio", "audio/aac", False
+    if head.startswith(b"ID3") or (len(head) > 1 and head[0] == 0xFF and (head[1] & 0xE0) == 0xE0
+                                   and (head[1] & 0x06) != 0):
+        return "audio", "audio/mpeg", True
+    if head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in (b"M4A ", b"M4B ", b"M4P "):
+            # AAC in MP4 is not readable by libsndfile, decoders need a path
+            return "audio", "audio/mp4", False
+        if brand == b"qt  ":
+            return "video", "video/quicktime", False
+        return "video", "video/mp4", False
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "video", "video/webm", False
+    return _MEDIA_UNKNOWN
+
+
+class MediaUpload:
+    """An ingested upload, held either in memory or in a spool file."""
+
+    def __init__(self, filename, content_type, kind, size, sha256, data=None, path=None):
+        self.filename = filename
+        self.content_type = content_type
+        self.kind = kind
+        self.size = size
+        self.sha256 = sha256
+        self.path = path
+        self._data = data
+
+    @property
+    def in_memory(self):
+        return self._data is not None
+
+    def source(self):
+        """Path or a fresh file-like object for decoders (PIL, librosa, soundfile)."""
+        if self.path is not None:
+            return self.path
+        return io.BytesIO(self._data)
+
+    def read_bytes(self):
+        if self._data is not None:
+            return self._data
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def close(self):
+        self._data = None
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"Could not remove spool file {self.path}: {e}")
+            self.path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def _resolve_content_type(declared, sniffed_mime):
+    declared = declared or "application/octet-stream"
+    if declared.split("/", 1)[0] in ("audio", "image", "video"):
+        return declared
+    return sniffed_mime or declared
+
+
+def _spool_file(filename):
+    suffix = os.path.splitext(filename or "")[1][:16]
+    fd, path = tempfile.mkstemp(prefix="upload_", suffix=suffix, dir=UPLOAD_SPOOL_DIR)
+    return os.fdopen(fd, "wb"), path
+
+
+def ingest_upload(fileobj, filename=None, content_type=None, memory_limit=UPLOAD_MEMORY_LIMIT):
+    """Read `fileobj` once into a MediaUpload, hashing it as it streams. Caller must close() it."""
+    started = time.perf_counter()
+    head = fileobj.read(UPLOAD_CHUNK_SIZE) or b""
+    hasher = hashlib.sha256(head)
+    kind, mime, in_memory_ok = sniff_media_type(head[:SNIFF_BYTES])
+    content_type = _resolve_content_type(content_type, mime)
+    major = content_type.split("/", 1)[0]
+    if major in ("audio", "image", "video"):
+        kind = major
+    if kind == "video" or (kind == "audio" and mime not in IN_MEMORY_AUDIO):
+        in_memory_ok = False
+
+    size = len(head)
+    out = None
+    path = None
+    buf = bytearray(head) if in_memory_ok else None
+    write_s = 0.0
+    try:
+        if buf is None:
+            out, path = _spool_file(filename)
+            t0 = time.perf_counter()
+            out.write(head)
+            write_s += time.perf_counter() - t0
+        while True:
+            chunk = fileobj.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            hasher.update(chunk)
+            if buf is not None:
+                buf += chunk
+                if len(buf) > memory_limit:
+                    out, path = _spool_file(filename)
+                    t0 = time.perf_counter()
+                    out.write(buf)
+                    write_s += time.perf_counter() - t0
+                    buf = None
+            else:
+                t0 = time.perf_counter()
+                out.write(chunk)
+                write_s += time.perf_counter() - t0
+        if out is not None:
+            t0 = time.perf_counter()
+            out.close()
+            write_s += time.perf_counter() - t0
+    except Exception:
+        if out is not None:
+            out.close()
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+        raise
+
+    # Reading and hashing the request body vs writing the spool file
+    observe_stage("upload_receive", time.perf_counter() - started - write_s, media=kind)
+    if path is not None:
+        observe_stage("temp_write", write_s, media=kind)
+    data = bytes(buf) if buf is not None else None
+    return MediaUpload(filename, content_type, kind, size, hasher.hexdigest(), data=data, path=path)
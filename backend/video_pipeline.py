@@ -0,0 +1,169 @@
+"""
+Pipelined video analysis.
+
+Decode, face detection and Xception inference run as three stages connected
+by bounded queues, so while one chunk of faces is being classified the next
+chunk of frames is already being detected and decoded. cv2 and torch release
+the GIL, so plain threads overlap real work. The queues bound memory to a few
+chunks regardless of `num_frames`.
+"""
+import os
+import queue
+import threading
+
+import torch
+
+from frame_sampler import iter_frames
+from metrics import in_context, timed_iter
+from video_utils import (
+    FaceEvidence,
+    VIDEO_BATCH_MAX_SIZE,
+    VIDEO_DETECT_BATCH_SIZE,
+    detect_faces,
+    predict_faces,
+    prepare_frame,
+    preprocess_faces,
+)
+
+VIDEO_PIPELINE_QUEUE = int(os.getenv("VIDEO_PIPELINE_QUEUE", "4"))
+TORCH_INTRA_OP_THREADS = int(os.getenv("TORCH_INTRA_OP_THREADS", "0"))
+
+_DONE = object()
+_threads_configured = False
+_threads_lock = threading.Lock()
+
+
+class _StageError:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def configure_torch_threads():
+    """
+    Detection and inference both run torch ops concurrently, so give each about
+    half of the cores instead of letting both claim all of them.
+    """
+    global _threads_configured
+    with _threads_lock:
+        if _threads_configured:
+            return
+        n = TORCH_INTRA_OP_THREADS or max(1, (os.cpu_count() or 2) // 2)
+        torch.set_num_threads(n)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Only allowed before the first inter-op parallel call
+            pass
+        _threads_configured = True
+        print(f"[Pipeline] torch intra-op threads: {n}")
+
+
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop):
+    while True:
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            if stop.is_set():
+                return _DONE
+
+
+def _decode_stage(video_path, num_frames, info, out_q, stop):
+    try:
+        chunk = []
+        for _, frame in timed_iter("decode", iter_frames(video_path, num_frames, info=info)):
+            chunk.append(prepare_frame(frame))
+            if len(chunk) >= VIDEO_DETECT_BATCH_SIZE:
+                if not _put(out_q, chunk, stop):
+                    return
+                chunk = []
+        if chunk:
+            _put(out_q, chunk, stop)
+    except Exception as e:
+        _put(out_q, _StageError(e), stop)
+    finally:
+        _put(out_q, _DONE, stop)
+
+
+def _detect_stage(mtcnn, evidence, in_q, out_q, stop, progress):
+    try:
+        faces = []
+        while True:
+            chunk = _get(in_q, stop)
+            if chunk is _DONE:
+                break
+            if isinstance(chunk, _StageError):
+                _put(out_q, chunk, stop)
+                return
+            detections = detect_faces(mtcnn, chunk)
+            for frame_rgb, boxes in zip(chunk, detections):
+                face = evidence.add_frame(frame_rgb, boxes)
+                if face is not None:
+                    faces.append(face)
+            progress(len(chunk))
+            while len(faces) >= VIDEO_BATCH_MAX_SIZE:
+                if not _put(out_q, faces[:VIDEO_BATCH_MAX_SIZE], stop):
+                    return
+                faces = faces[VIDEO_BATCH_MAX_SIZE:]
+        if faces:
+            _put(out_q, faces, stop)
+    except Exception as e:
+        _put(out_q, _StageError(e), stop)
+    finally:
+        _put(out_q, _DONE, stop)
+
+
+def collect_pipelined(video_path, num_frames, mtcnn, progress_callback=None):
+    """
+    Same contract as video_utils._collect_sequential: returns
+    (FaceEvidence, sample_info), or None if the video cannot be opened.
+    """
+    configure_torch_threads()
+    info = {}
+    evidence = FaceEvidence()
+    frames_q = queue.Queue(maxsize=VIDEO_PIPELINE_QUEUE)
+    faces_q = queue.Queue(maxsize=VIDEO_PIPELINE_QUEUE)
+    stop = threading.Event()
+    done_frames = [0]
+
+    def progress(n):
+        done_frames[0] += n
+        if progress_callback:
+            progress_callback(done_frames[0], num_frames)
+
+    # in_context: stage timings of these threads go to the current request
+    decoder = threading.Thread(target=in_context(_decode_stage), name="video-decode",
+                               args=(video_path, num_frames, info, frames_q, stop), daemon=True)
+    detector = threading.Thread(target=in_context(_detect_stage), name="video-detect",
+                                args=(mtcnn, evidence, frames_q, faces_q, stop, progress), daemon=True)
+    decoder.start()
+    detector.start()
+
+    # Inference stage runs on the calling thread (it owns the preprocessing buffer)
+    try:
+        while True:
+            faces = _get(faces_q, stop)
+            if faces is _DONE:
+                break
+            if isinstance(faces, _StageError):
+                raise faces.exc
+            evidence.model_predictions.extend(predict_faces(preprocess_faces(faces)).tolist())
+    finally:
+        stop.set()
+        decoder.join()
+        detector.join()
+
+    if not info.get("opened", False):
+        return None
+    if progress_callback:
+        progress_callback(done_frames[0], done_frames[0])
+    return evidence, info
@@ -12,166 +12,290 @@ from xception import Xception
 from facenet_pytorch import MTCNN
 from PIL import Image
 import warnings
+from batching import get_batcher
+from model_workers import batch_buffer, run_model, model_available, worker_model_version
+from frame_sampler import iter_frames
+from preprocessing import BatchPreprocessor, thread_local_preprocessor, IMAGENET_MEAN, IMAGENET_STD
+from model_registry import get_registry
+from xception_backends import build_backend
+from metrics import stage, timed_iter, timed_stage
 
 warnings.filterwarnings("ignore")
 
-# Global models
-_video_model = None
-_mtcnn = None
-MODEL_PATH = r"v:\Road2Tech\Project_3\Image and Audio Real or Fake Detection System\trained\ffpp_c23.pth"
+VIDEO_BATCH_MAX_SIZE = int(os.getenv("VIDEO_BATCH_MAX_SIZE", "16"))
+VIDEO_NUM_FRAMES = int(os.getenv("VIDEO_NUM_FRAMES", "8"))
+VIDEO_DETECT_BATCH_SIZE = int(os.getenv("VIDEO_DETECT_BATCH_SIZE", "16"))
+# Pipelined analysis: "auto" (when num_frames >= VIDEO_PIPELINE_MIN_FRAMES), "on" or "off"
+VIDEO_PIPELINE = os.getenv("VIDEO_PIPELINE", "auto").lower()
+VIDEO_PIPELINE_MIN_FRAMES = int(os.getenv("VIDEO_PIPELINE_MIN_FRAMES", "16"))
+
+
+def load_xception(model_path):
+    """Load Xception model trained on FaceForensics++ as an eager PyTorch module"""
+    print(f"Loading Xception model from {model_path}...")
+    model = Xception(num_classes=2)
+    
+    checkpoint = torch.load(model_path, map_location='cpu')
+    if isinstance(checkpoint, dict):
+        state_dict = checkpoint.get('model', checkpoint.get('state_dict', checkpoint))
+    else:
+        state_dict = checkpoint
+    
+    # Remap keys
+    new_state_dict = {}
+    for k, v in state_dict.items():
+        name = k
+        if name.startswith('model.'):
+            name = name[6:]
+        if 'last_linear' in name:
+            name = name.replace('last_linear', 'fc')
+            if 'last_linear.1' in k:
+                name = name.replace('fc.1', 'fc')
+        new_state_dict[name] = v
+    
+    model.load_state_dict(new_state_dict, strict=False)
+    model.eval()
+    print("Xception model loaded successfully.")
+    return model
+
+
+def build_video_model(model_path):
+    """Xception served by the VIDEO_BACKEND inference backend (called by the model registry)"""
+    return build_backend(load_xception(model_path), model_path)
 
 
 def get_video_model():
-    """Load Xception model trained on FaceForensics++"""
-    global _video_model
-    if _video_model is None:
-        if not os.path.exists(MODEL_PATH):
-            print(f"Video model not found at {MODEL_PATH}")
-            return None
-        
-        try:
-            print(f"Loading Xception model from {MODEL_PATH}...")
-            model = Xception(num_classes=2)
-            
-            checkpoint = torch.load(MODEL_PATH, map_location='cpu')
-            if isinstance(checkpoint, dict):
-                state_dict = checkpoint.get('model', checkpoint.get('state_dict', checkpoint))
-            else:
-                state_dict = checkpoint
-            
-            # Remap keys
-            new_state_dict = {}
-            for k, v in state_dict.items():
-                name = k
-                if name.startswith('model.'):
-                    name = name[6:]
-                if 'last_linear' in name:
-                    name = name.replace('last_linear', 'fc')
-                    if 'last_linear.1' in k:
-                        name = name.replace('fc.1', 'fc')
-                new_state_dict[name] = v
-            
-            model.load_state_dict(new_state_dict, strict=False)
-            model.eval()
-            _video_model = model
-            print("Xception model loaded successfully.")
-            
-        except Exception as e:
-            print(f"Error loading video model: {e}")
-            return None
-    return _video_model
+    """The serving Xception model (loaded once by the model registry), or None"""
+    return get_registry().get("video")
+
+
+def video_model_version():
+    """Version tag of the Xception checkpoint, used in result cache keys"""
+    version = worker_model_version("video")
+    if version is not None:
+        return version
+    return get_registry().version("video")
+
+
+def build_mtcnn():
+    return MTCNN(select_largest=True, post_process=False, device='cpu')
 
 
 def get_mtcnn():
     """Get MTCNN face detector"""
-    global _mtcnn
-    if _mtcnn is None:
-        try:
-            _mtcnn = MTCNN(select_largest=True, post_process=False, device='cpu')
-        except Exception as e:
-            print(f"Error loading MTCNN: {e}")
-            return None
-    return _mtcnn
+    return get_registry().get("mtcnn")
+
+
+def _xception_forward_local(batch, model=None):
+    """Softmax probabilities for a [N, 3, 299, 299] float32 face batch"""
+    if model is None:
+        model = get_video_model()
+    if model is None:
+        raise RuntimeError("Video model not loaded")
+    return model(batch)
+
+
+def _xception_forward(batch):
+    """Same as _xception_forward_local, but on a model worker process when enabled"""
+    return run_model("video", batch, _xception_forward_local)
+
+
+@timed_stage("model_forward")
+def predict_faces(batch):
+    """
+    Run a [N, 3, 299, 299] face batch through the shared cross-request Xception
+    batcher, in chunks of at most VIDEO_BATCH_MAX_SIZE to cap memory.
+    """
+    batcher = get_batcher("video", _xception_forward, max_batch_size=VIDEO_BATCH_MAX_SIZE,
+                          alloc_fn=batch_buffer)
+    futures = [batcher.submit(batch[i:i + VIDEO_BATCH_MAX_SIZE])
+               for i in range(0, len(batch), VIDEO_BATCH_MAX_SIZE)]
+    return np.concatenate([f.result() for f in futures], axis=0)
+
+
+_face_preprocessor = thread_local_preprocessor(
+    lambda: BatchPreprocessor(299, mean=IMAGENET_MEAN, std=IMAGENET_STD, channels_first=True)
+)
+
+
+@timed_stage("preprocessing")
+def preprocess_faces(faces):
+    """
+    Resize and ImageNet-normalize face crops into this thread's preallocated
+    [N, 3, 299, 299] float32 buffer. The result is reused by the next call.
+    """
+    return _face_preprocessor()(faces)
 
 
 def preprocess_face(face_img):
     """Preprocess face for Xception model using ImageNet normalization"""
-    img = cv2.resize(face_img, (299, 299))
-    img = img.astype(np.float32) / 255.0
+    return torch.from_numpy(preprocess_faces([face_img]).copy())
+
+
+@timed_stage("preprocessing")
+def prepare_frame(frame):
+    """Downscale a BGR frame to at most 640px wide and convert to RGB"""
+    h, w = frame.shape[:2]
+    if w > 640:
+        scale = 640 / w
+        frame = cv2.resize(frame, (640, int(h * scale)))
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+
+def _detect_one(mtcnn, frame_rgb):
+    try:
+        boxes, _ = mtcnn.detect(Image.fromarray(frame_rgb))
+        return boxes
+    except Exception:
+        return None
+
+
+@timed_stage("face_detection")
+def detect_faces(mtcnn, frames_rgb, batch_size=VIDEO_DETECT_BATCH_SIZE):
+    """
+    Face boxes for each frame (None when no face), using batched MTCNN calls.
+    MTCNN batches need equally sized frames; otherwise frames go one by one.
+    """
+    detections = []
+    for start in range(0, len(frames_rgb), batch_size):
+        chunk = frames_rgb[start:start + batch_size]
+        if len({f.shape for f in chunk}) == 1:
+            try:
+                boxes, _ = mtcnn.detect([Image.fromarray(f) for f in chunk])
+                detections.extend(boxes)
+                continue
+            except Exception as e:
+                print(f"[Hybrid] Batched face detection failed ({e}); retrying per frame")
+        detections.extend(_detect_one(mtcnn, f) for f in chunk)
+    return detections
+
+
+def warmup_mtcnn(mtcnn):
+    """Run detection once on a blank frame (model registry warm-up)"""
+    detect_faces(mtcnn, [np.zeros((360, 640, 3), dtype=np.uint8)])
+
+
+def extract_face(frame_rgb, boxes):
+    """
+    Heuristic stats and the crop for the first detected face.
+    Returns (face_area, (center_x, center_y), crop_or_None), or None without a face.
+    """
+    if boxes is None or len(boxes) == 0:
+        return None
+    x1, y1, x2, y2 = [int(b) for b in boxes[0]]
+    
+    # Collect heuristic data
+    face_area = (x2 - x1) * (y2 - y1)
+    center = ((x1 + x2) / 2, (y1 + y2) / 2)
+    
+    # Clamp coordinates
+    h, w = frame_rgb.shape[:2]
+    x1 = max(0, x1)
+    y1 = max(0, y1)
+    x2 = min(w, x2)
+    y2 = min(h, y2)
+    
+    if x2 - x1 < 20 or y2 - y1 < 20:
+        return face_area, center, None
+    return face_area, center, frame_rgb[y1:y2, x1:x2]
+
+
+class FaceEvidence:
+    """Face statistics and model outputs gathered for one video"""
+
+    def __init__(self):
+        self.face_sizes = []
+        self.face_positions = []
+        self.face_detected_count = 0
+        self.model_predictions = []
+
+    def add_frame(self, frame_rgb, boxes):
+        """Record heuristics for one frame; returns the face crop to classify, if any"""
+        found = extract_face(frame_rgb, boxes)
+        if found is None:
+            return None
+        self.face_detected_count += 1
+        face_area, center, face = found
+        self.face_sizes.append(face_area)
+        self.face_positions.append(center)
+        return face
+
+
+def _collect_sequential(video_path, num_frames, mtcnn, progress_callback=None):
+    """
+    Decode all frames, then detect in batches, then one Xception pass.
+    Progress counts one step per frame decoded and one per frame through face
+    detection (total 2 x frames), reported as each frame / detection chunk finishes.
+    """
+    def progress(done, total):
+        if progress_callback:
+            progress_callback(done, total)
+
+    # 1. Decode all sampled frames (seek / sequential scan / keyframe decoding per file)
+    sample_info = {}
+    frames_rgb = []
+    for _, frame in timed_iter("decode", iter_frames(video_path, num_frames, info=sample_info)):
+        frames_rgb.append(prepare_frame(frame))
+        progress(len(frames_rgb), 2 * num_frames)
+    if not sample_info.get("opened", False):
+        return None
+    total = 2 * len(frames_rgb)
     
-    # ImageNet normalization
-    mean = np.array([0.485, 0.456, 0.406])
-    std = np.array([0.229, 0.224, 0.225])
-    img = (img - mean) / std
+    # 2. Batched face detection
+    evidence = FaceEvidence()
+    faces = []
+    for start in range(0, len(frames_rgb), VIDEO_DETECT_BATCH_SIZE):
+        chunk = frames_rgb[start:start + VIDEO_DETECT_BATCH_SIZE]
+        for frame_rgb, boxes in zip(chunk, detect_faces(mtcnn, chunk)):
+            face = evidence.add_frame(frame_rgb, boxes)
+            if face is not None:
+                faces.append(face)
+        progress(len(frames_rgb) + start + len(chunk), total)
     
-    img = np.transpose(img, (2, 0, 1))
-    return torch.tensor(img, dtype=torch.float32).unsqueeze(0)
+    # 3. One [N, 3, 299, 299] batch through Xception (batched with concurrent requests)
+    if faces:
+        evidence.model_predictions = predict_faces(preprocess_faces(faces)).tolist()
+    
+    progress(total, total)
+    return evidence, sample_info
+
 
+def _use_pipeline(num_frames):
+    if VIDEO_PIPELINE == "auto":
+        return num_frames >= VIDEO_PIPELINE_MIN_FRAMES
+    return VIDEO_PIPELINE in ("1", "on", "true")
 
-def analyze_video(video_path, num_frames=8):
+
+def analyze_video(video_path, num_frames=VIDEO_NUM_FRAMES, progress_callback=None):
     """
     Hybrid Analysis: Xception Neural Network + Heuristic Calibration
     
     Returns both model predictions and heuristic signals for accurate detection.
+    `progress_callback(done, total)` is called as sampled frames are processed.
     """
     print(f"[Hybrid] Analyzing video: {video_path}")
     
-    model = get_video_model()
+    model_ready = model_available("video")
     mtcnn = get_mtcnn()
     
-    if model is None or mtcnn is None:
+    if not model_ready or mtcnn is None:
         return {"error": "Models not ready"}
     
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
+    if _use_pipeline(num_frames):
+        # Overlap decode, detection and inference in separate threads
+        from video_pipeline import collect_pipelined
+        collected = collect_pipelined(video_path, num_frames, mtcnn, progress_callback)
+    else:
+        collected = _collect_sequential(video_path, num_frames, mtcnn, progress_callback)
+    if collected is None:
         return {"error": "Cannot open video"}
+    evidence, sample_info = collected
+    print(f"[Hybrid] Sampled frames via {sample_info['strategy']} (frame_count={sample_info['frame_count']})")
     
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    if frame_count <= 0:
-        frame_count = 100
-    
-    indices = np.linspace(0, frame_count - 1, num_frames, dtype=int)
-    
-    # Collect data for both model and heuristics
-    model_predictions = []
-    face_sizes = []
-    face_positions = []
-    face_detected_count = 0
-    
-    for i in indices:
-        cap.set(cv2.CAP_PROP_POS_FRAMES, i)
-        ret, frame = cap.read()
-        if not ret:
-            continue
-        
-        # Resize for faster processing
-        h, w = frame.shape[:2]
-        if w > 640:
-            scale = 640 / w
-            frame = cv2.resize(frame, (640, int(h * scale)))
-        
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        pil_img = Image.fromarray(frame_rgb)
-        
-        try:
-            boxes, probs = mtcnn.detect(pil_img)
-        except:
-            continue
-        
-        if boxes is not None and len(boxes) > 0:
-            face_detected_count += 1
-            box = boxes[0]
-            x1, y1, x2, y2 = [int(b) for b in box]
-            
-            # Collect heuristic data
-            face_width = x2 - x1
-            face_height = y2 - y1
-            face_area = face_width * face_height
-            face_center_x = (x1 + x2) / 2
-            face_center_y = (y1 + y2) / 2
-            face_sizes.append(face_area)
-            face_positions.append((face_center_x, face_center_y))
-            
-            # Clamp coordinates
-            h, w = frame_rgb.shape[:2]
-            x1 = max(0, x1)
-            y1 = max(0, y1)
-            x2 = min(w, x2)
-            y2 = min(h, y2)
-            
-            if x2 - x1 < 20 or y2 - y1 < 20:
-                continue
-            
-            face = frame_rgb[y1:y2, x1:x2]
-            
-            # Model prediction
-            input_tensor = preprocess_face(face)
-            with torch.no_grad():
-                logits = model(input_tensor)
-                probs = torch.softmax(logits, dim=1).squeeze().tolist()
-                model_predictions.append(probs)
-    
-    cap.release()
+    model_predictions = evidence.model_predictions
+    face_sizes = evidence.face_sizes
+    face_positions = evidence.face_positions
+    face_detected_count = evidence.face_detected_count
     
     if not model_predictions or face_detected_count < 2:
         return {"result": "UNKNOWN", "confidence": 0.0, "detail": "Insufficient face data"}
@@ -182,27 +306,28 @@ def analyze_video(video_path, num_frames=8):
     nn_real_prob = avg_probs[1]  # Class 1 tendency
     
     # === HEURISTIC ANALYSIS ===
-    size_variance = np.std(face_sizes) / (np.mean(face_sizes) + 1e-6)
-    pos_x = [p[0] for p in face_positions]
-    pos_y = [p[1] for p in face_positions]
-    pos_variance = (np.std(pos_x) + np.std(pos_y)) / 2
-    detection_rate = face_detected_count / num_frames
-    
-    heuristic_fake_score = 0.0
-    
-    # AI-generated videos are too consistent
-    if size_variance < 0.20:
-        heuristic_fake_score += 0.4
-    if pos_variance < 40:
-        heuristic_fake_score += 0.3
-    if detection_rate > 0.9:
-        heuristic_fake_score += 0.15
-    
-    # High variance = manipulation artifacts
-    if size_variance > 0.45:
-        heuristic_fake_score += 0.3
-    if pos_variance > 80:
-        heuristic_fake_score += 0.2
+    with stage("heuristic_scoring"):
+        size_variance = np.std(face_sizes) / (np.mean(face_sizes) + 1e-6)
+        pos_x = [p[0] for p in face_positions]
+        pos_y = [p[1] for p in face_positions]
+        pos_variance = (np.std(pos_x) + np.std(pos_y)) / 2
+        detection_rate = face_detected_count / num_frames
+        
+        heuristic_fake_score = 0.0
+        
+        # AI-generated videos are too consistent
+        if size_variance < 0.20:
+            heuristic_fake_score += 0.4
+        if pos_variance < 40:
+            heuristic_fake_score += 0.3
+        if detection_rate > 0.9:
+            heuristic_fake_score += 0.15
+        
+        # High variance = manipulation artifacts
+        if size_variance > 0.45:
+            heuristic_fake_score += 0.3
+        if pos_variance > 80:
+            heuristic_fake_score += 0.2
     
     # === HYBRID DECISION ===
     # Combine neural network output with heuristic calibration
@@ -237,9 +362,9 @@ def analyze_video(video_path, num_frames=8):
     }
 
 
-def predict_video(video_path, num_frames=8):
+def predict_video(video_path, num_frames=VIDEO_NUM_FRAMES, progress_callback=None):
     """Main entry point for video prediction"""
-    return analyze_video(video_path, num_frames)
+    return analyze_video(video_path, num_frames, progress_callback=progress_callback)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,215 @@
+"""
+Optimized CPU inference backends for the Xception video model.
+
+VIDEO_BACKEND selects how a loaded checkpoint is served:
+
+- eager: the PyTorch module as loaded (float32)
+- torchscript: BatchNorm folded into the preceding convolutions, then traced,
+  frozen and optimized for inference
+- onnx: the BN-folded model exported to ONNX and run by ONNX Runtime
+- onnx-int8: the same graph with dynamic int8 quantization of the Conv
+  (depthwise, pointwise and skip) and Gemm weights
+
+Exported ONNX graphs are cached in VIDEO_BACKEND_CACHE_DIR, keyed by the
+checkpoint's checksum. A non-eager backend must match the eager model's
+softmax outputs on a fixed validation set before it serves; if it doesn't,
+or its dependency is missing, the eager model serves instead.
+
+Every backend is a callable mapping a [N, 3, 299, 299] float32 numpy batch to
+[N, 2] softmax probabilities.
+"""
+import copy
+import os
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+from xception import Block, SeparableConv2d
+
+VIDEO_BACKEND = os.getenv("VIDEO_BACKEND", "eager").lower()
+# Default: an "optimized" folder next to the checkpoint
+VIDEO_BACKEND_CACHE_DIR = os.getenv("VIDEO_BACKEND_CACHE_DIR", "")
+VIDEO_BACKEND_TOLERANCE = float(os.getenv("VIDEO_BACKEND_TOLERANCE", "0.001"))
+VIDEO_INT8_TOLERANCE = float(os.getenv("VIDEO_INT8_TOLERANCE", "0.05"))
+# Face crops (jpg/png) to validate on; seeded noise when unset
+VIDEO_VALIDATION_DIR = os.getenv("VIDEO_VALIDATION_DIR", "")
+VIDEO_VALIDATION_SIZE = int(os.getenv("VIDEO_VALIDATION_SIZE", "16"))
+
+BACKENDS = ("eager", "torchscript", "onnx", "onnx-int8")
+INPUT_SHAPE = (3, 299, 299)
+
+
+def fold_batchnorm(model):
+    """Copy of an Xception model with every BatchNorm folded into the convolution before it."""
+    model = copy.deepcopy(model).eval()
+    for conv, bn in (("conv1", "bn1"), ("conv2", "bn2")):
+        setattr(model, conv, fuse_conv_bn_eval(getattr(model, conv), getattr(model, bn)))
+        setattr(model, bn, nn.Identity())
+    for sep, bn in (("conv3", "bn3"), ("conv4", "bn4")):
+        # SeparableConv2d = depthwise -> pointwise; the BN follows the pointwise conv
+        getattr(model, sep).pointwise = fuse_conv_bn_eval(getattr(model, sep).pointwise, getattr(model, bn))
+        setattr(model, bn, nn.Identity())
+    for block in [m for m in model.modules() if isinstance(m, Block)]:
+        if block.skip is not None:
+            block.skip = fuse_conv_bn_eval(block.skip, block.skipbn)
+            block.skipbn = nn.Identity()
+        layers = list(block.rep)
+        for i in range(len(layers) - 1):
+            if isinstance(layers[i], SeparableConv2d) and isinstance(layers[i + 1], nn.BatchNorm2d):
+                layers[i].pointwise = fuse_conv_bn_eval(layers[i].pointwise, layers[i + 1])
+                layers[i + 1] = nn.Identity()
+        block.rep = nn.Sequential(*layers)
+    return model
+
+
+def _softmax(logits):
+    e = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return e / e.sum(axis=1, keepdims=True)
+
+
+class TorchBackend:
+    """Eager or TorchScript module on the current torch thread pool."""
+
+    def __init__(self, module, name="eager"):
+        self.module = module
+        self.name = name
+        self.variant = None if name == "eager" else name
+        self.validation = None
+
+    def __call__(self, batch):
+        with torch.no_grad():
+            logits = self.module(torch.from_numpy(np.ascontiguousarray(batch, dtype=np.float32)))
+            return torch.softmax(logits, dim=1).numpy()
+
+
+class OnnxBackend:
+    """ONNX Runtime session over an exported graph."""
+
+    def __init__(self, path, name):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # Same thread budget torch was given (model workers set it per process)
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.path = path
+        self.name = name
+        self.variant = name
+        self.validation = None
+
+    def __call__(self, batch):
+        logits = self.session.run(None, {"faces": np.ascontiguousarray(batch, dtype=np.float32)})[0]
+        return _softmax(logits)
+
+
+def _cache_path(model_path, suffix):
+    from model_registry import file_sha256
+    cache_dir = VIDEO_BACKEND_CACHE_DIR or os.path.join(os.path.dirname(model_path), "optimized")
+    os.makedirs(cache_dir, exist_ok=True)
+    digest = file_sha256(model_path)[:12]
+    return os.path.join(cache_dir, f"{os.path.basename(model_path)}.{digest}.{suffix}.onnx")
+
+
+def export_onnx(folded, path):
+    """Export a BN-folded model with a dynamic batch axis (written atomically)."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with torch.no_grad():
+        torch.onnx.export(folded, torch.zeros((1,) + INPUT_SHAPE), tmp, input_names=["faces"],
+                          output_names=["logits"], dynamic_axes={"faces": {0: "batch"}, "logits": {0: "batch"}},
+                          opset_version=13, do_constant_folding=True)
+    os.replace(tmp, path)
+
+
+def quantize_onnx(fp32_path, path):
+    """Dynamic int8 quantization of Conv/MatMul/Gemm weights (activations quantized per batch at run time)."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    tmp = f"{path}.{os.getpid()}.tmp"
+    # uint8 weights: ORT's CPU ConvInteger kernel has no int8-weight variant
+    quantize_dynamic(fp32_path, tmp, op_types_to_quantize=["Conv", "MatMul", "Gemm"], weight_type=QuantType.QUInt8)
+    os.replace(tmp, path)
+
+
+def build_optimized(module, model_path, backend):
+    folded = fold_batchnorm(module)
+    if backend == "torchscript":
+        with torch.no_grad():
+            traced = torch.jit.trace(folded, torch.zeros((1,) + INPUT_SHAPE))
+            traced = torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+        return TorchBackend(traced, backend)
+    fp32_path = _cache_path(model_path, "fp32")
+    if not os.path.exists(fp32_path):
+        print(f"[Xception] Exporting ONNX graph to {fp32_path}...")
+        export_onnx(folded, fp32_path)
+    if backend == "onnx":
+        return OnnxBackend(fp32_path, backend)
+    int8_path = _cache_path(model_path, "int8")
+    if not os.path.exists(int8_path):
+        print(f"[Xception] Quantizing ONNX graph to {int8_path}...")
+        quantize_onnx(fp32_path, int8_path)
+    return OnnxBackend(int8_path, backend)
+
+
+def validation_set(size=VIDEO_VALIDATION_SIZE, directory=VIDEO_VALIDATION_DIR):
+    """Fixed input batch: face crops from `directory` when set, else seeded standard-normal noise."""
+    if directory and os.path.isdir(directory):
+        import cv2
+        from preprocessing import BatchPreprocessor, IMAGENET_MEAN, IMAGENET_STD
+        faces = []
+        for name in sorted(os.listdir(directory)):
+            if len(faces) >= size:
+                break
+            if name.lower().endswith((".jpg", ".jpeg", ".png")):
+                img = cv2.imread(os.path.join(directory, name))
+                if img is not None:
+                    faces.append(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+        if faces:
+            pre = BatchPreprocessor(299, mean=IMAGENET_MEAN, std=IMAGENET_STD, channels_first=True)
+            return pre(faces).copy()
+    rng = np.random.default_rng(0)
+    return rng.standard_normal((size,) + INPUT_SHAPE, dtype=np.float32)
+
+
+def compare(reference, candidate, batch):
+    """Softmax agreement of two backends on `batch`."""
+    ref = reference(batch)
+    out = candidate(batch)
+    return {
+        "samples": len(batch),
+        "max_abs_diff": float(np.abs(ref - out).max()),
+        "mean_abs_diff": float(np.abs(ref - out).mean()),
+        "label_agreement": float((ref.argmax(axis=1) == out.argmax(axis=1)).mean()),
+    }
+
+
+def tolerance(backend):
+    return VIDEO_INT8_TOLERANCE if backend.endswith("int8") else VIDEO_BACKEND_TOLERANCE
+
+
+def build_backend(module, model_path, backend=VIDEO_BACKEND):
+    """
+    Wrap a loaded eager Xception in `backend`, validated against the eager
+    outputs. Falls back to eager when the backend can't be built or drifts
+    beyond its tolerance.
+    """
+    eager = TorchBackend(module)
+    if backend == "eager":
+        return eager
+    if backend not in BACKENDS:
+        print(f"[Xception] Unknown VIDEO_BACKEND {backend!r} (choose from {', '.join(BACKENDS)}); serving eager")
+        return eager
+    try:
+        candidate = build_optimized(module, model_path, backend)
+        report = compare(eager, candidate, validation_set())
+    except Exception as e:
+        print(f"[Xception] {backend} backend unavailable ({type(e).__name__}: {e}); serving eager")
+        return eager
+    candidate.validation = report
+    if report["max_abs_diff"] > tolerance(backend):
+        print(f"[Xception] {backend} backend rejected: max softmax diff {report['max_abs_diff']:.5f} "
+              f"> {tolerance(backend)}; serving eager")
+        return eager
+    print(f"[Xception] {backend} backend validated on {report['samples']} samples "
+          f"(max diff {report['max_abs_diff']:.5f}, label agreement {report['label_agreement']:.3f})")
+    return candidate
@@ -1,14 +1,24 @@
+import argparse
+import json
+import os
 import sys
 import numpy as np
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing import image
 
 # Load the model
 MODEL_PATH = 'trained/face_real_vs_ai_model.h5'
-model = load_model(MODEL_PATH)
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend')
+_model = None
+
+def get_model():
+    global _model
+    if _model is None:
+        from tensorflow.keras.models import load_model
+        _model = load_model(MODEL_PATH)
+    return _model
 
 # Preprocess the image
 def preprocess_image(img_path, target_size=(224, 224)):
+    from tensorflow.keras.preprocessing import image
     img = image.load_img(img_path, target_size=target_size)
     img_array = image.img_to_array(img)
     img_array = np.expand_dims(img_array, axis=0)
@@ -18,14 +28,88 @@ def preprocess_image(img_path, target_size=(224, 224)):
 # Predict function
 def predict(img_path):
     img = preprocess_image(img_path)
-    pred = model.predict(img)
+    pred = get_model().predict(img)
     # Assuming binary classification: 0 = Real, 1 = Fake
     label = 'Fake' if pred[0][0] > 0.5 else 'Real'
     print(f'Prediction: {label} (score={pred[0][0]:.4f})')
 
+class Checkpoint:
+    """Append-only list of finished item names, so an interrupted scan can resume"""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.done = {line.rstrip('\n') for line in f if line.strip()}
+        self._f = open(path, 'a')
+
+    def add(self, name):
+        self._f.write(name + '\n')
+        self._f.flush()
+        self.done.add(name)
+
+    def close(self):
+        self._f.close()
+
+def scan(args):
+    """Analyze every file under a directory / in a manifest with the backend detectors"""
+    sys.path.insert(0, BACKEND_DIR)
+    from bulk import iter_path_items, scan as bulk_scan
+    from model_workers import start_model_workers, stop_model_workers
+
+    checkpoint = Checkpoint(args.checkpoint or args.output + '.checkpoint')
+    if checkpoint.done:
+        print(f'Resuming: {len(checkpoint.done)} items already done', file=sys.stderr)
+    items = (item for item in iter_path_items(args.target) if item[0] not in checkpoint.done)
+
+    history_col = None
+    if args.user_email:
+        from database import get_db
+        history_col = get_db()['history']
+    if args.workers:
+        # Forward passes on forked worker processes (see model_workers)
+        start_model_workers(args.workers)
+
+    counts = {}
+    try:
+        with open(args.output, 'a') as out:
+            for result in bulk_scan(items, user_email=args.user_email, history_col=history_col,
+                                    audio_mode=args.audio_mode, max_in_flight=args.in_flight):
+                out.write(json.dumps(result) + '\n')
+                out.flush()
+                # Errors are retried on the next run; only finished items are checkpointed
+                key = 'error' if 'error' in result else result['label']
+                counts[key] = counts.get(key, 0) + 1
+                if 'error' not in result:
+                    checkpoint.add(result['filename'])
+                if sum(counts.values()) % 100 == 0:
+                    print(f'{sum(counts.values())} items: {counts}', file=sys.stderr)
+    finally:
+        checkpoint.close()
+        stop_model_workers()
+    print(f'Done: {counts}', file=sys.stderr)
+
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print('Usage: python detect_face_real_or_fake.py <image_path>')
+    if len(sys.argv) == 2 and sys.argv[1] not in ('scan', '-h', '--help'):
+        predict(sys.argv[1])
+        sys.exit(0)
+    parser = argparse.ArgumentParser(
+        description='Usage: python detect_face_real_or_fake.py <image_path>\n'
+                    '   or: python detect_face_real_or_fake.py scan <dir|manifest> --output results.ndjson',
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command')
+    p = sub.add_parser('scan', help='Analyze a directory or manifest (one path or {"path": ...} per line), '
+                                    'zip files included; writes NDJSON and resumes from a checkpoint')
+    p.add_argument('target')
+    p.add_argument('--output', required=True, help='NDJSON results, appended to')
+    p.add_argument('--checkpoint', help='Finished items (default: <output>.checkpoint)')
+    p.add_argument('--workers', type=int, default=0, help='Model worker processes (0 = in this process)')
+    p.add_argument('--in-flight', type=int, default=64, help='Items submitted at once across all media types')
+    p.add_argument('--user-email', help='Also save results to this user\'s history (bulk inserts)')
+    p.add_argument('--audio-mode', choices=['batch', 'stream'])
+    args = parser.parse_args()
+    if args.command != 'scan':
+        parser.print_help()
         sys.exit(1)
-    img_path = sys.argv[1]
-    predict(img_path)
+    scan(args)